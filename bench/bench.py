@@ -0,0 +1,479 @@
+"""
+SFU CMPT 756
+Benchmark of the music services, without Gatling or a cluster.
+
+Runs the read scenarios of `gatling/simulations/proj756/ReadTables.scala`
+with closed-loop simulated users, threads of this process, and reports
+the throughput, the p50/p95/p99 latency and the memory allocated per
+request of each scenario at each number of users:
+
+    RUser      GET /api/v1/user/<user_id> of s1, over the seeded users
+    RMusic     GET /api/v1/music/<Owner>/<SongTitle> of s2, a random song
+    RPlaylist  GET /api/v1/playlist/show_playlist of s3
+
+By default it starts db, s1, s2 (v1) and s3 on free localhost ports,
+through `serve.py`, with the database service keeping its tables in
+memory (`--backend`); the templates must be instantiated first.  The
+services may instead be ones already running (`--target`):
+
+    python bench.py --users 1 10 50 --output run.json
+    python bench.py --target db=http://localhost:30002 \\
+        --target s1=http://localhost:30000 --scenario RUser
+
+Each run writes its results as JSON (`--output`), and compares them
+with an earlier run's (`--baseline`), flagging the metrics that are
+worse by more than `--tolerance` percent.  Two result files can be
+compared without running anything:
+
+    python bench.py --compare before.json after.json
+
+The comparison exits with status 1 if it finds a regression.
+"""
+
+# Standard library modules
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Installed packages
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'db'))
+
+# Local modules
+import loadgen  # noqa: E402
+
+# Directory and path prefix of each service
+SERVICES = {
+    'db': ('db', '/api/v1/datastore/'),
+    's1': ('s1', '/api/v1/user/'),
+    's2': ('s2/v1', '/api/v1/music/'),
+    's3': ('s3', '/api/v1/playlist/'),
+}
+
+# Files that exist only once the templates are instantiated, which
+# also copies the modules of shared/ into the service directories
+TEMPLATE_OUTPUTS = ('db/app.py', 's2/v1/unique_code.py', 's1/datastore.py',
+                    's2/v1/datastore.py', 's3/datastore.py',
+                    'db/serialize.py', 's1/serialize.py', 's2/v1/serialize.py',
+                    's3/serialize.py')
+
+# The services check only that a request has an authorization
+AUTH = {'Authorization': 'Bearer A'}
+
+# Metrics compared between runs: name -> True if higher is better
+METRICS = {
+    'throughput_rps': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'alloc_peak_kib': False,
+}
+
+
+def parse_args():
+    argp = argparse.ArgumentParser(
+        'bench',
+        description='Measure the latency, throughput and allocations of '
+        'the music services'
+        )
+    argp.add_argument(
+        '--scenario',
+        nargs='+',
+        choices=sorted(SCENARIOS),
+        default=sorted(SCENARIOS),
+        help="Scenarios to run"
+        )
+    argp.add_argument(
+        '--users',
+        type=int,
+        nargs='+',
+        default=[1, 10, 50],
+        help="Numbers of concurrent users to run"
+        )
+    argp.add_argument(
+        '--duration',
+        type=float,
+        default=20,
+        help="Seconds to measure each number of users"
+        )
+    argp.add_argument(
+        '--warmup',
+        type=float,
+        default=2,
+        help="Seconds to run each number of users before measuring"
+        )
+    argp.add_argument(
+        '--pause',
+        type=float,
+        default=0,
+        help="Seconds each user waits between requests (the simulations "
+        "pause 1 s)"
+        )
+    argp.add_argument(
+        '--items',
+        type=int,
+        default=100,
+        help="Number of users, songs and playlist entries to seed"
+        )
+    argp.add_argument(
+        '--alloc-samples',
+        type=int,
+        default=50,
+        help="Sequential requests per scenario to measure allocations "
+        "with; 0 to skip"
+        )
+    argp.add_argument(
+        '--backend',
+        choices=['memory', 'sqlite', 'dynamodb'],
+        default='memory',
+        help="DB_BACKEND of the database service started for the run"
+        )
+    argp.add_argument(
+        '--target',
+        action='append',
+        default=[],
+        help="NAME=URL of a running service (db, s1, s2 or s3) to use "
+        "instead of starting them all; may be repeated, and must include db"
+        )
+    argp.add_argument(
+        '--output',
+        help="File to write the results to, as JSON"
+        )
+    argp.add_argument(
+        '--baseline',
+        help="Results of an earlier run to compare this run's with"
+        )
+    argp.add_argument(
+        '--tolerance',
+        type=float,
+        default=10,
+        help="Percentage by which a metric may worsen before it is "
+        "reported as a regression"
+        )
+    argp.add_argument(
+        '--compare',
+        nargs=2,
+        metavar=('BEFORE', 'AFTER'),
+        help="Compare two result files instead of running"
+        )
+    return argp.parse_args()
+
+
+# Services -------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_healthy(name, url, process, log, timeout=30):
+    """Wait for a started service to answer its health check."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(url + 'health', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    with open(log) as out:
+        sys.exit('Service {} did not start:\n{}'.format(
+            name, out.read()[-2000:]))
+
+
+def start_services(backend, workdir, processes):
+    """
+    Start every service on a free localhost port, adding their
+    processes to `processes`.
+
+    Returns {name: base URL}.
+    """
+    for path in TEMPLATE_OUTPUTS:
+        if not os.path.exists(os.path.join(REPO_DIR, path)):
+            sys.exit('{} is missing: instantiate the templates first '
+                     '(make -f k8s-tpl.mak templates)'.format(path))
+    env = dict(os.environ, DB_BACKEND=backend,
+               DB_PATH=os.path.join(workdir, 'datastore.sqlite3'))
+    env.setdefault('EXER', 'bench')
+    urls = {}
+    for name in ('db', 's1', 's2', 's3'):
+        directory, prefix = SERVICES[name]
+        port = free_port()
+        log = os.path.join(workdir, name + '.log')
+        with open(log, 'w') as out:
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(BENCH_DIR, 'serve.py'),
+                 os.path.join(REPO_DIR, directory), str(port)],
+                env=env, stdout=out, stderr=subprocess.STDOUT)
+        processes.append(process)
+        urls[name] = 'http://127.0.0.1:{}'.format(port)
+        wait_healthy(name, urls[name] + prefix, process, log)
+        if name == 'db':
+            env['DB_URL'] = urls['db'] + prefix.rstrip('/')
+    return urls
+
+
+def stop_services(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+# Data -----------------------------------------------------------------
+
+def seed(db_url, count):
+    """
+    Write `count` users, songs and playlist entries.
+
+    Returns {objtype: [(key, item)]}.
+    """
+    run = uuid.uuid4().hex[:8]
+    owners = ['bench-{}-{}'.format(run, i % 10) for i in range(count)]
+    items = {
+        'user': [{'fname': 'Bench', 'lname': str(i),
+                  'email': 'bench-{}-{}@example.com'.format(run, i)}
+                 for i in range(count)],
+        'music': [{'Owner': owners[i], 'SongTitle': 'song-{}'.format(i),
+                   'Artist': 'bench'} for i in range(count)],
+        'playlist': [{'Owner': owners[i], 'SongTitle': 'song-{}'.format(i),
+                      'Artist': 'bench', 'create_time': i}
+                     for i in range(count)],
+    }
+    data = {}
+    for objtype, objects in items.items():
+        response = requests.post(
+            db_url + SERVICES['db'][1] + 'batch_write',
+            json={'objtype': objtype, 'items': objects})
+        response.raise_for_status()
+        keys = [r[objtype + '_id'] for r in response.json()['results']]
+        data[objtype] = list(zip(keys, objects))
+    return data
+
+
+def unseed(db_url, data):
+    """Delete the items written by seed()."""
+    for objtype, entries in data.items():
+        requests.post(db_url + SERVICES['db'][1] + 'batch_write',
+                      json={'objtype': objtype,
+                            'deletes': [key for key, _ in entries]})
+
+
+# Scenarios ------------------------------------------------------------
+
+def ruser(data):
+    """Read the seeded users in turn, as the users.csv feeder does."""
+    users = itertools.cycle(data['user'])
+    lock = threading.Lock()
+
+    def request():
+        with lock:
+            key, _ = next(users)
+        return 's1', key
+    return request
+
+
+def rmusic(data):
+    """Read random seeded songs, as the music.csv feeder does."""
+    def request():
+        _, song = random.choice(data['music'])
+        return 's2', '{}/{}'.format(song['Owner'], song['SongTitle'])
+    return request
+
+
+def rplaylist(data):
+    """List the playlist table."""
+    def request():
+        return 's3', 'show_playlist'
+    return request
+
+
+# Name -> function of the seeded data returning a function that
+# returns the (service, path) of a scenario's next request
+SCENARIOS = {
+    'RUser': ruser,
+    'RMusic': rmusic,
+    'RPlaylist': rplaylist,
+}
+
+# The service each scenario calls
+SCENARIO_SERVICES = {
+    'RUser': 's1',
+    'RMusic': 's2',
+    'RPlaylist': 's3',
+}
+
+
+# Measurement ----------------------------------------------------------
+
+def new_user(urls, next_request):
+    """Return one user's request function for loadgen.run()."""
+    session = requests.Session()
+
+    def request():
+        service, path = next_request()
+        try:
+            response = session.get(
+                urls[service] + SERVICES[service][1] + path, headers=AUTH)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+    return request
+
+
+def allocations(urls, next_request, samples):
+    """
+    Return the KiB allocated per request (peak and retained) over
+    `samples` sequential requests, or None if the services do not
+    report them.
+
+    The medians are taken, as tracing also sees the allocations of the
+    server's other threads, such as one finishing an earlier connection.
+    """
+    if samples == 0:
+        return None
+    session = requests.Session()
+    peaks, retained = [], []
+    for _ in range(samples):
+        service, path = next_request()
+        response = session.get(
+            urls[service] + SERVICES[service][1] + path,
+            headers=dict(AUTH, **{'X-Bench-Alloc': '1'}))
+        if 'X-Alloc-Peak' not in response.headers:
+            return None
+        peaks.append(int(response.headers['X-Alloc-Peak']))
+        retained.append(int(response.headers['X-Alloc-Retained']))
+    return {'alloc_peak_kib': statistics.median(peaks) / 1024,
+            'alloc_retained_kib': statistics.median(retained) / 1024}
+
+
+def bench(args, urls):
+    """Run the scenarios; return their results."""
+    data = seed(urls['db'], args.items)
+    try:
+        results = {}
+        print('{:<10} {:>6} {:>10} {:>9} {:>9} {:>9} {:>10} {:>7}'.format(
+            'scenario', 'users', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+            'alloc KiB', 'errors'))
+        for name in args.scenario:
+            next_request = SCENARIOS[name](data)
+            runs = [loadgen.run(lambda: new_user(urls, next_request),
+                                users, args.duration, args.warmup,
+                                args.pause, percentiles=(50, 95, 99))
+                    for users in args.users]
+            alloc = allocations(urls, next_request, args.alloc_samples)
+            for stats in runs:
+                if alloc is not None:
+                    stats.update(alloc)
+                print('{:<10} {:>6} {:>10.1f} {:>9} {:>9} {:>9} {:>10} '
+                      '{:>7}'.format(
+                          name, stats['users'], stats['throughput_rps'],
+                          show(stats['p50_ms']), show(stats['p95_ms']),
+                          show(stats['p99_ms']),
+                          show(stats.get('alloc_peak_kib')),
+                          stats['errors']),
+                      flush=True)
+            results[name] = runs
+        return results
+    finally:
+        unseed(urls['db'], data)
+
+
+def show(value):
+    return '-' if value is None else '{:.2f}'.format(value)
+
+
+# Comparison -----------------------------------------------------------
+
+def compare(before, after, tolerance):
+    """
+    Print the change of each metric from run `before` to run `after`.
+
+    Returns the number of metrics worse by more than `tolerance`
+    percent.
+    """
+    regressions = 0
+    print('{:<10} {:>6} {:<15} {:>10} {:>10} {:>8}'.format(
+        'scenario', 'users', 'metric', 'before', 'after', 'change'))
+    for name, runs in after['results'].items():
+        earlier = {r['users']: r
+                   for r in before['results'].get(name, [])}
+        for stats in runs:
+            old = earlier.get(stats['users'])
+            if old is None:
+                continue
+            for metric, higher_is_better in METRICS.items():
+                if old.get(metric) is None or stats.get(metric) is None:
+                    continue
+                if old[metric] == 0:
+                    continue
+                change = 100 * (stats[metric] - old[metric]) / old[metric]
+                worse = -change if higher_is_better else change
+                flag = ''
+                if worse > tolerance:
+                    flag = '  REGRESSION'
+                    regressions += 1
+                print('{:<10} {:>6} {:<15} {:>10.2f} {:>10.2f} {:>+7.1f}%{}'
+                      .format(name, stats['users'], metric, old[metric],
+                              stats[metric], change, flag))
+    return regressions
+
+
+def load(path):
+    with open(path) as results:
+        return json.load(results)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.compare is not None:
+        before, after = (load(path) for path in args.compare)
+        sys.exit(1 if compare(before, after, args.tolerance) else 0)
+
+    processes = []
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        try:
+            if args.target:
+                urls = dict(t.split('=', 1) for t in args.target)
+                needed = {'db'} | {SCENARIO_SERVICES[s]
+                                   for s in args.scenario}
+                if not needed <= set(urls):
+                    sys.exit('--target must include ' + ', '.join(
+                        sorted(needed - set(urls))))
+            else:
+                urls = start_services(args.backend, workdir, processes)
+            results = bench(args, urls)
+        finally:
+            stop_services(processes)
+
+    report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'backend': None if args.target else args.backend,
+                       'duration_sec': args.duration,
+                       'pause_sec': args.pause,
+                       'items': args.items},
+              'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+    if args.baseline is not None:
+        print()
+        sys.exit(1 if compare(load(args.baseline), report, args.tolerance)
+                 else 0)
@@ -0,0 +1,126 @@
+"""
+SFU CMPT 756
+Microbenchmark of the JSON encoding of datastore responses.
+
+Times, per item, the encoding and decoding of query responses of
+`--sizes` music items, shaped as boto3 returns them (`create_time` a
+Decimal, with the ResponseMetadata of the call):
+
+    simplejson  simplejson.dumps() as Flask's jsonify() calls it, and
+                simplejson.loads() as requests' Response.json() does
+    serialize   serialize.dumps(compact=True) and serialize.loads() of
+                shared/serialize.py, which the services now use
+
+    python serialize_bench.py --sizes 10 1000 100000
+
+Each figure is the best of `--repeat` timings, each of enough calls
+to take at least 0.2 s.
+"""
+
+# Standard library modules
+import argparse
+import decimal
+import os
+import sys
+import timeit
+import uuid
+
+# Installed packages
+import simplejson
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'shared'))
+
+# Local modules
+import serialize  # noqa: E402
+
+# Encoder name -> (encode, decode)
+CODECS = {
+    'simplejson': (
+        lambda obj: simplejson.dumps(
+            obj, separators=(',', ':'), sort_keys=True),
+        simplejson.loads),
+    'serialize': (
+        lambda obj: serialize.dumps(obj, compact=True),
+        serialize.loads),
+}
+
+
+def parse_args():
+    argp = argparse.ArgumentParser(
+        'serialize_bench',
+        description='Time the JSON encoding of datastore responses'
+        )
+    argp.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=[10, 1000, 100000],
+        help="Numbers of items in a response (default: 10 1000 100000)"
+        )
+    argp.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help="Timings of each figure, of which the best is kept (default: 5)"
+        )
+    return argp.parse_args()
+
+
+def response(count):
+    """Return a boto3-shaped query response of `count` music items."""
+    items = [{'music_id': str(uuid.uuid4()),
+              'Artist': 'Artist {}'.format(i % 97),
+              'SongTitle': 'Song title {}'.format(i),
+              'Owner': 'Bearer {}'.format(i % 13),
+              'create_time': decimal.Decimal(1600000000 + i)}
+             for i in range(count)]
+    return {'Items': items,
+            'Count': count,
+            'ScannedCount': count,
+            'ResponseMetadata': {
+                'RequestId': 'Q' * 52,
+                'HTTPStatusCode': 200,
+                'HTTPHeaders': {
+                    'server': 'Server',
+                    'date': 'Thu, 01 Apr 2021 00:00:00 GMT',
+                    'content-type': 'application/x-amz-json-1.0',
+                    'content-length': '1000',
+                    'connection': 'keep-alive',
+                    'x-amzn-requestid': 'Q' * 52,
+                    'x-amz-crc32': '1234567890'},
+                'RetryAttempts': 0}}
+
+
+def best_time(call, repeat):
+    """Return the least time, in seconds, of one call of `call`."""
+    timer = timeit.Timer(call)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main():
+    args = parse_args()
+    print('{:>8} {:<11} {:>10} {:>10} {:>10} {:>8}'.format(
+        'items', 'codec', 'encode_us', 'decode_us', 'bytes', 'speedup'))
+    for count in args.sizes:
+        data = response(count)
+        baseline = None
+        for name, (encode, decode) in CODECS.items():
+            body = encode(data)
+            encode_sec = best_time(lambda: encode(data), args.repeat)
+            decode_sec = best_time(lambda: decode(body), args.repeat)
+            total = encode_sec + decode_sec
+            if baseline is None:
+                baseline = total
+            # Times and sizes are per item
+            print('{:>8} {:<11} {:>10.3f} {:>10.3f} {:>10.1f} {:>7.1f}x'
+                  .format(count, name,
+                          encode_sec * 1e6 / count,
+                          decode_sec * 1e6 / count,
+                          len(body) / count,
+                          baseline / total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+SFU CMPT 756
+Serve one service for bench.py, reporting what its requests allocate.
+
+    python serve.py SERVICE_DIR PORT
+
+imports `SERVICE_DIR/app.py` and serves it on localhost as `python
+app.py PORT` does, with Flask's threaded server.  A request carrying the
+header `X-Bench-Alloc: 1` is served with tracemalloc tracing, and its
+response has two more headers:
+
+X-Alloc-Peak
+    The most memory, in bytes, held at once by the blocks allocated
+    while serving the request.
+X-Alloc-Retained
+    The memory, in bytes, those blocks still held when the response
+    started.
+
+Tracing slows the service several times over, so bench.py sends the
+header only in a sampling phase of sequential requests, after it has
+measured latency and throughput.
+"""
+
+# Standard library modules
+import importlib
+import os
+import sys
+import tracemalloc
+
+
+class AllocationMeter():
+    """WSGI middleware that traces the allocations of marked requests."""
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if environ.get('HTTP_X_BENCH_ALLOC') != '1':
+            return self.app(environ, start_response)
+
+        def measured_start_response(status, headers, exc_info=None):
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            headers = headers + [('X-Alloc-Peak', str(peak)),
+                                 ('X-Alloc-Retained', str(retained))]
+            return start_response(status, headers, exc_info)
+
+        tracemalloc.start()
+        try:
+            return self.app(environ, measured_start_response)
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: serve.py SERVICE_DIR PORT')
+    service_dir, port = os.path.abspath(sys.argv[1]), int(sys.argv[2])
+    # Run as the service's container does, from its own directory
+    os.chdir(service_dir)
+    sys.path.insert(0, service_dir)
+    service = importlib.import_module('app')
+    service.app.wsgi_app = AllocationMeter(service.app.wsgi_app)
+    service.app.run(host='127.0.0.1', port=port, threaded=True)
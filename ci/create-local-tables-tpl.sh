@@ -21,3 +21,20 @@ aws dynamodb create-table \
   --key-schema '[{ "AttributeName": "user_id", "KeyType": "HASH" }]' \
   --provisioned-throughput '{"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}'
 
+aws dynamodb create-table \
+  --endpoint-url http://0.0.0.0:8000 \
+  --region us-west-2 \
+  --table-name Playlist-ZZ-REG-ID \
+  --attribute-definitions '[{ "AttributeName": "playlist_id", "AttributeType": "S" }, { "AttributeName": "Owner", "AttributeType": "S" }, { "AttributeName": "SongTitle", "AttributeType": "S" }, { "AttributeName": "create_time", "AttributeType": "N" }]' \
+  --key-schema '[{ "AttributeName": "playlist_id", "KeyType": "HASH" }]' \
+  --global-secondary-indexes '[{ "IndexName": "Owner-SongTitle-index", "KeySchema": [{ "AttributeName": "Owner", "KeyType": "HASH" }, { "AttributeName": "SongTitle", "KeyType": "RANGE" }], "Projection": { "ProjectionType": "ALL" }, "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5} }, { "IndexName": "Owner-create_time-index", "KeySchema": [{ "AttributeName": "Owner", "KeyType": "HASH" }, { "AttributeName": "create_time", "KeyType": "RANGE" }], "Projection": { "ProjectionType": "ALL" }, "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5} }]' \
+  --provisioned-throughput '{"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}'
+# The playlist service writes its play counts to History
+aws dynamodb create-table \
+  --endpoint-url http://0.0.0.0:8000 \
+  --region us-west-2 \
+  --table-name History-ZZ-REG-ID \
+  --attribute-definitions '[{ "AttributeName": "history_id", "AttributeType": "S" }, { "AttributeName": "Owner", "AttributeType": "S" }, { "AttributeName": "SongTitle", "AttributeType": "S" }]' \
+  --key-schema '[{ "AttributeName": "history_id", "KeyType": "HASH" }]' \
+  --global-secondary-indexes '[{ "IndexName": "Owner-SongTitle-index", "KeySchema": [{ "AttributeName": "Owner", "KeyType": "HASH" }, { "AttributeName": "SongTitle", "KeyType": "RANGE" }], "Projection": { "ProjectionType": "ALL" }, "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5} }]' \
+  --provisioned-throughput '{"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}'
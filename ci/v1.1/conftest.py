@@ -2,7 +2,7 @@
 Configure for pytest.
 
 Parses the command-line arguments, reads the environment variables,
-and then creates the two DynamoDB tables before executing the tests.
+and then creates the DynamoDB tables before executing the tests.
 
 The tests all assume that these tables have already been created.
 
@@ -160,7 +160,9 @@ def setup(args):
         args.access_key_id,
         args.secret_access_key,
         'Music-' + args.table_suffix,
-        'User-' + args.table_suffix
+        'User-' + args.table_suffix,
+        'Playlist-' + args.table_suffix,
+        'History-' + args.table_suffix
     )
 
 
@@ -168,7 +170,7 @@ def pytest_configure(config):
     """Configure the environment for the test suite.
 
     Parses the command line arguments, reads the environment variables,
-    and creates the two DyndamoDB tables.
+    and creates the DyndamoDB tables.
     """
     get_env_vars(config.option)
     setup(config.option)
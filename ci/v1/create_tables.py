@@ -1,5 +1,5 @@
 """
-Create the Music and User tables
+Create the Music, User, Playlist and History tables
 
 This is intended to be used within a continuous integration test.
 As such, it presumes that it is creating the tables in a local
@@ -17,9 +17,36 @@ import boto3
 # Local modules
 
 
+# Global secondary indexes of the Playlist and History tables, as
+# provisioned in `cluster/cloudformationdynamodb-tpl.json`
+OWNER_TITLE_INDEX = 'Owner-SongTitle-index'
+OWNER_TIME_INDEX = 'Owner-create_time-index'
+
+
 # Function definitions
-def create_tables(url, region, access_key_id, secret_access_key, music, user):
-    """ Create the music and user tables in DynamoDB.
+def owner_index(name, sort_key):
+    """ Return the definition of a global secondary index on Owner.
+
+    Parameters
+    ----------
+    name: string
+        Name of the index.
+    sort_key: string
+        The attribute sorting each owner's items in the index.
+    """
+    return {
+        "IndexName": name,
+        "KeySchema": [{"AttributeName": "Owner", "KeyType": "HASH"},
+                      {"AttributeName": sort_key, "KeyType": "RANGE"}],
+        "Projection": {"ProjectionType": "ALL"},
+        "ProvisionedThroughput": {
+            "ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+    }
+
+
+def create_tables(url, region, access_key_id, secret_access_key, music, user,
+                  playlist, history):
+    """ Create the music, user, playlist and history tables in DynamoDB.
 
     Parameters
     ----------
@@ -43,6 +70,11 @@ def create_tables(url, region, access_key_id, secret_access_key, music, user):
         Name of the music table.
     user: string
         Name of the user table.
+    playlist: string
+        Name of the playlist table.
+    history: string
+        Name of the history table, to which the playlist service
+        writes its play counts.
     """
     dynamodb = boto3.resource(
         'dynamodb',
@@ -72,9 +104,36 @@ def create_tables(url, region, access_key_id, secret_access_key, music, user):
         ProvisionedThroughput={
             "ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
     )
+    pt = dynamodb.create_table(
+        TableName=playlist,
+        AttributeDefinitions=[
+            {"AttributeName": "playlist_id", "AttributeType": "S"},
+            {"AttributeName": "Owner", "AttributeType": "S"},
+            {"AttributeName": "SongTitle", "AttributeType": "S"},
+            {"AttributeName": "create_time", "AttributeType": "N"}],
+        KeySchema=[{"AttributeName": "playlist_id", "KeyType": "HASH"}],
+        GlobalSecondaryIndexes=[
+            owner_index(OWNER_TITLE_INDEX, "SongTitle"),
+            owner_index(OWNER_TIME_INDEX, "create_time")],
+        ProvisionedThroughput={
+            "ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+    )
+    ht = dynamodb.create_table(
+        TableName=history,
+        AttributeDefinitions=[
+            {"AttributeName": "history_id", "AttributeType": "S"},
+            {"AttributeName": "Owner", "AttributeType": "S"},
+            {"AttributeName": "SongTitle", "AttributeType": "S"}],
+        KeySchema=[{"AttributeName": "history_id", "KeyType": "HASH"}],
+        GlobalSecondaryIndexes=[owner_index(OWNER_TITLE_INDEX, "SongTitle")],
+        ProvisionedThroughput={
+            "ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+    )
     """
     The order in which we wait for the tables is irrelevant.  We can only
-    proceed after both exist.
+    proceed after all exist.
     """
     mt.wait_until_exists()
     ut.wait_until_exists()
+    pt.wait_until_exists()
+    ht.wait_until_exists()
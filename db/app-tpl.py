@@ -4,33 +4,49 @@ Sample application---database service.
 """
 
 # Standard library modules
-import base64
+import collections
+import concurrent.futures
+import contextlib
 import logging
 import os
+import queue
 import sys
+import threading
+import time
 import urllib.parse
 import uuid
 
 # Installed packages
 
 import boto3
-from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
 
 from flask import Blueprint
 from flask import Flask
 from flask import request
 from flask import Response
+from flask import stream_with_context
 
-from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_client import Counter
+from prometheus_client import Histogram
 
 import simplejson as json
 
+# Local modules
+import common
+from common import BATCH_READ_SIZE, BATCH_RETRIES, BATCH_WRITE_SIZE
+from common import BATCH_UPDATE_CONCURRENCY
+from common import IMPORT_CONCURRENCY, IMPORT_PROGRESS_ITEMS
+from common import SCAN_CONCURRENCY, SCAN_QUEUE_PAGES
+import monitoring
+import serialize
+from backends import memory, sqlite
+
 # The application
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
-metrics.info('app_info', 'Database process')
+metrics = monitoring.create_metrics(app, 'Database process')
 
 bp = Blueprint('app', __name__)
 
@@ -48,7 +64,29 @@ loader_token = os.getenv('SVC_LOADER_TOKEN')
 # In some testing contexts, we pass in the DynamoDB URL
 dynamodb_url = os.getenv('DYNAMODB_URL', '')
 
-if dynamodb_url == '':
+# Storage: DynamoDB (the default), `memory`, tables held in this
+# process, or `sqlite`, tables in the SQLite file at DB_PATH (see
+# backends/), for tests and benchmarks without DynamoDB
+db_backend = os.getenv('DB_BACKEND', 'dynamodb')
+if db_backend not in ('dynamodb', 'memory', 'sqlite'):
+    logging.error("Unknown DB_BACKEND: {}".format(db_backend))
+    sys.exit(-1)
+db_path = os.getenv('DB_PATH', '/tmp/datastore.sqlite3')
+
+# Segments of a parallel scan of a whole table; 1 scans it in one piece
+scan_segment_count = int(
+    os.getenv('DB_SCAN_SEGMENTS', str(common.SCAN_SEGMENTS)))
+
+# Responses leave out DynamoDB's ResponseMetadata unless this is "false"
+compact_json = os.getenv('DB_COMPACT_JSON', 'true') != 'false'
+
+if db_backend == 'memory':
+    dynamodb = memory.Resource(
+        common.TABLE_INDEXES, common.INDEX_KEYS, common.ATTRIBUTE_TYPES)
+elif db_backend == 'sqlite':
+    dynamodb = sqlite.Resource(db_path, common.TABLE_INDEXES,
+                               common.INDEX_KEYS, common.ATTRIBUTE_TYPES)
+elif dynamodb_url == '':
     dynamodb = boto3.resource(
         'dynamodb',
         region_name=region,
@@ -64,6 +102,377 @@ else:
         aws_access_key_id=access_key,
         aws_secret_access_key=secret_access_key)
 
+# Index names of each table, keyed by table name, filled on first use
+table_indexes = {}
+
+# Threads making the UpdateItem calls of `/batch_update`s.  They start
+# on first use, so each Gunicorn worker has its own.
+update_pool = concurrent.futures.ThreadPoolExecutor(BATCH_UPDATE_CONCURRENCY)
+
+# Threads scanning the segments of the one-page parallel scans of
+# parallel_scan(), started on first use; streamed scans have their own
+scan_pool = concurrent.futures.ThreadPoolExecutor(SCAN_CONCURRENCY)
+
+# Throughput of parallel scans: rate() of the items and read units,
+# and the latency of each segment's pages
+scan_items = Counter(
+    'datastore_scan_items',
+    'Items read by parallel scans',
+    ['table'],
+    registry=metrics.registry)
+scan_read_units = Counter(
+    'datastore_scan_read_units',
+    'Read capacity units consumed by parallel scans',
+    ['table'],
+    registry=metrics.registry)
+scan_page_seconds = Histogram(
+    'datastore_scan_page_seconds',
+    'Latency of reading one page of one segment of a parallel scan',
+    ['table'],
+    registry=metrics.registry)
+
+# Threads making the BatchWriteItem calls of `/import`s
+import_pool = concurrent.futures.ThreadPoolExecutor(IMPORT_CONCURRENCY)
+
+# Items of `/import`s written ("ok") and not written ("unprocessed")
+import_counts = Counter(
+    'datastore_import_items',
+    'Items written by imports',
+    ['table', 'status'],
+    registry=metrics.registry)
+
+
+def indexes(table):
+    '''Return the names of the global secondary indexes of `table`
+
+    Tables created without the indexes (older stacks, local test
+    tables) make the callers fall back to a scan.
+    '''
+    if table.name not in table_indexes:
+        try:
+            gsis = table.global_secondary_indexes or []
+        except ClientError:
+            return set()
+        table_indexes[table.name] = {g['IndexName'] for g in gsis}
+    return table_indexes[table.name]
+
+
+def adjacent_item(table, owner, create_time, forward, limit=1, fields=None):
+    '''
+    Return the owner's item created next after `create_time`
+
+    If `forward` is False, return the one created last before it
+    instead.  The response has the shape of a query with at most
+    `limit` items in `Items`, holding only the attributes in `fields`
+    if given.
+    '''
+    op, kwargs = common.adjacent_request(
+        owner, create_time, forward, indexes(table), limit, fields)
+    if op == 'query':
+        return table.query(**kwargs)
+    return common.nearest_item(table.scan(**kwargs), forward, limit,
+                               fields)
+
+
+def adjacent_args(args):
+    '''
+    Return (owner, create_time, limit, fields) of a `/next` or `/prev`
+
+    Raises TypeError if one is missing, ValueError if one is malformed.
+    '''
+    if not args.get('owner') or args.get('create_time') is None:
+        raise TypeError('owner and create_time are required')
+    owner = urllib.parse.unquote_plus(args.get('owner'))
+    create_time = int(urllib.parse.unquote_plus(args.get('create_time')))
+    limit = common.limit_arg(args)
+    return (owner, create_time, 1 if limit is None else limit,
+            common.fields_arg(args))
+
+
+def playlist_cursor(table, table_id, owner, args):
+    '''
+    Return the `/cursor` response for `owner`'s tracks in `table`
+
+    Raises ValueError if `owner` is empty or `args` are malformed.
+    '''
+    forward, create_time, start_key = common.cursor_args(args, owner)
+    wrap = args.get('wrap', 'true') != 'false'
+    index = indexes(table)
+    op, kwargs = common.cursor_request(
+        owner, forward, index, create_time, start_key)
+    if op == 'scan':
+        items = table.scan(**kwargs)['Items']
+        item = common.cursor_pick(
+            items, table_id, forward, create_time, start_key)
+        wrapped = item is None and wrap
+        if wrapped:
+            item = common.cursor_pick(items, table_id, forward)
+        return common.cursor_response(item, table_id, wrapped)
+
+    items = table.query(**kwargs)['Items']
+    positioned = create_time is not None or start_key is not None
+    wrapped = len(items) == 0 and wrap and positioned
+    if wrapped:
+        op, kwargs = common.cursor_request(owner, forward, index)
+        items = table.query(**kwargs)['Items']
+    return common.cursor_response(
+        items[0] if items else None, table_id, wrapped)
+
+
+def stream_items(op, kwargs):
+    '''
+    Generate the items of every page of a scan or query as NDJSON
+
+    Only one page (at most `Limit` items, or 1 MB) is held in
+    memory at a time.
+    '''
+    kwargs = dict(kwargs)
+    while True:
+        page = op(**kwargs)
+        for item in page['Items']:
+            yield serialize.dumps(item) + b'\n'
+        if 'LastEvaluatedKey' not in page:
+            break
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def all_items(op, kwargs):
+    '''Return the items of every page of a scan or query'''
+    kwargs = dict(kwargs)
+    items = []
+    while True:
+        page = op(**kwargs)
+        items.extend(page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return items
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def json_response(obj, status=200):
+    '''Return a response carrying `obj`, encoded by serialize.dumps()'''
+    return Response(
+        serialize.dumps(obj, compact=compact_json),
+        status=status,
+        mimetype='application/json')
+
+
+def scan_segment(table, kwargs):
+    '''Scan one page of one segment, recording its throughput'''
+    start = time.perf_counter()
+    page = table.scan(**kwargs)
+    scan_page_seconds.labels(table.name).observe(time.perf_counter() - start)
+    scan_items.labels(table.name).inc(len(page['Items']))
+    scan_read_units.labels(table.name).inc(common.consumed_units(page))
+    return page
+
+
+def parallel_scan(table, kwargs, starts, total):
+    '''
+    Return one page of a parallel scan, from the segments in `starts`
+
+    The segments are scanned at once, a page each, on `scan_pool`,
+    sharing `kwargs`' `Limit` between them; see
+    common.merge_segment_pages().
+    '''
+    limit = common.segment_limit(kwargs.get('Limit'), len(starts))
+    futures = {
+        segment: scan_pool.submit(
+            scan_segment,
+            table,
+            common.segment_request(kwargs, segment, total, start, limit))
+        for segment, start in starts.items()}
+    return common.merge_segment_pages(
+        {segment: f.result() for segment, f in futures.items()}, total)
+
+
+def segment_pages(table, kwargs, starts, total):
+    '''
+    Generate (segment, page) for every page of a parallel scan
+
+    Each segment is scanned page after page, up to SCAN_CONCURRENCY
+    at a time, and its pages are generated as they arrive, so those of
+    different segments interleave.  At most SCAN_QUEUE_PAGES pages
+    wait; the scans pause while the consumer catches up, and stop when
+    it closes the generator, as the server does when the client goes
+    away.
+
+    The scans run on threads of this generator's own, not on
+    `scan_pool`: a slow client holds them while its pages wait, and
+    would otherwise leave parallel_scan() none.
+    '''
+    pages = queue.Queue(SCAN_QUEUE_PAGES)
+    stop = threading.Event()
+
+    def offer(entry):
+        while not stop.is_set():
+            try:
+                pages.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def scan(segment, start):
+        try:
+            while not stop.is_set():
+                page = scan_segment(table, common.segment_request(
+                    kwargs, segment, total, start))
+                offer((segment, page))
+                start = page.get('LastEvaluatedKey')
+                if start is None:
+                    break
+        except Exception as e:
+            offer(e)
+        finally:
+            offer(None)
+
+    workers = concurrent.futures.ThreadPoolExecutor(
+        max(1, min(len(starts), SCAN_CONCURRENCY)),
+        thread_name_prefix='stream-scan')
+    for segment, start in starts.items():
+        workers.submit(scan, segment, start)
+    try:
+        running = len(starts)
+        while running > 0:
+            entry = pages.get()
+            if entry is None:
+                running -= 1
+            elif isinstance(entry, Exception):
+                raise entry
+            else:
+                yield entry
+    finally:
+        # The scans see `stop` within a page; segments not yet begun
+        # return at once
+        stop.set()
+        workers.shutdown(wait=False)
+
+
+def stream_segments(table, kwargs, starts, total):
+    '''
+    Generate the items of every page of a parallel scan as NDJSON
+
+    The pages are sent as they arrive (see segment_pages()), so the
+    order of the items is that of no one segment.  The scans stop if
+    the client goes away.
+    '''
+    with contextlib.closing(
+            segment_pages(table, kwargs, starts, total)) as pages:
+        for _, page in pages:
+            if page['Items']:
+                yield b''.join(serialize.dumps(item) + b'\n'
+                               for item in page['Items'])
+
+
+def export_items(table, starts, total, limit):
+    '''
+    Generate the NDJSON lines of an `/export`: the items of a parallel
+    scan, each page followed by a checkpoint line
+
+    See common.export_checkpoint().  Pages arrive as for
+    stream_segments(), but those of one segment in order, so the
+    checkpoint after a page resumes after every item sent before it.
+    '''
+    kwargs = {} if limit is None else {'Limit': limit}
+    remaining = dict(starts)
+    exported = 0
+    with contextlib.closing(
+            segment_pages(table, kwargs, starts, total)) as pages:
+        for segment, page in pages:
+            exported += len(page['Items'])
+            if 'LastEvaluatedKey' in page:
+                remaining[segment] = page['LastEvaluatedKey']
+            else:
+                del remaining[segment]
+            checkpoint = common.export_checkpoint(remaining, total, exported)
+            yield b''.join(serialize.dumps(item) + b'\n'
+                           for item in page['Items'] + [checkpoint])
+
+
+def import_items(table_name, lines, skip):
+    '''
+    Write the items of the NDJSON `lines` of an `/import` to
+    `table_name`, generating its progress lines
+
+    The first `skip` items are passed over.  The rest are written in
+    batches of BATCH_WRITE_SIZE on `import_pool`, at most
+    IMPORT_CONCURRENCY batches at once; no more of `lines` is read
+    until the oldest batch is written, so a fast client waits on
+    DynamoDB rather than filling memory.  A progress line (see
+    common.import_progress()) follows every IMPORT_PROGRESS_ITEMS
+    items, and ends the stream with `done` true, or with `error` if a
+    line or a batch is rejected.
+    '''
+    progress = common.import_progress(skip)
+    pending = collections.deque()
+
+    def settle():
+        start, end, future = pending.popleft()
+        try:
+            unprocessed = len(future.result())
+        except ClientError as e:
+            unprocessed = end - start
+            progress.setdefault('error', e.response['Error']['Message'])
+        except Exception as e:
+            logging.exception('Import batch failed')
+            unprocessed = end - start
+            progress.setdefault('error', 'Write failed: {}'.format(e))
+        common.import_settled(progress, start, end, unprocessed)
+        import_counts.labels(table_name, 'ok').inc(
+            end - start - unprocessed)
+        import_counts.labels(table_name, 'unprocessed').inc(unprocessed)
+
+    count = 0
+    writes = []
+    reported = 0
+    try:
+        for number, line in enumerate(lines, 1):
+            try:
+                item = common.import_item(line)
+            except ValueError:
+                progress['error'] = 'Line {} is not a JSON object'.format(
+                    number)
+                break
+            if item is None:
+                continue
+            count += 1
+            if count <= skip:
+                continue
+            writes.append({'PutRequest': {'Item': item}})
+            if len(writes) < BATCH_WRITE_SIZE:
+                continue
+            if len(pending) == IMPORT_CONCURRENCY:
+                settle()
+            pending.append((count - len(writes), count,
+                            import_pool.submit(batch_put, table_name, writes)))
+            writes = []
+            if 'error' in progress:
+                break
+            if count - reported >= IMPORT_PROGRESS_ITEMS:
+                reported = count
+                yield serialize.dumps(progress) + b'\n'
+    except Exception as e:
+        # The body could not be read; write what was, and say where to
+        # resume
+        logging.exception('Import read failed')
+        progress.setdefault('error', 'Read failed: {}'.format(e))
+    if writes:
+        pending.append((count - len(writes), count,
+                        import_pool.submit(batch_put, table_name, writes)))
+    while pending:
+        settle()
+    progress['done'] = 'error' not in progress
+    yield serialize.dumps(progress) + b'\n'
+
+
+def bad_request(reason):
+    '''Return a 400 response carrying `reason`'''
+    return json_response({"http_status_code": 400, "reason": reason}, 400)
+
+
+def conflict(reason):
+    '''Return a 409 response carrying `reason`'''
+    return json_response({"http_status_code": 409, "reason": reason}, 409)
+
 
 # Change the implementation of this: you should probably have a separate
 # driver class for interfacing with a db like dynamodb in a different file.
@@ -71,24 +480,28 @@ else:
 def update():
     headers = request.headers  # noqa: F841
     # check header here
-    content = request.get_json()
+    content = request.get_json() or {}
     objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
     objkey = urllib.parse.unquote_plus(request.args.get('objkey'))
     table_name = objtype.capitalize()+"-ZZ-REG-ID"
     table_id = objtype + "_id"
     table = dynamodb.Table(table_name)
-    expression = 'SET '
-    x = 1
-    attrvals = {}
-    for k in content.keys():
-        expression += k + ' = :val' + str(x) + ', '
-        attrvals[':val' + str(x)] = content[k]
-        x += 1
-    expression = expression[:-2]
-    response = table.update_item(Key={table_id: objkey},
-                                 UpdateExpression=expression,
-                                 ExpressionAttributeValues=attrvals)
-    return response
+    try:
+        add, version, return_values = common.update_args(request.args)
+        kwargs = common.update_request(
+            table_id, objkey, content, add, version, return_values)
+    except ValueError as e:
+        return bad_request(str(e))
+    try:
+        response = table.update_item(**kwargs)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'ConditionalCheckFailedException':
+            return conflict("Item is not at version {}".format(version))
+        if code == 'ValidationException':
+            return bad_request(e.response['Error']['Message'])
+        raise
+    return json_response(response)
 
 
 @bp.route('/read_music', methods=['GET'])
@@ -111,29 +524,50 @@ def read_new():
     else:
         artist = ""
 
+    try:
+        paging = common.page_args(request.args)
+        fields = common.fields_arg(request.args)
+        sort = common.sort_arg(request.args)
+    except ValueError:
+        return bad_request("Invalid limit, next_token, fields or sort")
+
     table_name = objtype.capitalize()+"-ZZ-REG-ID"
-    table_id = objtype + "_id"
     table = dynamodb.Table(table_name)
-    if objkey or objkey != "":
-        if (owner or owner != "") and (artist or artist != ""):
-            response = table.scan(
-                    FilterExpression=Attr('SongTitle').eq(objkey) & Attr('Owner').eq(owner) & Attr('Artist').eq(artist)
-                )
-        elif (owner or owner != ""):
-            response = table.scan(
-                    FilterExpression=Attr('SongTitle').eq(objkey) & Attr('Owner').eq(owner)
-                )
+    op_name, kwargs, full_table = common.read_music_request(
+        objkey, owner, artist, indexes(table))
+    op = getattr(table, op_name)
+    kwargs.update(paging)
+    kwargs.update(common.projection(fields))
+    # Only a query has an order, that of the index's sort key
+    if op_name == 'query' and sort is not None:
+        kwargs['ScanIndexForward'] = sort
+    segments = None
+    if full_table:
+        try:
+            segments = common.scan_segments(
+                kwargs.get('ExclusiveStartKey'), scan_segment_count)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return bad_request("Invalid next_token")
+    if segments is not None:
+        kwargs.pop('ExclusiveStartKey', None)
+
+    if request.args.get('format') == 'ndjson':
+        if segments is not None:
+            return Response(stream_segments(table, kwargs, *segments),
+                            mimetype='application/x-ndjson')
+        return Response(stream_items(op, kwargs),
+                        mimetype='application/x-ndjson')
+    if segments is not None:
+        response = parallel_scan(table, kwargs, *segments)
     else:
-        if owner or owner != "":
-            response = table.scan(
-                    FilterExpression=Attr('Owner').eq(owner)
-                )
-        else:
-            attrs = table.attribute_definitions
-            # print(attrs)
-            response = table.scan()
-            response['attrib'] = attrs
-    return response
+        response = op(**kwargs)
+    if full_table:
+        response['attrib'] = table.attribute_definitions
+    if 'LastEvaluatedKey' in response:
+        response['next_token'] = common.encode_token(
+            response['LastEvaluatedKey'])
+    return json_response(response)
+
 
 @bp.route('/read', methods=['GET'])
 def read():
@@ -141,45 +575,67 @@ def read():
     # check header here
     objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
     objkey = urllib.parse.unquote_plus(request.args.get('objkey'))
+    try:
+        limit = common.limit_arg(request.args)
+        fields = common.fields_arg(request.args)
+    except ValueError:
+        return bad_request("Invalid limit or fields")
     table_name = objtype.capitalize()+"-ZZ-REG-ID"
     table_id = objtype + "_id"
     table = dynamodb.Table(table_name)
-    response = table.query(Select='ALL_ATTRIBUTES',
-                           KeyConditionExpression=Key(table_id).eq(objkey))
-    return response
+    response = table.query(
+        **common.read_request(table_id, objkey, limit, fields))
+    return json_response(response)
 
 @bp.route('/next', methods=['GET'])
 def next():
     # payload = {"objtype": "Playlist", "owner": headers['Authorization']}
     objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
-    owner = urllib.parse.unquote_plus(request.args.get('owner'))
-    create_time = int(urllib.parse.unquote_plus(request.args.get('create_time')))
+    try:
+        owner, create_time, limit, fields = adjacent_args(request.args)
+    except (TypeError, ValueError):
+        return bad_request("Invalid owner, create_time, limit or fields")
     table_name = objtype.capitalize()+"-ZZ-REG-ID"
     table = dynamodb.Table(table_name)
-    response = table.scan(
-                        # KeyConditionExpression=Key("create_time").gt(create_time),
-                        # Limit=1,
-                        FilterExpression=Attr('Owner').eq(owner) & Attr("create_time").gt(create_time)
-                    )   
-    response["test_create_time"] = create_time
-    response["test_create_time_type"] = str(type(create_time))
-    return response
+    return json_response(
+        adjacent_item(table, owner, create_time, True, limit, fields))
+
 
 @bp.route('/prev', methods=['GET'])
 def prev():
     objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
-    owner = urllib.parse.unquote_plus(request.args.get('owner'))
-    create_time = int(urllib.parse.unquote_plus(request.args.get('create_time')))
+    try:
+        owner, create_time, limit, fields = adjacent_args(request.args)
+    except (TypeError, ValueError):
+        return bad_request("Invalid owner, create_time, limit or fields")
     table_name = objtype.capitalize()+"-ZZ-REG-ID"
     table = dynamodb.Table(table_name)
-    response = table.scan(
-                        # KeyConditionExpression=Key("create_time").lt(create_time),
-                        # Limit=1,
-                        FilterExpression=Attr('Owner').eq(owner) & Attr("create_time").lt(create_time),
-                        ScanIndexForward=False
-                    )
+    return json_response(
+        adjacent_item(table, owner, create_time, False, limit, fields))
+
+
+@bp.route('/cursor', methods=['GET'])
+def cursor():
+    '''
+    Return one track of an owner's playlist, next to a position
+
+    The query names the `owner`, the `direction` ("next" or "prev")
+    and the position, a `cursor` returned by an earlier call or a
+    `create_time`; see common.cursor_args().  Past either end the
+    call wraps around to the first (or last) track, unless
+    `wrap=false`.  The response holds at most one item, and the
+    `cursor` to pass to the following call.
+    '''
+    objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
+    owner = urllib.parse.unquote_plus(request.args.get('owner', ''))
+    table_name = objtype.capitalize()+"-ZZ-REG-ID"
+    table = dynamodb.Table(table_name)
+    try:
+        return json_response(
+            playlist_cursor(table, objtype + "_id", owner, request.args))
+    except ValueError as e:
+        return bad_request(str(e))
 
-    return response
 
 @bp.route('/write', methods=['POST'])
 def write():
@@ -198,26 +654,14 @@ def write():
     returnval = ''
     if response['ResponseMetadata']['HTTPStatusCode'] != 200:
         returnval = {"message": "fail"}
-    return json.dumps(
+    return json_response(
         ({table_id: payload[table_id]}, returnval)['returnval' in globals()])
 
 
-def decode_auth_token(token):
-    '''Given an auth token in Base64 encoding, return the original string'''
-    return base64.standard_b64decode(token).decode()
-
-
 def load_auth(headers):
     '''Return True if caller authorized to do a `/load` '''
     global loader_token
-    if 'Authorization' not in headers:
-        return False
-    # Auth string is 'Basic ' concatenated with base64 encoding of uname:passwd
-    auth_string = headers['Authorization'].split()[1]
-    name, pwd = decode_auth_token(auth_string).split(':')
-    if name != 'svc-loader' or pwd != loader_token:
-        return False
-    return True
+    return common.is_loader(headers, loader_token)
 
 
 @bp.route('/load', methods=['POST'])
@@ -274,7 +718,249 @@ def delete():
     table_id = objtype + "_id"
     table = dynamodb.Table(table_name)
     response = table.delete_item(Key={table_id: objkey})
-    return response
+    return json_response(response)
+
+
+@bp.route('/delete_music', methods=['DELETE'])
+def delete_music():
+    '''
+    Delete the items of one type matching a song title, owner and artist
+
+    `objkey` (a song title), `owner` and `artist` are as for
+    read_new(), but an item must match every one given, and at least
+    one must be.  The items are found through the (Owner, SongTitle)
+    index, if the request names an owner, and deleted with
+    BatchWriteItem.  The response holds the deleted items, their
+    `Count` and the keys still `unprocessed` after BATCH_RETRIES
+    retries.
+    '''
+    headers = request.headers  # noqa: F841
+    # check header here
+    objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
+    objkey = urllib.parse.unquote_plus(request.args.get('objkey', ''))
+    owner = urllib.parse.unquote_plus(request.args.get('owner', ''))
+    artist = urllib.parse.unquote_plus(request.args.get('artist', ''))
+    table_name = objtype.capitalize()+"-ZZ-REG-ID"
+    table_id = objtype + "_id"
+    table = dynamodb.Table(table_name)
+    try:
+        op_name, kwargs = common.delete_music_request(
+            objkey, owner, artist, indexes(table))
+    except ValueError as e:
+        return bad_request(str(e))
+    items = all_items(getattr(table, op_name), kwargs)
+    unprocessed = batch_put(
+        table_name,
+        [{'DeleteRequest': {'Key': {table_id: item[table_id]}}}
+         for item in items])
+    return json_response(
+        common.delete_music_response(table_id, items, unprocessed))
+
+
+def backoff(attempt):
+    '''Sleep before retry number `attempt` (1, 2, ...) of a batch'''
+    time.sleep(common.backoff_sec(attempt))
+
+
+def batch_get(table_name, keys):
+    '''
+    Read `keys` from `table_name` with BatchGetItem
+
+    Returns (items, unprocessed), where `unprocessed` lists the keys
+    DynamoDB still had not processed after BATCH_RETRIES retries.
+    '''
+    items = []
+    unprocessed = []
+    for chunk in common.chunks(keys, BATCH_READ_SIZE):
+        pending = {table_name: {'Keys': chunk}}
+        for attempt in range(BATCH_RETRIES + 1):
+            if attempt > 0:
+                backoff(attempt)
+            response = dynamodb.batch_get_item(RequestItems=pending)
+            items.extend(response['Responses'].get(table_name, []))
+            pending = response.get('UnprocessedKeys')
+            if not pending:
+                break
+        if pending:
+            unprocessed.extend(pending[table_name]['Keys'])
+    return items, unprocessed
+
+
+def batch_put(table_name, writes):
+    '''
+    Apply `writes` (PutRequest/DeleteRequest dicts) with BatchWriteItem
+
+    Returns the write requests DynamoDB still had not processed
+    after BATCH_RETRIES retries.
+    '''
+    unprocessed = []
+    for chunk in common.chunks(writes, BATCH_WRITE_SIZE):
+        pending = {table_name: chunk}
+        for attempt in range(BATCH_RETRIES + 1):
+            if attempt > 0:
+                backoff(attempt)
+            response = dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get('UnprocessedItems')
+            if not pending:
+                break
+        if pending:
+            unprocessed.extend(pending[table_name])
+    return unprocessed
+
+
+@bp.route('/batch_read', methods=['POST'])
+def batch_read():
+    '''
+    Read many items of one type in as few DynamoDB calls as possible
+
+    The body is `{"objtype": ..., "objkeys": [...]}`.  The response
+    holds the found items plus a `results` entry per requested key,
+    with status "found", "not_found" or "unprocessed".
+    '''
+    content = request.get_json()
+    if not content or 'objtype' not in content or 'objkeys' not in content:
+        return bad_request('Missing objtype or objkeys')
+    objtype = content['objtype']
+    table_name = objtype.capitalize()+"-ZZ-REG-ID"
+    table_id = objtype + "_id"
+    # BatchGetItem rejects repeated keys
+    objkeys = list(dict.fromkeys(content['objkeys']))
+    items, unprocessed = batch_get(table_name,
+                                   [{table_id: k} for k in objkeys])
+    results = common.batch_read_results(objkeys, table_id, items, unprocessed)
+    return json_response(
+        {"Items": items, "Count": len(items), "results": results})
+
+
+@bp.route('/batch_write', methods=['POST'])
+def batch_write():
+    '''
+    Write and delete many items of one type with BatchWriteItem
+
+    The body is `{"objtype": ..., "items": [...], "deletes": [...]}`,
+    where `deletes` lists keys.  As for write(), each item is given a
+    new UUID; an item may instead carry its own `uuid`, as for
+    load(), if the caller passes load_auth().  The response has a
+    `results` entry per item and delete, in request order, with status
+    "ok" or "unprocessed".
+    '''
+    content = request.get_json()
+    if not content or 'objtype' not in content:
+        return bad_request('Missing objtype')
+    objtype = content['objtype']
+    table_name = objtype.capitalize()+"-ZZ-REG-ID"
+    table_id = objtype + "_id"
+    items = content.get('items', [])
+    if any('uuid' in item for item in items) and not load_auth(
+            request.headers):
+        return Response(
+            json.dumps({"http_status_code": 401,
+                        "reason": "Invalid authorization for uuid"}),
+            status=401,
+            mimetype='application/json')
+
+    writes, results = common.batch_write_requests(
+        table_id, items, content.get('deletes', []))
+    unprocessed = batch_put(table_name, writes)
+    return json_response(
+        common.batch_write_response(table_id, writes, results, unprocessed))
+
+
+def apply_update(table, kwargs):
+    '''Apply one update of a batch; return None or the error message'''
+    try:
+        table.update_item(**kwargs)
+    except ClientError as e:
+        return e.response['Error']['Message']
+    return None
+
+
+@bp.route('/batch_update', methods=['POST'])
+def batch_update():
+    '''
+    Apply many updates to items of one type
+
+    The body is `{"objtype": ..., "updates": [...]}`, each update
+    `{"objkey": ..., "item": {...}, "add": [...]}` as the arguments of
+    one `/update`, so `add` makes atomic counters.  The updates are
+    independent UpdateItem calls, up to BATCH_UPDATE_CONCURRENCY at a
+    time.  The response has a `results` entry per update, in request
+    order, with status "ok" or "error".
+    '''
+    content = request.get_json()
+    if not content or 'objtype' not in content:
+        return bad_request('Missing objtype')
+    objtype = content['objtype']
+    table = dynamodb.Table(objtype.capitalize()+"-ZZ-REG-ID")
+    table_id = objtype + "_id"
+    try:
+        calls = common.batch_update_requests(
+            table_id, content.get('updates', []))
+    except ValueError as e:
+        return bad_request(str(e))
+    errors = list(update_pool.map(
+        lambda kwargs: apply_update(table, kwargs), calls))
+    return json_response(
+        common.batch_update_response(table_id, calls, errors))
+
+
+@bp.route('/export', methods=['GET'])
+def export():
+    '''
+    Stream every item of a table as NDJSON
+
+    The items are read by a parallel scan of DB_SCAN_SEGMENTS
+    segments (see export_items()), `limit` items a page if given, so
+    only a few pages are held at once however large the table.  Each
+    page is followed by a checkpoint line,
+    `{"_checkpoint": {"cursor": ..., "exported": n}}`: `exported`
+    items have been sent, and an `/export` with that `cursor` resumes
+    after them.  The last line is a checkpoint with a null cursor; a
+    stream without one was cut short.
+    '''
+    if not request.args.get('objtype'):
+        return bad_request('Missing objtype')
+    objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
+    try:
+        starts, total, limit = common.export_args(
+            request.args, scan_segment_count)
+    except ValueError:
+        return bad_request("Invalid limit or cursor")
+    table = dynamodb.Table(objtype.capitalize()+"-ZZ-REG-ID")
+    return Response(export_items(table, starts, total, limit),
+                    mimetype='application/x-ndjson')
+
+
+@bp.route('/import', methods=['POST'])
+def import_():
+    '''
+    Write the items of an NDJSON body, such as an `/export`, to a table
+
+    Each line is an item, with its key, so the caller must pass
+    load_auth(), as for load().  Checkpoint lines are passed over, as
+    are the first `cursor` items.  The items are written as the body
+    arrives (see import_items()), and the response streams progress
+    lines, `{"cursor": n, "imported": ..., "unprocessed": ...}`.  An
+    `/import` with the last `cursor` received, of the same body,
+    resumes it: every item before the cursor has been written.
+    '''
+    if not load_auth(request.headers):
+        return Response(
+            json.dumps({"http_status_code": 401,
+                        "reason": "Invalid authorization for /import"}),
+            status=401,
+            mimetype='application/json')
+    if not request.args.get('objtype'):
+        return bad_request('Missing objtype')
+    objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
+    try:
+        skip = common.import_args(request.args)
+    except ValueError:
+        return bad_request("Invalid cursor")
+    table_name = objtype.capitalize()+"-ZZ-REG-ID"
+    return Response(
+        stream_with_context(import_items(table_name, request.stream, skip)),
+        mimetype='application/x-ndjson')
 
 
 @bp.route('/health')
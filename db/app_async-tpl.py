@@ -0,0 +1,886 @@
+"""
+SFU CMPT 756
+Sample application---database service, asyncio build.
+
+Serves the same `/api/v1/datastore/` routes and Prometheus metrics as
+`app.py`, from an ASGI application (Starlette under uvicorn).  The
+DynamoDB calls are awaited through aioboto3, so a request waiting on
+DynamoDB does not hold a thread.  `start.sh` runs this build when
+`APP_SERVER=asgi`.
+"""
+
+# Standard library modules
+import asyncio
+import collections
+import contextlib
+import logging
+import os
+import sys
+import time
+import urllib.parse
+import uuid
+
+# Installed packages
+import aioboto3
+from botocore.exceptions import ClientError
+
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import generate_latest
+
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+import uvicorn
+
+# Local modules
+import common
+from common import BATCH_READ_SIZE, BATCH_RETRIES, BATCH_WRITE_SIZE
+from common import BATCH_UPDATE_CONCURRENCY
+from common import IMPORT_CONCURRENCY, IMPORT_PROGRESS_ITEMS
+from common import SCAN_CONCURRENCY, SCAN_QUEUE_PAGES
+import serialize
+
+# The application
+
+# The metrics that prometheus_flask_exporter exports for app.py, under
+# the same names and labels, so the Grafana dashboards read either build
+REQUEST_DURATION = Histogram(
+    'flask_http_request_duration_seconds',
+    'Flask HTTP request duration in seconds',
+    ['method', 'path', 'status'])
+REQUEST_TOTAL = Counter(
+    'flask_http_request_total',
+    'Total number of HTTP requests',
+    ['method', 'status'])
+REQUEST_EXCEPTIONS = Counter(
+    'flask_http_request_exceptions_total',
+    'Total number of HTTP requests which resulted in an exception',
+    ['method', 'status'])
+APP_INFO = Gauge('app_info', 'Database process')
+APP_INFO.set(1)
+
+# Throughput of parallel scans, as app.py reports it
+SCAN_ITEMS = Counter(
+    'datastore_scan_items',
+    'Items read by parallel scans',
+    ['table'])
+SCAN_READ_UNITS = Counter(
+    'datastore_scan_read_units',
+    'Read capacity units consumed by parallel scans',
+    ['table'])
+SCAN_PAGE_SECONDS = Histogram(
+    'datastore_scan_page_seconds',
+    'Latency of reading one page of one segment of a parallel scan',
+    ['table'])
+
+# Items of `/import`s written ("ok") and not written ("unprocessed")
+IMPORT_ITEMS = Counter(
+    'datastore_import_items',
+    'Items written by imports',
+    ['table', 'status'])
+
+# default to us-east-1 if no region is specified
+# (us-east-1 is the default/only supported region for a starter account)
+region = os.getenv('AWS_REGION', 'us-east-1')
+
+# these must be present; if they are missing, we should probably bail now
+access_key = os.getenv('AWS_ACCESS_KEY_ID')
+secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
+
+# Must be presented to authorize call to `/load`
+loader_token = os.getenv('SVC_LOADER_TOKEN')
+
+# In some testing contexts, we pass in the DynamoDB URL
+dynamodb_url = os.getenv('DYNAMODB_URL', '')
+
+# Responses leave out DynamoDB's ResponseMetadata unless this is "false"
+compact_json = os.getenv('DB_COMPACT_JSON', 'true') != 'false'
+
+# Segments of a parallel scan of a whole table; 1 scans it in one piece
+scan_segment_count = int(
+    os.getenv('DB_SCAN_SEGMENTS', str(common.SCAN_SEGMENTS)))
+
+session = aioboto3.Session()
+
+# The DynamoDB resource, opened at startup and closed at shutdown
+dynamodb = None
+
+# DescribeTable result of each table, keyed by table name, filled on
+# first use
+table_descriptions = {}
+
+PREFIX = '/api/v1/datastore/'
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    '''Hold the DynamoDB resource open while the application runs'''
+    global dynamodb
+    kwargs = {'region_name': region,
+              'aws_access_key_id': access_key,
+              'aws_secret_access_key': secret_access_key}
+    if dynamodb_url != '':
+        kwargs['endpoint_url'] = dynamodb_url
+    async with session.resource('dynamodb', **kwargs) as resource:
+        dynamodb = resource
+        yield
+        dynamodb = None
+
+
+def tracked(handler):
+    '''Record the request metrics of a route, as prometheus_flask_exporter
+    does for every route of app.py'''
+    async def endpoint(request):
+        start = time.perf_counter()
+        try:
+            response = await handler(request)
+        except Exception:
+            REQUEST_EXCEPTIONS.labels(request.method, 500).inc()
+            raise
+        REQUEST_DURATION.labels(
+            request.method, request.url.path, response.status_code).observe(
+                time.perf_counter() - start)
+        REQUEST_TOTAL.labels(request.method, response.status_code).inc()
+        return response
+    return endpoint
+
+
+def json_response(obj, status=200):
+    '''Return a response carrying `obj`, encoded by serialize.dumps()'''
+    return Response(serialize.dumps(obj, compact=compact_json),
+                    status_code=status,
+                    media_type='application/json')
+
+
+def bad_request(reason):
+    '''Return a 400 response carrying `reason`'''
+    return json_response({"http_status_code": 400, "reason": reason}, 400)
+
+
+def conflict(reason):
+    '''Return a 409 response carrying `reason`'''
+    return json_response({"http_status_code": 409, "reason": reason}, 409)
+
+
+def unauthorized(reason):
+    '''Return a 401 response carrying `reason`'''
+    return json_response({"http_status_code": 401, "reason": reason}, 401)
+
+
+def arg(request, name):
+    '''Return the query parameter `name`, or "" if it is absent'''
+    value = request.query_params.get(name)
+    if value is None:
+        return ""
+    return urllib.parse.unquote_plus(value)
+
+
+async def get_json(request):
+    '''Return the decoded JSON body, parsed as Flask's get_json() does'''
+    body = await request.body()
+    if not body:
+        return None
+    return serialize.loads(body)
+
+
+async def table_named(objtype):
+    '''Return the table holding items of `objtype`'''
+    return await dynamodb.Table(objtype.capitalize()+"-ZZ-REG-ID")
+
+
+async def describe(table):
+    '''Return the DescribeTable description of `table`'''
+    if table.name not in table_descriptions:
+        response = await dynamodb.meta.client.describe_table(
+            TableName=table.name)
+        table_descriptions[table.name] = response['Table']
+    return table_descriptions[table.name]
+
+
+async def indexes(table):
+    '''Return the names of the global secondary indexes of `table`
+
+    Tables created without the indexes (older stacks, local test
+    tables) make the callers fall back to a scan.
+    '''
+    try:
+        description = await describe(table)
+    except ClientError:
+        return set()
+    return {g['IndexName']
+            for g in description.get('GlobalSecondaryIndexes', [])}
+
+
+async def adjacent_item(table, owner, create_time, forward, limit=1,
+                        fields=None):
+    '''
+    Return the owner's item created next after `create_time`
+
+    If `forward` is False, return the one created last before it
+    instead.  The response has the shape of a query with at most
+    `limit` items in `Items`, holding only the attributes in `fields`
+    if given.
+    '''
+    op, kwargs = common.adjacent_request(
+        owner, create_time, forward, await indexes(table), limit, fields)
+    if op == 'query':
+        return await table.query(**kwargs)
+    return common.nearest_item(await table.scan(**kwargs), forward,
+                               limit, fields)
+
+
+async def playlist_cursor(table, table_id, owner, args):
+    '''
+    Return the `/cursor` response for `owner`'s tracks in `table`
+
+    Raises ValueError if `owner` is empty or `args` are malformed.
+    '''
+    forward, create_time, start_key = common.cursor_args(args, owner)
+    wrap = args.get('wrap', 'true') != 'false'
+    index = await indexes(table)
+    op, kwargs = common.cursor_request(
+        owner, forward, index, create_time, start_key)
+    if op == 'scan':
+        items = (await table.scan(**kwargs))['Items']
+        item = common.cursor_pick(
+            items, table_id, forward, create_time, start_key)
+        wrapped = item is None and wrap
+        if wrapped:
+            item = common.cursor_pick(items, table_id, forward)
+        return common.cursor_response(item, table_id, wrapped)
+
+    items = (await table.query(**kwargs))['Items']
+    positioned = create_time is not None or start_key is not None
+    wrapped = len(items) == 0 and wrap and positioned
+    if wrapped:
+        op, kwargs = common.cursor_request(owner, forward, index)
+        items = (await table.query(**kwargs))['Items']
+    return common.cursor_response(
+        items[0] if items else None, table_id, wrapped)
+
+
+async def stream_items(op, kwargs):
+    '''
+    Generate the items of every page of a scan or query as NDJSON
+
+    Only one page (at most `Limit` items, or 1 MB) is held in
+    memory at a time.
+    '''
+    kwargs = dict(kwargs)
+    while True:
+        page = await op(**kwargs)
+        for item in page['Items']:
+            yield serialize.dumps(item) + b'\n'
+        if 'LastEvaluatedKey' not in page:
+            break
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+async def all_items(op, kwargs):
+    '''Return the items of every page of a scan or query'''
+    kwargs = dict(kwargs)
+    items = []
+    while True:
+        page = await op(**kwargs)
+        items.extend(page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return items
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+async def scan_segment(table, kwargs, slots):
+    '''Scan one page of one segment, recording its throughput'''
+    async with slots:
+        start = time.perf_counter()
+        page = await table.scan(**kwargs)
+    SCAN_PAGE_SECONDS.labels(table.name).observe(time.perf_counter() - start)
+    SCAN_ITEMS.labels(table.name).inc(len(page['Items']))
+    SCAN_READ_UNITS.labels(table.name).inc(common.consumed_units(page))
+    return page
+
+
+async def parallel_scan(table, kwargs, starts, total):
+    '''
+    Return one page of a parallel scan, from the segments in `starts`
+
+    The segments are scanned at once, up to SCAN_CONCURRENCY at a
+    time, a page each, sharing `kwargs`' `Limit` between them; see
+    common.merge_segment_pages().
+    '''
+    limit = common.segment_limit(kwargs.get('Limit'), len(starts))
+    slots = asyncio.Semaphore(SCAN_CONCURRENCY)
+    segments = list(starts)
+    pages = await asyncio.gather(*(
+        scan_segment(
+            table,
+            common.segment_request(
+                kwargs, segment, total, starts[segment], limit),
+            slots)
+        for segment in segments))
+    return common.merge_segment_pages(dict(zip(segments, pages)), total)
+
+
+async def segment_pages(table, kwargs, starts, total):
+    '''
+    Generate (segment, page) for every page of a parallel scan
+
+    Each segment is scanned by a task of its own, page after page, up
+    to SCAN_CONCURRENCY at a time, and its pages are generated as
+    they arrive.  At most SCAN_QUEUE_PAGES pages wait; the scans
+    pause while the consumer catches up, and are cancelled when it
+    closes the generator.
+    '''
+    pages = asyncio.Queue(SCAN_QUEUE_PAGES)
+    slots = asyncio.Semaphore(SCAN_CONCURRENCY)
+
+    async def scan(segment, start):
+        try:
+            while True:
+                page = await scan_segment(table, common.segment_request(
+                    kwargs, segment, total, start), slots)
+                await pages.put((segment, page))
+                start = page.get('LastEvaluatedKey')
+                if start is None:
+                    break
+        except Exception as e:
+            await pages.put(e)
+            return
+        await pages.put(None)
+
+    tasks = [asyncio.ensure_future(scan(segment, start))
+             for segment, start in starts.items()]
+    try:
+        running = len(tasks)
+        while running > 0:
+            entry = await pages.get()
+            if entry is None:
+                running -= 1
+            elif isinstance(entry, Exception):
+                raise entry
+            else:
+                yield entry
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_segments(table, kwargs, starts, total):
+    '''
+    Generate the items of every page of a parallel scan as NDJSON
+
+    The pages are sent as they arrive (see segment_pages()); the scans
+    are cancelled if the client goes away.
+    '''
+    pages = segment_pages(table, kwargs, starts, total)
+    try:
+        async for _, page in pages:
+            if page['Items']:
+                yield b''.join(serialize.dumps(item) + b'\n'
+                               for item in page['Items'])
+    finally:
+        await pages.aclose()
+
+
+async def export_items(table, starts, total, limit):
+    '''
+    Generate the NDJSON lines of an `/export`, as export_items() of
+    app.py
+    '''
+    kwargs = {} if limit is None else {'Limit': limit}
+    remaining = dict(starts)
+    exported = 0
+    pages = segment_pages(table, kwargs, starts, total)
+    try:
+        async for segment, page in pages:
+            exported += len(page['Items'])
+            if 'LastEvaluatedKey' in page:
+                remaining[segment] = page['LastEvaluatedKey']
+            else:
+                del remaining[segment]
+            checkpoint = common.export_checkpoint(remaining, total, exported)
+            yield b''.join(serialize.dumps(item) + b'\n'
+                           for item in page['Items'] + [checkpoint])
+    finally:
+        await pages.aclose()
+
+
+async def body_lines(request):
+    '''Generate the lines of the request body as it arrives'''
+    rest = b''
+    async for chunk in request.stream():
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+async def import_items(table_name, lines, skip):
+    '''
+    Write the items of the NDJSON `lines` of an `/import` to
+    `table_name`; return its progress lines
+
+    As import_items() of app.py, with each batch written by a task of
+    its own, but the progress lines are returned once the import
+    ends: Starlette reads the request's channel while it streams a
+    response, to notice a disconnect, and would take the body.
+    '''
+    progress = common.import_progress(skip)
+    pending = collections.deque()
+    report = []
+
+    async def settle():
+        start, end, task = pending.popleft()
+        try:
+            unprocessed = len(await task)
+        except ClientError as e:
+            unprocessed = end - start
+            progress.setdefault('error', e.response['Error']['Message'])
+        except Exception as e:
+            logging.exception('Import batch failed')
+            unprocessed = end - start
+            progress.setdefault('error', 'Write failed: {}'.format(e))
+        common.import_settled(progress, start, end, unprocessed)
+        IMPORT_ITEMS.labels(table_name, 'ok').inc(end - start - unprocessed)
+        IMPORT_ITEMS.labels(table_name, 'unprocessed').inc(unprocessed)
+
+    count = 0
+    number = 0
+    writes = []
+    reported = 0
+    try:
+        async for line in lines:
+            number += 1
+            try:
+                item = common.import_item(line)
+            except ValueError:
+                progress['error'] = 'Line {} is not a JSON object'.format(
+                    number)
+                break
+            if item is None:
+                continue
+            count += 1
+            if count <= skip:
+                continue
+            writes.append({'PutRequest': {'Item': item}})
+            if len(writes) < BATCH_WRITE_SIZE:
+                continue
+            if len(pending) == IMPORT_CONCURRENCY:
+                await settle()
+            pending.append((count - len(writes), count, asyncio.ensure_future(
+                batch_put(table_name, writes))))
+            writes = []
+            if 'error' in progress:
+                break
+            if count - reported >= IMPORT_PROGRESS_ITEMS:
+                reported = count
+                report.append(serialize.dumps(progress) + b'\n')
+    except Exception as e:
+        # The body could not be read; write what was, and say where to
+        # resume
+        logging.exception('Import read failed')
+        progress.setdefault('error', 'Read failed: {}'.format(e))
+    if writes:
+        pending.append((count - len(writes), count, asyncio.ensure_future(
+            batch_put(table_name, writes))))
+    while pending:
+        await settle()
+    progress['done'] = 'error' not in progress
+    report.append(serialize.dumps(progress) + b'\n')
+    return report
+
+
+async def update(request):
+    content = await get_json(request) or {}
+    objtype = arg(request, 'objtype')
+    objkey = arg(request, 'objkey')
+    table = await table_named(objtype)
+    try:
+        add, version, return_values = common.update_args(
+            request.query_params)
+        kwargs = common.update_request(
+            objtype + "_id", objkey, content, add, version, return_values)
+    except ValueError as e:
+        return bad_request(str(e))
+    try:
+        response = await table.update_item(**kwargs)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'ConditionalCheckFailedException':
+            return conflict("Item is not at version {}".format(version))
+        if code == 'ValidationException':
+            return bad_request(e.response['Error']['Message'])
+        raise
+    return json_response(response)
+
+
+async def read_new(request):
+    objtype = arg(request, 'objtype')
+    objkey = arg(request, 'objkey')
+    owner = arg(request, 'owner')
+    artist = arg(request, 'artist')
+    try:
+        paging = common.page_args(request.query_params)
+        fields = common.fields_arg(request.query_params)
+        sort = common.sort_arg(request.query_params)
+    except ValueError:
+        return bad_request("Invalid limit, next_token, fields or sort")
+
+    table = await table_named(objtype)
+    op_name, kwargs, full_table = common.read_music_request(
+        objkey, owner, artist, await indexes(table))
+    op = getattr(table, op_name)
+    kwargs.update(paging)
+    kwargs.update(common.projection(fields))
+    # Only a query has an order, that of the index's sort key
+    if op_name == 'query' and sort is not None:
+        kwargs['ScanIndexForward'] = sort
+    segments = None
+    if full_table:
+        try:
+            segments = common.scan_segments(
+                kwargs.get('ExclusiveStartKey'), scan_segment_count)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return bad_request("Invalid next_token")
+    if segments is not None:
+        kwargs.pop('ExclusiveStartKey', None)
+
+    if request.query_params.get('format') == 'ndjson':
+        if segments is not None:
+            return StreamingResponse(
+                stream_segments(table, kwargs, *segments),
+                media_type='application/x-ndjson')
+        return StreamingResponse(stream_items(op, kwargs),
+                                 media_type='application/x-ndjson')
+    if segments is not None:
+        response = await parallel_scan(table, kwargs, *segments)
+    else:
+        response = await op(**kwargs)
+    if full_table:
+        description = await describe(table)
+        response['attrib'] = description['AttributeDefinitions']
+    if 'LastEvaluatedKey' in response:
+        response['next_token'] = common.encode_token(
+            response['LastEvaluatedKey'])
+    return json_response(response)
+
+
+async def read(request):
+    objtype = arg(request, 'objtype')
+    objkey = arg(request, 'objkey')
+    try:
+        limit = common.limit_arg(request.query_params)
+        fields = common.fields_arg(request.query_params)
+    except ValueError:
+        return bad_request("Invalid limit or fields")
+    table = await table_named(objtype)
+    response = await table.query(
+        **common.read_request(objtype + "_id", objkey, limit, fields))
+    return json_response(response)
+
+
+async def adjacent(request, forward):
+    '''Return the `/next` (`forward`) or `/prev` response'''
+    owner = arg(request, 'owner')
+    try:
+        if not owner:
+            raise TypeError('owner is required')
+        create_time = int(arg(request, 'create_time'))
+        limit = common.limit_arg(request.query_params)
+        fields = common.fields_arg(request.query_params)
+    except (TypeError, ValueError):
+        return bad_request("Invalid owner, create_time, limit or fields")
+    table = await table_named(arg(request, 'objtype'))
+    return json_response(await adjacent_item(
+        table, owner, create_time, forward,
+        1 if limit is None else limit, fields))
+
+
+async def next_item(request):
+    return await adjacent(request, True)
+
+
+async def prev_item(request):
+    return await adjacent(request, False)
+
+
+async def cursor(request):
+    '''Return one track of an owner's playlist, as cursor() of app.py'''
+    objtype = arg(request, 'objtype')
+    owner = arg(request, 'owner')
+    table = await table_named(objtype)
+    try:
+        return json_response(await playlist_cursor(
+            table, objtype + "_id", owner, request.query_params))
+    except ValueError as e:
+        return bad_request(str(e))
+
+
+async def write(request):
+    content = await get_json(request)
+    objtype = content.pop('objtype')
+    table_id = objtype + "_id"
+    payload = {table_id: str(uuid.uuid4())}
+    payload.update(content)
+    table = await table_named(objtype)
+    response = await table.put_item(Item=payload)
+    if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+        return json_response({"message": "fail"})
+    return json_response({table_id: payload[table_id]})
+
+
+def load_auth(headers):
+    '''Return True if caller authorized to do a `/load` '''
+    return common.is_loader(headers, loader_token)
+
+
+async def load(request):
+    '''Load a value into the database, as load() of app.py'''
+    if not load_auth(request.headers):
+        return unauthorized("Invalid authorization for /load")
+
+    content = await get_json(request)
+    if 'uuid' not in content:
+        return json_response({"http_status_code": 400,
+                              "reason": 'Missing uuid'})
+    objtype = content.pop('objtype')
+    table_id = objtype + "_id"
+    payload = {table_id: content.pop('uuid')}
+    payload.update(content)
+    table = await table_named(objtype)
+    response = await table.put_item(Item=payload)
+    status = response['ResponseMetadata']['HTTPStatusCode']
+    if status != 200:
+        return json_response({"http_status_code": status})
+    return json_response({table_id: payload[table_id]})
+
+
+async def delete(request):
+    objtype = arg(request, 'objtype')
+    objkey = arg(request, 'objkey')
+    table = await table_named(objtype)
+    response = await table.delete_item(Key={objtype + "_id": objkey})
+    return json_response(response)
+
+
+async def delete_music(request):
+    '''
+    Delete the items of one type matching a song title, owner and
+    artist, as delete_music() of app.py
+    '''
+    objtype = arg(request, 'objtype')
+    table_name = objtype.capitalize()+"-ZZ-REG-ID"
+    table_id = objtype + "_id"
+    table = await table_named(objtype)
+    try:
+        op_name, kwargs = common.delete_music_request(
+            arg(request, 'objkey'), arg(request, 'owner'),
+            arg(request, 'artist'), await indexes(table))
+    except ValueError as e:
+        return bad_request(str(e))
+    items = await all_items(getattr(table, op_name), kwargs)
+    unprocessed = await batch_put(
+        table_name,
+        [{'DeleteRequest': {'Key': {table_id: item[table_id]}}}
+         for item in items])
+    return json_response(
+        common.delete_music_response(table_id, items, unprocessed))
+
+
+async def backoff(attempt):
+    '''Wait before retry number `attempt` (1, 2, ...) of a batch'''
+    await asyncio.sleep(common.backoff_sec(attempt))
+
+
+async def batch_get(table_name, keys):
+    '''
+    Read `keys` from `table_name` with BatchGetItem
+
+    Returns (items, unprocessed), where `unprocessed` lists the keys
+    DynamoDB still had not processed after BATCH_RETRIES retries.
+    '''
+    items = []
+    unprocessed = []
+    for chunk in common.chunks(keys, BATCH_READ_SIZE):
+        pending = {table_name: {'Keys': chunk}}
+        for attempt in range(BATCH_RETRIES + 1):
+            if attempt > 0:
+                await backoff(attempt)
+            response = await dynamodb.batch_get_item(RequestItems=pending)
+            items.extend(response['Responses'].get(table_name, []))
+            pending = response.get('UnprocessedKeys')
+            if not pending:
+                break
+        if pending:
+            unprocessed.extend(pending[table_name]['Keys'])
+    return items, unprocessed
+
+
+async def batch_put(table_name, writes):
+    '''
+    Apply `writes` (PutRequest/DeleteRequest dicts) with BatchWriteItem
+
+    Returns the write requests DynamoDB still had not processed
+    after BATCH_RETRIES retries.
+    '''
+    unprocessed = []
+    for chunk in common.chunks(writes, BATCH_WRITE_SIZE):
+        pending = {table_name: chunk}
+        for attempt in range(BATCH_RETRIES + 1):
+            if attempt > 0:
+                await backoff(attempt)
+            response = await dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get('UnprocessedItems')
+            if not pending:
+                break
+        if pending:
+            unprocessed.extend(pending[table_name])
+    return unprocessed
+
+
+async def batch_read(request):
+    '''Read many items of one type, as batch_read() of app.py'''
+    content = await get_json(request)
+    if not content or 'objtype' not in content or 'objkeys' not in content:
+        return bad_request('Missing objtype or objkeys')
+    objtype = content['objtype']
+    table_name = objtype.capitalize()+"-ZZ-REG-ID"
+    table_id = objtype + "_id"
+    # BatchGetItem rejects repeated keys
+    objkeys = list(dict.fromkeys(content['objkeys']))
+    items, unprocessed = await batch_get(table_name,
+                                         [{table_id: k} for k in objkeys])
+    results = common.batch_read_results(objkeys, table_id, items, unprocessed)
+    return json_response(
+        {"Items": items, "Count": len(items), "results": results})
+
+
+async def batch_write(request):
+    '''Write and delete many items of one type, as batch_write() of app.py'''
+    content = await get_json(request)
+    if not content or 'objtype' not in content:
+        return bad_request('Missing objtype')
+    objtype = content['objtype']
+    table_name = objtype.capitalize()+"-ZZ-REG-ID"
+    table_id = objtype + "_id"
+    items = content.get('items', [])
+    if any('uuid' in item for item in items) and not load_auth(
+            request.headers):
+        return unauthorized("Invalid authorization for uuid")
+
+    writes, results = common.batch_write_requests(
+        table_id, items, content.get('deletes', []))
+    unprocessed = await batch_put(table_name, writes)
+    return json_response(
+        common.batch_write_response(table_id, writes, results, unprocessed))
+
+
+async def apply_update(table, kwargs, slots):
+    '''Apply one update of a batch; return None or the error message'''
+    async with slots:
+        try:
+            await table.update_item(**kwargs)
+        except ClientError as e:
+            return e.response['Error']['Message']
+    return None
+
+
+async def batch_update(request):
+    '''Apply many updates to items of one type, as batch_update() of app.py'''
+    content = await get_json(request)
+    if not content or 'objtype' not in content:
+        return bad_request('Missing objtype')
+    objtype = content['objtype']
+    table = await table_named(objtype)
+    table_id = objtype + "_id"
+    try:
+        calls = common.batch_update_requests(
+            table_id, content.get('updates', []))
+    except ValueError as e:
+        return bad_request(str(e))
+    slots = asyncio.Semaphore(BATCH_UPDATE_CONCURRENCY)
+    errors = await asyncio.gather(
+        *(apply_update(table, kwargs, slots) for kwargs in calls))
+    return json_response(
+        common.batch_update_response(table_id, calls, list(errors)))
+
+
+async def export(request):
+    '''Stream every item of a table as NDJSON, as export() of app.py'''
+    objtype = arg(request, 'objtype')
+    if not objtype:
+        return bad_request('Missing objtype')
+    try:
+        starts, total, limit = common.export_args(
+            request.query_params, scan_segment_count)
+    except ValueError:
+        return bad_request("Invalid limit or cursor")
+    table = await table_named(objtype)
+    return StreamingResponse(export_items(table, starts, total, limit),
+                             media_type='application/x-ndjson')
+
+
+async def import_(request):
+    '''Write the items of an NDJSON body to a table, as import_() of app.py'''
+    if not load_auth(request.headers):
+        return unauthorized("Invalid authorization for /import")
+    objtype = arg(request, 'objtype')
+    if not objtype:
+        return bad_request('Missing objtype')
+    try:
+        skip = common.import_args(request.query_params)
+    except ValueError:
+        return bad_request("Invalid cursor")
+    report = await import_items(
+        objtype.capitalize()+"-ZZ-REG-ID", body_lines(request), skip)
+    return Response(b''.join(report), media_type='application/x-ndjson')
+
+
+async def health(request):
+    return Response("", status_code=200, media_type="application/json")
+
+
+async def readiness(request):
+    return Response("", status_code=200, media_type="application/json")
+
+
+async def metrics(request):
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+routes = [
+    Route(PREFIX + 'update', tracked(update), methods=['PUT']),
+    Route(PREFIX + 'read_music', tracked(read_new), methods=['GET']),
+    Route(PREFIX + 'read', tracked(read), methods=['GET']),
+    Route(PREFIX + 'next', tracked(next_item), methods=['GET']),
+    Route(PREFIX + 'prev', tracked(prev_item), methods=['GET']),
+    Route(PREFIX + 'cursor', tracked(cursor), methods=['GET']),
+    Route(PREFIX + 'write', tracked(write), methods=['POST']),
+    Route(PREFIX + 'load', tracked(load), methods=['POST']),
+    Route(PREFIX + 'delete', tracked(delete), methods=['DELETE']),
+    Route(PREFIX + 'delete_music', tracked(delete_music), methods=['DELETE']),
+    Route(PREFIX + 'batch_read', tracked(batch_read), methods=['POST']),
+    Route(PREFIX + 'batch_write', tracked(batch_write), methods=['POST']),
+    Route(PREFIX + 'batch_update', tracked(batch_update), methods=['POST']),
+    Route(PREFIX + 'export', tracked(export), methods=['GET']),
+    Route(PREFIX + 'import', tracked(import_), methods=['POST']),
+    Route(PREFIX + 'health', health),
+    Route(PREFIX + 'readiness', readiness),
+    Route('/metrics', metrics),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        logging.error("missing port arg 1")
+        sys.exit(-1)
+
+    p = int(sys.argv[1])
+    uvicorn.run(app, host='0.0.0.0', port=p)
@@ -0,0 +1,15 @@
+"""
+SFU CMPT 756
+Storage backends that stand in for DynamoDB in the database service.
+
+Each backend offers the part of the boto3 DynamoDB service resource that
+`app.py` calls: `Table(name)` objects with get_item, put_item,
+update_item, delete_item, query and scan, plus batch_get_item and
+batch_write_item, taking the same parameters and returning responses
+of the same shape.  Failures are raised as botocore ClientErrors with
+DynamoDB's error codes, so the routes handle them unchanged.
+
+DB_BACKEND selects the backend: `dynamodb` (the default), `memory` for
+the in-process tables of `memory.py`, or `sqlite` for the tables of the
+SQLite file at DB_PATH (`sqlite.py`).
+"""
@@ -0,0 +1,576 @@
+"""
+SFU CMPT 756
+DynamoDB expressions, evaluated in process by the stand-in backends.
+
+Conditions arrive either as boto3 condition objects (`Key('Owner').eq(
+owner) & ...`) or as expression strings with `#name` and `:value`
+placeholders (`attribute_not_exists(#v)`, `SET #s0 = :s0 ADD #a0 :a0`),
+as the datastore routes build them.  Both are turned into the same
+tree of tuples and evaluated against items, which are dicts holding
+values as boto3 returns them (Decimal numbers, sets, ...).
+
+This is the subset of the expression language the routes use: top-level
+attribute names (no nested paths), comparisons, BETWEEN, IN, AND, OR,
+NOT, the attribute_exists, attribute_not_exists, attribute_type,
+begins_with and contains functions and size(); SET (with +, -,
+if_not_exists and list_append), REMOVE, ADD and DELETE updates.
+"""
+
+# Standard library modules
+import decimal
+import functools
+import re
+
+# Installed packages
+from boto3.dynamodb.conditions import AttributeBase, ConditionBase
+from boto3.dynamodb.types import Binary
+
+from botocore.exceptions import ClientError
+
+# An attribute the item does not have
+MISSING = object()
+
+# The DynamoDB type of a value, for attribute_type() and key checks
+TYPES = ((bool, 'BOOL'), (str, 'S'), (decimal.Decimal, 'N'),
+         (Binary, 'B'), (list, 'L'), (dict, 'M'))
+
+TOKEN = re.compile(
+    r'\s*(?:(#\w+)|(:\w+)|([A-Za-z_]\w*)|(<>|<=|>=|[=<>(),+\-]))')
+
+COMPARISONS = ('=', '<>', '<', '<=', '>', '>=')
+
+
+def client_error(code, message, operation):
+    """Return the ClientError DynamoDB reports for `code`."""
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': 400}},
+                       operation)
+
+
+def validation_error(message, operation='Expression'):
+    """Return the ClientError of an invalid request."""
+    return client_error('ValidationException', message, operation)
+
+
+def normalize(value):
+    """
+    Return `value` as boto3 would read it back from DynamoDB.
+
+    Numbers become Decimal and sets, lists and maps are copied.  Like
+    boto3, floats are rejected with a TypeError.
+    """
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (str, decimal.Decimal)):
+        return value
+    if isinstance(value, int):
+        return decimal.Decimal(value)
+    if isinstance(value, float):
+        raise TypeError(
+            'Float types are not supported. Use Decimal types instead.')
+    if isinstance(value, (bytes, bytearray)):
+        return Binary(bytes(value))
+    if isinstance(value, Binary):
+        return value
+    if isinstance(value, (set, frozenset)):
+        return {normalize(v) for v in value}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    raise TypeError('Unsupported type "{}" for value "{}"'.format(
+        type(value), value))
+
+
+def type_name(value):
+    """Return the DynamoDB type name (S, N, SS, ...) of a value."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, set):
+        for member in value:
+            return {str: 'SS', decimal.Decimal: 'NS'}.get(type(member), 'BS')
+        return 'SS'
+    for cls, name in TYPES:
+        if isinstance(value, cls):
+            return name
+    return None
+
+
+class Env():
+    """The placeholder maps of a request, for resolving tree leaves."""
+    def __init__(self, names=None, values=None):
+        self.names = names or {}
+        self.values = values or {}
+
+    def name(self, token):
+        """Return the attribute name of a path token."""
+        if token.startswith('#'):
+            if token not in self.names:
+                raise validation_error(
+                    'An expression attribute name used in the document '
+                    'path is not defined; attribute name: ' + token)
+            return self.names[token]
+        return token
+
+    def value(self, token):
+        """Return the value of a `:value` token."""
+        if token not in self.values:
+            raise validation_error(
+                'An expression attribute value used in expression is not '
+                'defined; attribute value: ' + token)
+        return normalize(self.values[token])
+
+
+# Condition trees ------------------------------------------------------
+
+def condition(expression):
+    """
+    Return the tree of a condition, an object or an expression string.
+
+    Trees are tuples: ('path', token), ('ref', token), ('value', v),
+    ('size', operand), ('cmp', op, a, b), ('between', a, lo, hi),
+    ('in', a, [operands]), ('func', name, [operands]), ('and', a, b),
+    ('or', a, b) and ('not', a).
+    """
+    if isinstance(expression, str):
+        return parse_condition(expression)
+    return from_object(expression)
+
+
+def from_object(obj):
+    """Return the tree of a boto3 condition object."""
+    # size() is both a condition and an attribute
+    if isinstance(obj, AttributeBase) and not isinstance(obj, ConditionBase):
+        return ('path', obj.name)
+    if not isinstance(obj, ConditionBase):
+        return ('value', normalize(obj))
+    op = obj.expression_operator
+    args = [from_object(v) for v in obj._values]
+    if op in COMPARISONS:
+        return ('cmp', op, args[0], args[1])
+    if op in ('AND', 'OR'):
+        return (op.lower(), args[0], args[1])
+    if op == 'NOT':
+        return ('not', args[0])
+    if op == 'BETWEEN':
+        return ('between', args[0], args[1], args[2])
+    if op == 'IN':
+        return ('in', args[0], [('value', normalize(v))
+                                for v in obj._values[1]])
+    if op == 'size':
+        return ('size', args[0])
+    return ('func', op, args)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_condition(text):
+    """Return the tree of a condition expression string."""
+    parser = Parser(text)
+    tree = parser.condition()
+    parser.end()
+    return tree
+
+
+def evaluate(tree, item, env):
+    """Return True if `item` satisfies the condition `tree`."""
+    kind = tree[0]
+    if kind == 'and':
+        return evaluate(tree[1], item, env) and evaluate(tree[2], item, env)
+    if kind == 'or':
+        return evaluate(tree[1], item, env) or evaluate(tree[2], item, env)
+    if kind == 'not':
+        return not evaluate(tree[1], item, env)
+    if kind == 'cmp':
+        return compare(tree[1], operand(tree[2], item, env),
+                       operand(tree[3], item, env))
+    if kind == 'between':
+        value = operand(tree[1], item, env)
+        return (compare('>=', value, operand(tree[2], item, env))
+                and compare('<=', value, operand(tree[3], item, env)))
+    if kind == 'in':
+        value = operand(tree[1], item, env)
+        return any(compare('=', value, operand(v, item, env))
+                   for v in tree[2])
+    if kind == 'func':
+        return function(tree[1], [operand(a, item, env) for a in tree[2]])
+    raise validation_error('Invalid condition')
+
+
+def operand(tree, item, env):
+    """Return the value of an operand, or MISSING."""
+    kind = tree[0]
+    if kind == 'path':
+        return item.get(env.name(tree[1]), MISSING)
+    if kind == 'ref':
+        return env.value(tree[1])
+    if kind == 'value':
+        return tree[1]
+    if kind == 'size':
+        value = operand(tree[1], item, env)
+        return MISSING if value is MISSING else decimal.Decimal(len(value))
+    raise validation_error('Invalid operand')
+
+
+def compare(op, a, b):
+    """Compare two values as DynamoDB does; other types never match."""
+    if op == '<>':
+        return not compare('=', a, b)
+    if a is MISSING or b is MISSING or type_name(a) != type_name(b):
+        return False
+    if op == '=':
+        return a == b
+    if type_name(a) not in ('S', 'N', 'B'):
+        return False
+    if op == '<':
+        return a < b
+    if op == '<=':
+        return a <= b
+    if op == '>':
+        return a > b
+    return a >= b
+
+
+def function(name, args):
+    """Return the value of a condition function of `args`."""
+    if name == 'attribute_exists':
+        return args[0] is not MISSING
+    if name == 'attribute_not_exists':
+        return args[0] is MISSING
+    if name == 'attribute_type':
+        return args[0] is not MISSING and type_name(args[0]) == args[1]
+    if args[0] is MISSING or args[1] is MISSING:
+        return False
+    if name == 'begins_with':
+        return (type_name(args[0]) == type_name(args[1])
+                and args[0].startswith(args[1]))
+    if name == 'contains':
+        if isinstance(args[0], str):
+            return isinstance(args[1], str) and args[1] in args[0]
+        if isinstance(args[0], (set, list)):
+            return args[1] in args[0]
+        return False
+    raise validation_error('Invalid function name; function: ' + name)
+
+
+def key_value(tree, attribute, env):
+    """
+    Return the value `attribute` must equal in a key condition tree.
+
+    Raises a ValidationException if the condition does not give one.
+    """
+    if tree[0] == 'and':
+        for side in tree[1:]:
+            try:
+                return key_value(side, attribute, env)
+            except ClientError:
+                pass
+    elif (tree[0] == 'cmp' and tree[1] == '=' and tree[2][0] == 'path'
+          and env.name(tree[2][1]) == attribute):
+        return operand(tree[3], {}, env)
+    raise validation_error(
+        'Query condition missed key schema element: ' + attribute, 'Query')
+
+
+# Projections ----------------------------------------------------------
+
+@functools.lru_cache(maxsize=1024)
+def parse_projection(text):
+    """Return the paths of a projection expression string."""
+    parser = Parser(text)
+    tokens = [parser.path()]
+    while parser.accept(','):
+        tokens.append(parser.path())
+    parser.end()
+    return tokens
+
+
+def project(item, projection, env):
+    """Return `item` holding only the attributes of `projection`."""
+    if projection is None:
+        return item
+    names = [env.name(p[1]) for p in parse_projection(projection)]
+    return {n: item[n] for n in names if n in item}
+
+
+# Updates --------------------------------------------------------------
+
+@functools.lru_cache(maxsize=1024)
+def parse_update(text):
+    """
+    Return the actions of an update expression string.
+
+    Actions are ('SET', path, value), ('REMOVE', path),
+    ('ADD', path, operand) and ('DELETE', path, operand), where a SET
+    value is an operand or ('+', a, b), ('-', a, b),
+    ('if_not_exists', path, value) or ('list_append', a, b).
+    """
+    parser = Parser(text)
+    actions = []
+    while not parser.at_end():
+        clause = parser.keyword(('SET', 'REMOVE', 'ADD', 'DELETE'))
+        while True:
+            path = parser.path()
+            if clause == 'SET':
+                parser.expect('=')
+                actions.append(('SET', path, parser.set_value()))
+            elif clause == 'REMOVE':
+                actions.append(('REMOVE', path))
+            else:
+                actions.append((clause, path, parser.operand()))
+            if not parser.accept(','):
+                break
+    if not actions:
+        raise validation_error('The update expression is empty')
+    return actions
+
+
+def update_paths(actions, env):
+    """Return the attribute names an update's `actions` change."""
+    return [env.name(a[1][1]) for a in actions]
+
+
+def apply_update(actions, item, env):
+    """
+    Return a copy of `item` changed by the update `actions`.
+
+    As in DynamoDB, every value is computed from `item` as it was
+    before the update.
+    """
+    new = dict(item)
+    for action in actions:
+        name = env.name(action[1][1])
+        if action[0] == 'SET':
+            new[name] = set_value(action[2], item, env)
+        elif action[0] == 'REMOVE':
+            new.pop(name, None)
+        elif action[0] == 'ADD':
+            new[name] = add(item.get(name, MISSING),
+                            operand(action[2], item, env))
+        else:
+            value = subtract_set(item.get(name, MISSING),
+                                 operand(action[2], item, env))
+            if value:
+                new[name] = value
+            else:
+                new.pop(name, None)
+    return new
+
+
+def set_value(tree, item, env):
+    """Return the value of the right-hand side of a SET action."""
+    kind = tree[0]
+    if kind in ('+', '-'):
+        a = set_value(tree[1], item, env)
+        b = set_value(tree[2], item, env)
+        if type_name(a) != 'N' or type_name(b) != 'N':
+            raise validation_error(
+                'An operand in the update expression has an incorrect '
+                'data type', 'UpdateItem')
+        return a + b if kind == '+' else a - b
+    if kind == 'if_not_exists':
+        value = item.get(env.name(tree[1][1]), MISSING)
+        return value if value is not MISSING else set_value(
+            tree[2], item, env)
+    if kind == 'list_append':
+        a = set_value(tree[1], item, env)
+        b = set_value(tree[2], item, env)
+        if not isinstance(a, list) or not isinstance(b, list):
+            raise validation_error(
+                'An operand in the update expression has an incorrect '
+                'data type', 'UpdateItem')
+        return a + b
+    value = operand(tree, item, env)
+    if value is MISSING:
+        raise validation_error(
+            'The provided expression refers to an attribute that does '
+            'not exist in the item', 'UpdateItem')
+    return value
+
+
+def add(current, value):
+    """Return the result of ADDing `value` to an attribute."""
+    kind = type_name(value)
+    if kind not in ('N', 'SS', 'NS', 'BS'):
+        raise validation_error(
+            'An operand in the update expression has an incorrect data '
+            'type', 'UpdateItem')
+    if current is MISSING:
+        return value
+    if type_name(current) != kind and not (
+            kind.endswith('S') and isinstance(current, set)
+            and not current):
+        raise validation_error(
+            'An operand in the update expression has an incorrect data '
+            'type', 'UpdateItem')
+    return current + value if kind == 'N' else current | value
+
+
+def subtract_set(current, value):
+    """Return the result of DELETEing the members `value` from a set."""
+    if not isinstance(value, set):
+        raise validation_error(
+            'An operand in the update expression has an incorrect data '
+            'type', 'UpdateItem')
+    if current is MISSING:
+        return None
+    if not isinstance(current, set):
+        raise validation_error(
+            'An operand in the update expression has an incorrect data '
+            'type', 'UpdateItem')
+    return current - value
+
+
+# Parsing --------------------------------------------------------------
+
+class Parser():
+    """Recursive-descent parser of one expression string."""
+    def __init__(self, text):
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = TOKEN.match(text, pos)
+            if match is None:
+                raise validation_error(
+                    'Invalid expression: Syntax error; token: "{}"'.format(
+                        text[pos:].strip()[:10]))
+            self.tokens.append(match.group(match.lastindex))
+            pos = match.end()
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def at_end(self):
+        return self.pos >= len(self.tokens)
+
+    def end(self):
+        if not self.at_end():
+            self.fail()
+
+    def fail(self):
+        raise validation_error(
+            'Invalid expression: Syntax error; token: "{}"'.format(
+                self.peek() or '<EOF>'))
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            self.fail()
+        self.pos += 1
+        return token
+
+    def accept(self, token):
+        peeked = self.peek()
+        if peeked is not None and peeked.upper() == token:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, token):
+        if not self.accept(token):
+            self.fail()
+
+    def keyword(self, keywords):
+        token = self.next()
+        if token.upper() not in keywords:
+            self.pos -= 1
+            self.fail()
+        return token.upper()
+
+    def path(self):
+        token = self.next()
+        if token[0] == ':' or not (token[0] == '#' or token[0].isalpha()
+                                   or token[0] == '_'):
+            self.pos -= 1
+            self.fail()
+        return ('path', token)
+
+    def operand(self):
+        token = self.peek()
+        if token is not None and token.startswith(':'):
+            self.pos += 1
+            return ('ref', token)
+        if token is not None and token.lower() == 'size':
+            self.pos += 1
+            self.expect('(')
+            tree = ('size', self.path())
+            self.expect(')')
+            return tree
+        return self.path()
+
+    def set_value(self):
+        tree = self.set_operand()
+        if self.peek() in ('+', '-'):
+            op = self.next()
+            tree = (op, tree, self.set_operand())
+        return tree
+
+    def set_operand(self):
+        token = self.peek()
+        if token is not None and token.lower() in ('if_not_exists',
+                                                   'list_append'):
+            self.pos += 1
+            self.expect('(')
+            if token.lower() == 'if_not_exists':
+                first = self.path()
+            else:
+                first = self.set_operand()
+            self.expect(',')
+            tree = (token.lower(), first, self.set_operand())
+            self.expect(')')
+            return tree
+        return self.operand()
+
+    def condition(self):
+        tree = self.conjunction()
+        while self.accept('OR'):
+            tree = ('or', tree, self.conjunction())
+        return tree
+
+    def conjunction(self):
+        tree = self.negation()
+        while self.accept('AND'):
+            tree = ('and', tree, self.negation())
+        return tree
+
+    def negation(self):
+        if self.accept('NOT'):
+            return ('not', self.negation())
+        return self.predicate()
+
+    def predicate(self):
+        if self.accept('('):
+            tree = self.condition()
+            self.expect(')')
+            return tree
+        token = self.peek()
+        if token is not None and token.lower() in (
+                'attribute_exists', 'attribute_not_exists',
+                'attribute_type', 'begins_with', 'contains'):
+            self.pos += 1
+            self.expect('(')
+            args = [self.path()]
+            while self.accept(','):
+                args.append(self.operand())
+            self.expect(')')
+            return ('func', token.lower(), args)
+        left = self.operand()
+        if self.accept('BETWEEN'):
+            low = self.operand()
+            self.expect('AND')
+            return ('between', left, low, self.operand())
+        if self.accept('IN'):
+            self.expect('(')
+            values = [self.operand()]
+            while self.accept(','):
+                values.append(self.operand())
+            self.expect(')')
+            return ('in', left, values)
+        op = self.next()
+        if op not in COMPARISONS:
+            self.pos -= 1
+            self.fail()
+        return ('cmp', op, left, self.operand())
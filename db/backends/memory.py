@@ -0,0 +1,197 @@
+"""
+SFU CMPT 756
+In-memory stand-in for DynamoDB.
+
+Each table is a dict of items by key, with a sorted list of the keys
+for scans and, for each global secondary index, a sorted list of
+(sort key, item key) pairs per partition key value for queries.
+A lock per table makes every call atomic, so the threads of a Flask or
+Gunicorn worker may share the tables.  The data lives only as long as
+the process, and each process has its own: serve the database service
+with one process (APP_SERVER=flask, or WEB_WORKERS=1).
+"""
+
+# Standard library modules
+import bisect
+import copy
+import threading
+import zlib
+
+# Local modules
+from backends import expressions, tables
+from backends.expressions import Env
+from backends.tables import response
+
+
+class Resource(tables.Resource):
+    """The in-memory tables, as the boto3 DynamoDB service resource."""
+    def _open(self, name, key, indexes, attribute_types):
+        return Table(name, key, indexes, attribute_types)
+
+
+class Table(tables.Table):
+    """
+    One in-memory table, as a boto3 DynamoDB Table resource.
+
+    Supports the parameters of get_item, put_item, update_item,
+    delete_item, query and scan that the datastore routes use.
+    """
+    _copy = staticmethod(copy.deepcopy)
+
+    def __init__(self, name, key, indexes, attribute_types):
+        super().__init__(name, key, indexes, attribute_types)
+        self._items = {}  # key value -> item
+        self._keys = []  # sorted key values
+        self._entries = {i: {} for i in indexes}  # partition -> entries
+        self._lock = threading.RLock()
+
+    # Storage ----------------------------------------------------------
+
+    def _store(self, item):
+        """Write `item`, replacing any item with its key."""
+        value = item[self.key]
+        self._remove(value)
+        self._items[value] = item
+        bisect.insort(self._keys, value)
+        for name, (partition, sort) in self._indexes.items():
+            if partition in item and sort in item:
+                bisect.insort(
+                    self._entries[name].setdefault(item[partition], []),
+                    (item[sort], value))
+
+    def _remove(self, value):
+        """Delete the item with key `value`; return it or None."""
+        item = self._items.pop(value, None)
+        if item is None:
+            return None
+        del self._keys[bisect.bisect_left(self._keys, value)]
+        for name, (partition, sort) in self._indexes.items():
+            if partition in item and sort in item:
+                entries = self._entries[name][item[partition]]
+                del entries[bisect.bisect_left(entries, (item[sort], value))]
+                if not entries:
+                    del self._entries[name][item[partition]]
+        return item
+
+    # Single items -----------------------------------------------------
+
+    def get_item(self, Key, ProjectionExpression=None,
+                 ExpressionAttributeNames=None, ConsistentRead=None,
+                 ReturnConsumedCapacity=None):
+        env = Env(ExpressionAttributeNames)
+        with self._lock:
+            item = self._items.get(self._key_value(Key, 'GetItem'))
+            if item is None:
+                return response()
+            item = copy.deepcopy(item)
+        return response(
+            Item=expressions.project(item, ProjectionExpression, env))
+
+    def put_item(self, Item, ConditionExpression=None,
+                 ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues='NONE',
+                 ReturnConsumedCapacity=None):
+        item = self._put_item(Item)
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._lock:
+            old = self._items.get(item[self.key])
+            self._condition(ConditionExpression, old, env, 'PutItem')
+            self._store(item)
+        if ReturnValues == 'ALL_OLD' and old is not None:
+            return response(Attributes=copy.deepcopy(old))
+        return response()
+
+    def update_item(self, Key, UpdateExpression,
+                    ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE',
+                    ReturnConsumedCapacity=None):
+        value = self._key_value(Key, 'UpdateItem')
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        actions, changed = self._update_actions(UpdateExpression, env)
+        with self._lock:
+            old = self._items.get(value)
+            self._condition(ConditionExpression, old, env, 'UpdateItem')
+            new = expressions.apply_update(
+                actions, old or {self.key: value}, env)
+            self._check(new, 'UpdateItem')
+            self._store(new)
+            return self._update_response(old, new, changed, ReturnValues)
+
+    def delete_item(self, Key, ConditionExpression=None,
+                    ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE',
+                    ReturnConsumedCapacity=None):
+        value = self._key_value(Key, 'DeleteItem')
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._lock:
+            self._condition(ConditionExpression, self._items.get(value),
+                            env, 'DeleteItem')
+            old = self._remove(value)
+        if ReturnValues == 'ALL_OLD' and old is not None:
+            return response(Attributes=old)
+        return response()
+
+    # Many items -------------------------------------------------------
+
+    def query(self, KeyConditionExpression, IndexName=None,
+              FilterExpression=None, ProjectionExpression=None,
+              ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+              ScanIndexForward=True, Limit=None, ExclusiveStartKey=None,
+              Select=None, ConsistentRead=None,
+              ReturnConsumedCapacity=None):
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        key_condition = expressions.condition(KeyConditionExpression)
+        with self._lock:
+            if IndexName is None:
+                value = expressions.key_value(key_condition, self.key, env)
+                keys = [value] if value in self._items else []
+                last_key = self._table_key
+            else:
+                self._index(IndexName, 'Query')
+                keys = self._index_keys(
+                    IndexName, key_condition, env, ScanIndexForward,
+                    ExclusiveStartKey)
+                last_key = self._index_key(IndexName)
+            return self._read((self._items[k] for k in keys),
+                              key_condition, last_key, env,
+                              FilterExpression, ProjectionExpression,
+                              Limit, Select)
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None,
+             ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+             Limit=None, ExclusiveStartKey=None, Select=None,
+             Segment=None, TotalSegments=None, ConsistentRead=None,
+             ReturnConsumedCapacity=None):
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._lock:
+            start = 0
+            if ExclusiveStartKey is not None:
+                start = bisect.bisect_right(
+                    self._keys, ExclusiveStartKey[self.key])
+            keys = self._keys[start:]
+            if TotalSegments is not None:
+                # Split by a hash that, unlike hash(), is the same in
+                # every process
+                keys = [k for k in keys
+                        if zlib.crc32(str(k).encode()) % TotalSegments
+                        == Segment]
+            return self._read((self._items[k] for k in keys), None,
+                              self._table_key, env, FilterExpression,
+                              ProjectionExpression, Limit, Select)
+
+    def _index_keys(self, name, key_condition, env, forward, start_key):
+        """Return the item keys of an index query, in index order."""
+        partition, sort = self._indexes[name]
+        value = expressions.key_value(key_condition, partition, env)
+        entries = self._entries[name].get(value, [])
+        if forward:
+            begin = 0
+            if start_key is not None:
+                begin = bisect.bisect_right(
+                    entries, (start_key[sort], start_key[self.key]))
+            return [k for _, k in entries[begin:]]
+        end = len(entries)
+        if start_key is not None:
+            end = bisect.bisect_left(
+                entries, (start_key[sort], start_key[self.key]))
+        return [k for _, k in reversed(entries[:end])]
@@ -0,0 +1,445 @@
+"""
+SFU CMPT 756
+SQLite stand-in for DynamoDB.
+
+The tables live in one SQLite database file.  Each holds a row per
+item: the item itself, in DynamoDB's JSON encoding so that numbers,
+sets and binary values read back exactly, and the attributes of the
+table's global secondary indexes in columns of their own.  An SQLite
+index on (partition, sort, key) serves the queries of each DynamoDB
+index, in its order, and one on (attribute, key) serves scans that
+filter on an index attribute, such as `SongTitle` without an owner.
+
+The database runs in WAL mode, so reads never wait for a write.  Each
+thread opens its own connection, on first use and again in a forked
+Gunicorn worker, as SQLite connections may not be shared.  Writes that
+first read the item (conditions, updates, ReturnValues) run in an
+IMMEDIATE transaction, which makes them atomic across the threads and
+processes that open the same file: unlike the memory backend, any
+number of workers may serve it.
+"""
+
+# Standard library modules
+import base64
+import contextlib
+import decimal
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+# Installed packages
+from boto3.dynamodb.types import Binary
+
+# Local modules
+from backends import expressions, tables
+from backends.expressions import Env
+from backends.tables import response
+
+# Seconds a connection waits for another's write to finish
+BUSY_TIMEOUT_SEC = 10
+
+# SQL operator of each comparison a condition may push into a query
+SQL_OPERATORS = {'=': '=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+# The comparison seen from the other side, for `:v < #a`
+FLIPPED = {'=': '=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+
+def quote(name):
+    """Return `name` as an SQL identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def encode(value):
+    """Return the DynamoDB JSON form of an item's value."""
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, decimal.Decimal):
+        return {'N': str(value)}
+    if isinstance(value, Binary):
+        return {'B': base64.b64encode(value.value).decode()}
+    if isinstance(value, set):
+        kind = expressions.type_name(value)
+        return {kind: [encode(v)[kind[0]] for v in value]}
+    if isinstance(value, list):
+        return {'L': [encode(v) for v in value]}
+    return {'M': {k: encode(v) for k, v in value.items()}}
+
+
+def decode(value):
+    """Return the item value of its DynamoDB JSON form."""
+    (kind, data), = value.items()
+    if kind in ('S', 'BOOL'):
+        return data
+    if kind == 'NULL':
+        return None
+    if kind == 'N':
+        return decimal.Decimal(data)
+    if kind == 'B':
+        return Binary(base64.b64decode(data))
+    if kind == 'SS':
+        return set(data)
+    if kind == 'NS':
+        return {decimal.Decimal(v) for v in data}
+    if kind == 'BS':
+        return {Binary(base64.b64decode(v)) for v in data}
+    if kind == 'L':
+        return [decode(v) for v in data]
+    return {k: decode(v) for k, v in data.items()}
+
+
+def dumps(item):
+    return json.dumps({k: encode(v) for k, v in item.items()},
+                      separators=(',', ':'))
+
+
+def loads(text):
+    return {k: decode(v) for k, v in json.loads(text).items()}
+
+
+def column_value(value):
+    """Return an index attribute's value as SQLite stores it."""
+    if isinstance(value, decimal.Decimal):
+        # SQLite integers are 64 bits; larger numbers are stored inexact
+        if value == value.to_integral_value() and abs(value) < 2 ** 63:
+            return int(value)
+        return float(value)
+    return value
+
+
+def connect(path):
+    """Open a connection to the database at `path`."""
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SEC,
+                                 isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    # In WAL mode, commits survive a crash of the process, but not
+    # necessarily of the machine
+    connection.execute('PRAGMA synchronous=NORMAL')
+    # The hash of the scan segments, as the memory backend splits them
+    connection.create_function(
+        'crc32', 1, lambda key: zlib.crc32(str(key).encode()),
+        deterministic=True)
+    return connection
+
+
+class Resource(tables.Resource):
+    """
+    The tables of a database file, as the boto3 DynamoDB service resource.
+
+    Parameters
+    ----------
+    path: string
+        The database file, created if missing.
+    table_indexes, index_keys, attribute_types:
+        As for tables.Resource.
+    """
+    def __init__(self, path, table_indexes, index_keys, attribute_types):
+        super().__init__(table_indexes, index_keys, attribute_types)
+        self._path = path
+        self._local = threading.local()
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = connect(self._path)
+            local.pid = os.getpid()
+        return local.connection
+
+    def _open(self, name, key, indexes, attribute_types):
+        table = Table(name, key, indexes, attribute_types, self.connection)
+        table.create()
+        return table
+
+
+class Table(tables.Table):
+    """
+    One table of a database file, as a boto3 DynamoDB Table resource.
+
+    Supports the parameters of get_item, put_item, update_item,
+    delete_item, query and scan that the datastore routes use.
+    `connection` returns the calling thread's connection.
+    """
+    def __init__(self, name, key, indexes, attribute_types, connection):
+        super().__init__(name, key, indexes, attribute_types)
+        self._connection = connection
+        self._table = quote(name)
+        self._columns = [self.key] + list(self._types)
+        self._insert = 'INSERT OR REPLACE INTO {} ({}, item) VALUES ({})' \
+            .format(self._table, ', '.join(map(quote, self._columns)),
+                    ', '.join('?' * (len(self._columns) + 1)))
+        self._where_key = 'WHERE {} = ?'.format(quote(self.key))
+
+    # Storage ----------------------------------------------------------
+
+    def create(self):
+        """Create the table and its indexes if they do not exist."""
+        columns = ['{} TEXT PRIMARY KEY'.format(quote(self.key))]
+        columns += ['{} {}'.format(quote(a), 'NUMERIC' if k == 'N' else 'TEXT')
+                    for a, k in self._types.items()]
+        statements = ['CREATE TABLE IF NOT EXISTS {} ({}, item TEXT NOT NULL)'
+                      .format(self._table, ', '.join(columns))]
+        for name, (partition, sort) in self._indexes.items():
+            statements.append(
+                'CREATE INDEX IF NOT EXISTS {} ON {} ({}, {}, {})'.format(
+                    quote(self.name + ':' + name), self._table,
+                    quote(partition), quote(sort), quote(self.key)))
+        for attribute in self._types:
+            statements.append(
+                'CREATE INDEX IF NOT EXISTS {} ON {} ({}, {})'.format(
+                    quote(self.name + ':' + attribute), self._table,
+                    quote(attribute), quote(self.key)))
+        with self._write() as connection:
+            for statement in statements:
+                connection.execute(statement)
+
+    @contextlib.contextmanager
+    def _write(self):
+        """Run the block in a transaction holding the write lock."""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _get(self, connection, value):
+        """Return the item with key `value`, or None."""
+        row = connection.execute(
+            'SELECT item FROM {} {}'.format(self._table, self._where_key),
+            (value,)).fetchone()
+        return None if row is None else loads(row[0])
+
+    def _store(self, connection, item):
+        """Write `item`, replacing any item with its key."""
+        connection.execute(
+            self._insert,
+            [column_value(item.get(c)) for c in self._columns]
+            + [dumps(item)])
+
+    def _remove(self, connection, value):
+        connection.execute(
+            'DELETE FROM {} {}'.format(self._table, self._where_key),
+            (value,))
+
+    # Single items -----------------------------------------------------
+
+    def get_item(self, Key, ProjectionExpression=None,
+                 ExpressionAttributeNames=None, ConsistentRead=None,
+                 ReturnConsumedCapacity=None):
+        env = Env(ExpressionAttributeNames)
+        item = self._get(self._connection(), self._key_value(Key, 'GetItem'))
+        if item is None:
+            return response()
+        return response(
+            Item=expressions.project(item, ProjectionExpression, env))
+
+    def put_item(self, Item, ConditionExpression=None,
+                 ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues='NONE',
+                 ReturnConsumedCapacity=None):
+        item = self._put_item(Item)
+        if ConditionExpression is None and ReturnValues != 'ALL_OLD':
+            self._store(self._connection(), item)
+            return response()
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._write() as connection:
+            old = self._get(connection, item[self.key])
+            self._condition(ConditionExpression, old, env, 'PutItem')
+            self._store(connection, item)
+        if ReturnValues == 'ALL_OLD' and old is not None:
+            return response(Attributes=old)
+        return response()
+
+    def update_item(self, Key, UpdateExpression,
+                    ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE',
+                    ReturnConsumedCapacity=None):
+        value = self._key_value(Key, 'UpdateItem')
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        actions, changed = self._update_actions(UpdateExpression, env)
+        with self._write() as connection:
+            old = self._get(connection, value)
+            self._condition(ConditionExpression, old, env, 'UpdateItem')
+            # apply_update changes the item it is given
+            new = expressions.apply_update(
+                actions, loads(dumps(old)) if old else {self.key: value},
+                env)
+            self._check(new, 'UpdateItem')
+            self._store(connection, new)
+        return self._update_response(old, new, changed, ReturnValues)
+
+    def delete_item(self, Key, ConditionExpression=None,
+                    ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE',
+                    ReturnConsumedCapacity=None):
+        value = self._key_value(Key, 'DeleteItem')
+        if ConditionExpression is None and ReturnValues != 'ALL_OLD':
+            self._remove(self._connection(), value)
+            return response()
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._write() as connection:
+            old = self._get(connection, value)
+            self._condition(ConditionExpression, old, env, 'DeleteItem')
+            self._remove(connection, value)
+        if ReturnValues == 'ALL_OLD' and old is not None:
+            return response(Attributes=old)
+        return response()
+
+    # Many items -------------------------------------------------------
+
+    def query(self, KeyConditionExpression, IndexName=None,
+              FilterExpression=None, ProjectionExpression=None,
+              ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+              ScanIndexForward=True, Limit=None, ExclusiveStartKey=None,
+              Select=None, ConsistentRead=None,
+              ReturnConsumedCapacity=None):
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        key_condition = expressions.condition(KeyConditionExpression)
+        if IndexName is None:
+            value = expressions.key_value(key_condition, self.key, env)
+            where, params = [quote(self.key) + ' = ?'], [value]
+            order, exact = [self.key], True
+            last_key = self._table_key
+        else:
+            partition, sort = self._index(IndexName, 'Query')
+            value = expressions.key_value(key_condition, partition, env)
+            # Like a DynamoDB index, this one holds only the items with
+            # both its keys
+            where = [quote(partition) + ' = ?', quote(sort) + ' IS NOT NULL']
+            params = [column_value(value)]
+            exact = self._push(key_condition, (partition, sort), env,
+                               where, params)
+            order = [sort, self.key]
+            if ExclusiveStartKey is not None:
+                where.append('({}, {}) {} (?, ?)'.format(
+                    quote(sort), quote(self.key),
+                    '>' if ScanIndexForward else '<'))
+                params += [column_value(ExclusiveStartKey[sort]),
+                           ExclusiveStartKey[self.key]]
+            last_key = self._index_key(IndexName)
+        # Unless SQLite applies the whole key condition, the rows it
+        # returns are not all read, so it cannot apply the Limit
+        return self._select(where, params, order, not ScanIndexForward,
+                            Limit if exact else None, key_condition,
+                            last_key, env, FilterExpression,
+                            ProjectionExpression, Limit, Select)
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None,
+             ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+             Limit=None, ExclusiveStartKey=None, Select=None,
+             Segment=None, TotalSegments=None, ConsistentRead=None,
+             ReturnConsumedCapacity=None):
+        """
+        Scan the table in key order.
+
+        The comparisons of index attributes with values that the filter
+        requires are applied through the SQLite indexes, so unlike
+        DynamoDB the Limit counts only items that pass them.
+        """
+        env = Env(ExpressionAttributeNames, ExpressionAttributeValues)
+        where, params = [], []
+        if FilterExpression is not None:
+            self._push(expressions.condition(FilterExpression),
+                       tuple(self._types), env, where, params)
+        if ExclusiveStartKey is not None:
+            where.append(quote(self.key) + ' > ?')
+            params.append(ExclusiveStartKey[self.key])
+        if TotalSegments is not None:
+            where.append('crc32({}) % ? = ?'.format(quote(self.key)))
+            params += [TotalSegments, Segment]
+        return self._select(where, params, [self.key], False, Limit, None,
+                            self._table_key, env, FilterExpression,
+                            ProjectionExpression, Limit, Select)
+
+    def _select(self, where, params, order, descending, sql_limit,
+                *read_args):
+        """Return the _read() response of the rows matching `where`."""
+        statement = 'SELECT item FROM ' + self._table
+        if where:
+            statement += ' WHERE ' + ' AND '.join(where)
+        statement += ' ORDER BY ' + ', '.join(
+            quote(c) + (' DESC' if descending else '') for c in order)
+        if sql_limit is not None:
+            # One row past the Limit tells whether there are more
+            statement += ' LIMIT ?'
+            params = params + [sql_limit + 1]
+        rows = self._connection().execute(statement, params)
+        try:
+            return self._read((loads(r[0]) for r in rows), *read_args)
+        finally:
+            rows.close()
+
+    def _push(self, tree, attributes, env, where, params):
+        """
+        Add the SQL terms of the comparisons `tree` requires of
+        `attributes` to `where` and `params`
+
+        Only terms ANDed at the top of the tree are taken.  Returns True
+        if the terms express the whole tree.
+        """
+        kind = tree[0]
+        if kind == 'and':
+            left = self._push(tree[1], attributes, env, where, params)
+            right = self._push(tree[2], attributes, env, where, params)
+            return left and right
+        terms = self._terms(tree, attributes, env)
+        if terms is None:
+            return False
+        where.append(terms[0])
+        params += terms[1]
+        return True
+
+    def _terms(self, tree, attributes, env):
+        """Return (SQL, params) of one comparison, or None."""
+        kind = tree[0]
+
+        def attribute(operand):
+            if operand[0] == 'path' and env.name(operand[1]) in attributes:
+                return env.name(operand[1])
+            return None
+
+        def value(operand, name):
+            """The operand's value, if a constant of the column's type"""
+            if operand[0] not in ('ref', 'value'):
+                return None
+            v = expressions.operand(operand, {}, env)
+            if expressions.type_name(v) != self._types.get(name, 'S'):
+                return None
+            return column_value(v)
+
+        if kind == 'cmp' and tree[1] in SQL_OPERATORS:
+            op, left, right = tree[1:]
+            if attribute(left) is None:
+                op, left, right = FLIPPED[op], right, left
+            name = attribute(left)
+            v = None if name is None else value(right, name)
+            if v is None:
+                return None
+            return '{} {} ?'.format(quote(name), SQL_OPERATORS[op]), [v]
+        if kind == 'between':
+            name = attribute(tree[1])
+            if name is None:
+                return None
+            low, high = value(tree[2], name), value(tree[3], name)
+            if low is None or high is None:
+                return None
+            return '{} BETWEEN ? AND ?'.format(quote(name)), [low, high]
+        if kind == 'func' and tree[1] == 'begins_with':
+            name = attribute(tree[2][0])
+            if name is None or self._types.get(name, 'S') != 'S':
+                return None
+            prefix = value(tree[2][1], name)
+            if prefix is None:
+                return None
+            return ('substr({}, 1, ?) = ?'.format(quote(name)),
+                    [len(prefix), prefix])
+        return None
@@ -0,0 +1,259 @@
+"""
+SFU CMPT 756
+What the DynamoDB stand-ins have in common.
+
+`Resource` names and creates the tables and spreads the batch calls
+over them; `Table` holds a table's schema and the checks, condition
+handling and response building of its calls.  A backend subclasses
+both, supplying how items are stored and found.
+"""
+
+# Standard library modules
+import threading
+
+# Local modules
+from backends import expressions
+from backends.expressions import client_error, validation_error
+
+
+def response(**fields):
+    """Return a response with the metadata of a successful call."""
+    fields['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': 0}
+    return fields
+
+
+class Resource():
+    """
+    The tables of a stand-in, as the boto3 DynamoDB service resource.
+
+    Parameters
+    ----------
+    table_indexes: dict
+        Index names of each table, by object type (common.TABLE_INDEXES).
+    index_keys: dict
+        (partition, sort) key attributes of each index
+        (common.INDEX_KEYS).
+    attribute_types: dict
+        Type (S or N) of each index key attribute
+        (common.ATTRIBUTE_TYPES).
+    """
+    def __init__(self, table_indexes, index_keys, attribute_types):
+        self._table_indexes = table_indexes
+        self._index_keys = index_keys
+        self._attribute_types = attribute_types
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def Table(self, name):
+        """
+        Return the table `name`, creating it empty on first use.
+
+        A table `<Objtype>-<suffix>` is keyed by `<objtype>_id` and has
+        the indexes listed for `<objtype>`.
+        """
+        with self._lock:
+            if name not in self._tables:
+                objtype = name.split('-', 1)[0].lower()
+                indexes = {i: self._index_keys[i]
+                           for i in self._table_indexes.get(objtype, ())}
+                self._tables[name] = self._open(
+                    name, objtype + '_id', indexes, self._attribute_types)
+            return self._tables[name]
+
+    def _open(self, name, key, indexes, attribute_types):
+        """Return the backend's Table object for table `name`."""
+        raise NotImplementedError
+
+    def batch_get_item(self, RequestItems, ReturnConsumedCapacity=None):
+        """Read the keys of each table; none are left unprocessed."""
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            found = responses.setdefault(name, [])
+            for key in request['Keys']:
+                item = table.get_item(
+                    Key=key,
+                    ProjectionExpression=request.get('ProjectionExpression'),
+                    ExpressionAttributeNames=request.get(
+                        'ExpressionAttributeNames')).get('Item')
+                if item is not None:
+                    found.append(item)
+        return response(Responses=responses, UnprocessedKeys={})
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity=None):
+        """Apply the puts and deletes of each table; none are left."""
+        for name, writes in RequestItems.items():
+            table = self.Table(name)
+            for write in writes:
+                if 'PutRequest' in write:
+                    table.put_item(Item=write['PutRequest']['Item'])
+                else:
+                    table.delete_item(Key=write['DeleteRequest']['Key'])
+        return response(UnprocessedItems={})
+
+
+class Table():
+    """
+    One table of a stand-in, as a boto3 DynamoDB Table resource.
+
+    Parameters
+    ----------
+    name: string
+        Table name.
+    key: string
+        Key attribute.
+    indexes: dict
+        (partition, sort) key attributes of each global secondary
+        index, by index name.
+    attribute_types: dict
+        Type (S or N) of each index key attribute.
+    """
+    def __init__(self, name, key, indexes, attribute_types):
+        self.name = name
+        self.key = key
+        self._indexes = indexes
+        self._types = {a: attribute_types[a]
+                       for keys in indexes.values() for a in keys}
+
+    @property
+    def attribute_definitions(self):
+        definitions = [{'AttributeName': self.key, 'AttributeType': 'S'}]
+        for attribute, kind in self._types.items():
+            definitions.append(
+                {'AttributeName': attribute, 'AttributeType': kind})
+        return definitions
+
+    @property
+    def global_secondary_indexes(self):
+        if not self._indexes:
+            return None
+        return [{'IndexName': name,
+                 'KeySchema': [{'AttributeName': keys[0], 'KeyType': 'HASH'},
+                               {'AttributeName': keys[1],
+                                'KeyType': 'RANGE'}],
+                 'Projection': {'ProjectionType': 'ALL'},
+                 'IndexStatus': 'ACTIVE'}
+                for name, keys in self._indexes.items()]
+
+    @staticmethod
+    def _copy(item):
+        """Return an item the caller may change; see memory.Table."""
+        return item
+
+    def _key_value(self, key, operation):
+        """Return the key value of a Key parameter."""
+        if set(key) != {self.key}:
+            raise validation_error(
+                'The provided key element does not match the schema',
+                operation)
+        return key[self.key]
+
+    def _index(self, name, operation):
+        """Return the (partition, sort) attributes of index `name`."""
+        if name not in self._indexes:
+            raise validation_error(
+                'The table does not have the specified index: ' + name,
+                operation)
+        return self._indexes[name]
+
+    def _check(self, item, operation):
+        """Reject an item whose index keys have the wrong type."""
+        for attribute, kind in self._types.items():
+            if (attribute in item
+                    and expressions.type_name(item[attribute]) != kind):
+                raise validation_error(
+                    'One or more parameter values were invalid: Type '
+                    'mismatch for Index Key {} Expected: {} Actual: {}'
+                    .format(attribute, kind,
+                            expressions.type_name(item[attribute])),
+                    operation)
+
+    def _condition(self, expression, item, env, operation):
+        """Raise ConditionalCheckFailedException if `item` fails."""
+        if expression is None:
+            return
+        tree = expressions.condition(expression)
+        if not expressions.evaluate(tree, item or {}, env):
+            raise client_error('ConditionalCheckFailedException',
+                               'The conditional request failed', operation)
+
+    def _put_item(self, item):
+        """Return the stored form of put_item's Item, after its checks."""
+        item = expressions.normalize(item)
+        if self.key not in item:
+            raise validation_error(
+                'One or more parameter values were invalid: Missing the '
+                'key {} in the item'.format(self.key), 'PutItem')
+        self._check(item, 'PutItem')
+        return item
+
+    def _update_actions(self, update_expression, env):
+        """Return (actions, changed attributes) of an UpdateExpression."""
+        actions = expressions.parse_update(update_expression)
+        changed = expressions.update_paths(actions, env)
+        if self.key in changed:
+            raise validation_error(
+                'One or more parameter values were invalid: Cannot update '
+                'attribute {}. This attribute is part of the key'.format(
+                    self.key), 'UpdateItem')
+        return actions, changed
+
+    def _update_response(self, old, new, changed, return_values):
+        """Return the update_item response for its ReturnValues."""
+        attributes = {
+            'ALL_OLD': old or {},
+            'ALL_NEW': new,
+            'UPDATED_OLD': {n: old[n] for n in changed
+                            if old is not None and n in old},
+            'UPDATED_NEW': {n: new[n] for n in changed if n in new},
+        }.get(return_values, {})
+        if attributes:
+            return response(Attributes=self._copy(attributes))
+        return response()
+
+    def _table_key(self, item):
+        return {self.key: item[self.key]}
+
+    def _index_key(self, index):
+        """Return the LastEvaluatedKey function of a query of `index`."""
+        partition, sort = self._indexes[index]
+
+        def last_key(item):
+            return {self.key: item[self.key], partition: item[partition],
+                    sort: item[sort]}
+        return last_key
+
+    def _read(self, items, key_condition, last_key, env, filter_expression,
+              projection, limit, select):
+        """
+        Return the query or scan response reading `items` in order
+
+        As in DynamoDB, `limit` counts the items read before the filter
+        is applied.
+        """
+        filter_tree = None
+        if filter_expression is not None:
+            filter_tree = expressions.condition(filter_expression)
+        found = []
+        scanned = 0
+        last = None  # The last item read
+        result = {}
+        for item in items:
+            if key_condition is not None and not expressions.evaluate(
+                    key_condition, item, env):
+                continue
+            if limit is not None and scanned == limit:
+                result['LastEvaluatedKey'] = last_key(last)
+                break
+            scanned += 1
+            last = item
+            if filter_tree is None or expressions.evaluate(
+                    filter_tree, item, env):
+                found.append(item)
+        result['Count'] = len(found)
+        result['ScannedCount'] = scanned
+        if select != 'COUNT':
+            result['Items'] = [
+                expressions.project(self._copy(i), projection, env)
+                for i in found]
+        return response(**result)
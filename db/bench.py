@@ -0,0 +1,143 @@
+"""
+SFU CMPT 756
+Benchmark of the two builds of the database service.
+
+Drives running database services with closed-loop simulated users and
+reports the p50/p99 latency and the throughput of each at each number
+of users.  For example, with the Flask build on port 30002 and the
+asyncio build on port 30003, both over the same DynamoDB tables:
+
+    python bench.py --target flask=http://localhost:30002 \\
+        --target asgi=http://localhost:30003 --users 1 50 100
+
+Each user repeats one owner's playlist listing (`/read_music`), a
+`/next` and a `/read` of a random track, over items that the benchmark
+writes before it starts and deletes when it ends.
+"""
+
+# Standard library modules
+import argparse
+import json
+import random
+import uuid
+
+# Installed packages
+import requests
+
+# Local modules
+import loadgen
+
+PREFIX = '/api/v1/datastore/'
+
+
+def parse_args():
+    argp = argparse.ArgumentParser(
+        'bench',
+        description='Compare the latency and throughput of db service builds'
+        )
+    argp.add_argument(
+        '--target',
+        action='append',
+        required=True,
+        help="NAME=URL of a running db service; may be repeated"
+        )
+    argp.add_argument(
+        '--users',
+        type=int,
+        nargs='+',
+        default=[1, 50, 100],
+        help="Numbers of concurrent users to run"
+        )
+    argp.add_argument(
+        '--duration',
+        type=float,
+        default=30,
+        help="Seconds to run each number of users"
+        )
+    argp.add_argument(
+        '--items',
+        type=int,
+        default=50,
+        help="Number of playlist items written for the users to read"
+        )
+    argp.add_argument(
+        '--output',
+        help="File to write the results to, as JSON"
+        )
+    return argp.parse_args()
+
+
+def seed(url, owner, count):
+    """Write `count` playlist items for `owner`; return (key, time) pairs."""
+    items = [{"Owner": owner,
+              "SongTitle": "song-{}".format(i),
+              "Artist": "bench",
+              "create_time": i} for i in range(count)]
+    response = requests.post(url + PREFIX + 'batch_write',
+                             json={"objtype": "playlist", "items": items})
+    response.raise_for_status()
+    keys = [r['playlist_id'] for r in response.json()['results']]
+    return list(zip(keys, range(count)))
+
+
+def unseed(url, tracks):
+    """Delete the items written by seed()."""
+    requests.post(url + PREFIX + 'batch_write',
+                  json={"objtype": "playlist",
+                        "deletes": [key for key, _ in tracks]})
+
+
+def new_user(url, owner, tracks):
+    """
+    Return one user's request function for loadgen.run().
+
+    Each user repeats, for a random track, a listing of `owner`'s
+    playlist, a `/next` and a `/read`.
+    """
+    session = requests.Session()
+
+    def calls():
+        while True:
+            key, create_time = random.choice(tracks)
+            yield 'read_music', {"objtype": "playlist", "owner": owner}
+            yield 'next', {"objtype": "playlist", "owner": owner,
+                           "create_time": create_time}
+            yield 'read', {"objtype": "playlist", "objkey": key}
+    pending = calls()
+
+    def request():
+        endpoint, params = next(pending)
+        try:
+            response = session.get(url + PREFIX + endpoint, params=params)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+    return request
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = {}
+    print('{:<10} {:>6} {:>10} {:>10} {:>10} {:>7}'.format(
+        'target', 'users', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+    for target in args.target:
+        name, url = target.split('=', 1)
+        owner = 'bench-' + str(uuid.uuid4())
+        tracks = seed(url, owner, args.items)
+        try:
+            results[name] = []
+            for users in args.users:
+                stats = loadgen.run(
+                    lambda: new_user(url, owner, tracks),
+                    users, args.duration)
+                results[name].append(stats)
+                print('{:<10} {:>6} {:>10.1f} {:>10.2f} {:>10.2f} {:>7}'
+                      .format(name, users, stats['throughput_rps'],
+                              stats['p50_ms'], stats['p99_ms'],
+                              stats['errors']),
+                      flush=True)
+        finally:
+            unseed(url, tracks)
+    if args.output is not None:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2)
@@ -0,0 +1,831 @@
+"""
+SFU CMPT 756
+DynamoDB request building shared by both builds of the database
+service: the Flask build (`app.py`) and the asyncio build
+(`app_async.py`).
+
+Nothing here does I/O, so the same arguments serve a blocking boto3
+call in one build and an awaited aioboto3 call in the other.
+"""
+
+# Standard library modules
+import base64
+import functools
+import uuid
+
+# Installed packages
+from boto3.dynamodb.conditions import Key, Attr
+
+import simplejson as json
+
+# Global secondary index on (Owner, SongTitle), provisioned for the
+# Music and Playlist tables in `cluster/cloudformationdynamodb-tpl.json`.
+# Reads that name an owner query this index rather than scanning
+# the whole table.
+OWNER_TITLE_INDEX = 'Owner-SongTitle-index'
+
+# Global secondary index on (Owner, create_time), provisioned for the
+# Playlist table.  `/next`, `/prev` and `/cursor` read one item from it.
+OWNER_TIME_INDEX = 'Owner-create_time-index'
+
+# The global secondary indexes of each table, by object type, and the
+# (partition, sort) key attributes of each index and their types, as
+# provisioned in `cluster/cloudformationdynamodb-tpl.json`.  DynamoDB
+# reports its own; the stand-in backends (`backends/`) build theirs
+# from these.
+TABLE_INDEXES = {
+    'music': (OWNER_TITLE_INDEX,),
+    'playlist': (OWNER_TITLE_INDEX, OWNER_TIME_INDEX),
+    'history': (OWNER_TITLE_INDEX,),
+}
+INDEX_KEYS = {
+    OWNER_TITLE_INDEX: ('Owner', 'SongTitle'),
+    OWNER_TIME_INDEX: ('Owner', 'create_time'),
+}
+ATTRIBUTE_TYPES = {'Owner': 'S', 'SongTitle': 'S', 'create_time': 'N'}
+
+# DynamoDB limits on the number of items in one batch request
+BATCH_READ_SIZE = 100
+BATCH_WRITE_SIZE = 25
+
+# DynamoDB has no batch form of UpdateItem, so a `/batch_update`
+# makes up to this many UpdateItem calls at once
+BATCH_UPDATE_CONCURRENCY = 8
+
+# Unprocessed batch items are retried this many times, with
+# exponential backoff starting at BATCH_BACKOFF_SEC
+BATCH_RETRIES = 5
+BATCH_BACKOFF_SEC = 0.05
+
+# A read of a whole table is a parallel scan of this many segments
+# (DB_SCAN_SEGMENTS overrides it), up to SCAN_CONCURRENCY of them
+# scanned at once
+SCAN_SEGMENTS = 4
+SCAN_CONCURRENCY = 8
+
+# Pages of a streamed parallel scan held at once, waiting to be sent
+SCAN_QUEUE_PAGES = 8
+
+# The key, in the `LastEvaluatedKey` of a parallel scan page, holding
+# the segment count; a table key never has it
+SEGMENTS_KEY = 'TotalSegments'
+
+# Key of the checkpoint lines of an `/export` stream; no item has it
+CHECKPOINT_KEY = '_checkpoint'
+
+# An `/import` has up to this many BatchWriteItem batches in flight,
+# and reports its progress every IMPORT_PROGRESS_ITEMS items
+IMPORT_CONCURRENCY = 8
+IMPORT_PROGRESS_ITEMS = 1000
+
+# Attribute holding an item's version for conditional `/update`s
+VERSION_ATTR = 'version'
+
+# Accepted `return_values` of `/update`, as DynamoDB's ReturnValues
+RETURN_VALUES = ('NONE', 'ALL_OLD', 'UPDATED_OLD', 'ALL_NEW', 'UPDATED_NEW')
+
+# Number of distinct update expressions kept, one for each set of
+# attribute names updated together
+UPDATE_CACHE_SIZE = 256
+
+
+def encode_token(last_key):
+    '''Wrap a DynamoDB `LastEvaluatedKey` as an opaque cursor string'''
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def decode_token(token):
+    '''Return the `LastEvaluatedKey` wrapped by encode_token()'''
+    return json.loads(base64.urlsafe_b64decode(token.encode()).decode(),
+                      use_decimal=True)
+
+
+def limit_arg(args):
+    '''
+    Return the `limit` of a request as an int, or None if it has none
+
+    Raises ValueError if it is not a positive integer.
+    '''
+    if args.get('limit') is None:
+        return None
+    limit = int(args.get('limit'))
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return limit
+
+
+def page_args(args):
+    '''
+    Return the scan/query paging arguments of a request
+
+    `limit` caps the number of items DynamoDB evaluates for one
+    page and `next_token` resumes after the page that returned it.
+    Raises ValueError if either is malformed.
+    '''
+    paging = {}
+    limit = limit_arg(args)
+    if limit is not None:
+        paging['Limit'] = limit
+    if args.get('next_token'):
+        try:
+            paging['ExclusiveStartKey'] = decode_token(args.get('next_token'))
+        except Exception:
+            raise ValueError('malformed next_token')
+    return paging
+
+
+def fields_arg(args):
+    '''
+    Return the attribute names listed in the `fields` of a request,
+    or None if it has none
+
+    `fields` is a comma-separated list, such as "Artist,SongTitle".
+    '''
+    return names_arg(args, 'fields')
+
+
+def names_arg(args, name):
+    '''
+    Return the comma-separated attribute names in argument `name` of a
+    request, or None if it has none
+
+    Raises ValueError if a name is empty.
+    '''
+    if not args.get(name):
+        return None
+    names = [n.strip() for n in args.get(name).split(',')]
+    if '' in names:
+        raise ValueError('empty name in ' + name)
+    return names
+
+
+def projection(fields):
+    '''
+    Return the arguments reading only the attributes in `fields`
+
+    Each name is given through a placeholder, as many attribute
+    names (Owner, for one) are DynamoDB reserved words.  boto3 adds
+    its own `#n` placeholders for condition objects to the same map.
+    '''
+    if not fields:
+        return {}
+    names = {'#f{}'.format(i): f for i, f in enumerate(fields)}
+    return {'ProjectionExpression': ', '.join(names),
+            'ExpressionAttributeNames': names}
+
+
+def sort_arg(args):
+    '''
+    Return the ScanIndexForward value given by the `sort` of a request
+    ("asc" or "desc"), or None if it has none
+    '''
+    sort = args.get('sort')
+    if sort is None:
+        return None
+    if sort not in ('asc', 'desc'):
+        raise ValueError('sort must be asc or desc')
+    return sort == 'asc'
+
+
+def read_request(table_id, objkey, limit=None, fields=None):
+    '''Return the query() arguments of a `/read` of one key'''
+    kwargs = {'KeyConditionExpression': Key(table_id).eq(objkey)}
+    if fields:
+        kwargs.update(projection(fields))
+    else:
+        kwargs['Select'] = 'ALL_ATTRIBUTES'
+    if limit is not None:
+        kwargs['Limit'] = limit
+    return kwargs
+
+
+def read_music_request(objkey, owner, artist, indexes):
+    '''
+    Return (operation, kwargs, full_table) for a `/read_music` lookup
+
+    `operation` is 'query' or 'scan' and `kwargs` its arguments.
+    Lookups naming an owner query the (Owner, SongTitle) index if
+    it is among the table's `indexes`.  `full_table` is True for an
+    unfiltered scan of the whole table.
+    '''
+    if owner != "" and OWNER_TITLE_INDEX in indexes:
+        condition = Key('Owner').eq(owner)
+        if objkey != "":
+            condition = condition & Key('SongTitle').eq(objkey)
+        kwargs = {'IndexName': OWNER_TITLE_INDEX,
+                  'KeyConditionExpression': condition}
+        if objkey != "" and artist != "":
+            kwargs['FilterExpression'] = Attr('Artist').eq(artist)
+        return 'query', kwargs, False
+
+    if objkey != "" and owner != "" and artist != "":
+        kwargs = {'FilterExpression': Attr('SongTitle').eq(objkey)
+                  & Attr('Owner').eq(owner) & Attr('Artist').eq(artist)}
+    elif objkey != "" and owner != "":
+        kwargs = {'FilterExpression': Attr('SongTitle').eq(objkey)
+                  & Attr('Owner').eq(owner)}
+    elif objkey != "":
+        kwargs = {'FilterExpression': Attr('SongTitle').eq(objkey)}
+    elif owner != "":
+        kwargs = {'FilterExpression': Attr('Owner').eq(owner)}
+    else:
+        return 'scan', {}, True
+    return 'scan', kwargs, False
+
+
+def delete_music_request(objkey, owner, artist, indexes):
+    '''
+    Return (operation, kwargs) finding the items a `/delete_music`
+    deletes: those matching every one given of SongTitle `objkey`,
+    Owner `owner` and Artist `artist`
+
+    As in read_music_request(), a lookup naming an owner queries the
+    (Owner, SongTitle) index if it is among the table's `indexes`.
+    Raises ValueError if none is given, rather than match every item.
+    '''
+    matches = [Attr(name).eq(value)
+               for name, value in (('SongTitle', objkey),
+                                   ('Owner', owner),
+                                   ('Artist', artist))
+               if value != ""]
+    if not matches:
+        raise ValueError('Missing objkey, owner or artist')
+    if owner != "" and OWNER_TITLE_INDEX in indexes:
+        condition = Key('Owner').eq(owner)
+        if objkey != "":
+            condition = condition & Key('SongTitle').eq(objkey)
+        kwargs = {'IndexName': OWNER_TITLE_INDEX,
+                  'KeyConditionExpression': condition}
+        if artist != "":
+            kwargs['FilterExpression'] = Attr('Artist').eq(artist)
+        return 'query', kwargs
+    return 'scan', {'FilterExpression': functools.reduce(
+        lambda a, b: a & b, matches)}
+
+
+def scan_segments(start_key, segments):
+    '''
+    Return (starts, total) for a parallel scan of a whole table, or
+    None if the scan is to run in one piece
+
+    `starts` maps each segment still to be read to the
+    ExclusiveStartKey to resume it from, or None to start it, and
+    `total` is the segment count.  `start_key` is the request's
+    ExclusiveStartKey: None for a first page of `segments` segments,
+    the LastEvaluatedKey of a merge_segment_pages() response for a
+    later one, or a table key, from a scan in one piece.  Raises
+    ValueError if `start_key` names no segments, or segments out of
+    range.
+    '''
+    if start_key is None:
+        if segments < 2:
+            return None
+        return {s: None for s in range(segments)}, segments
+    if SEGMENTS_KEY not in start_key:
+        return None
+    starts = {int(s): k for s, k in start_key['Segments'].items()}
+    total = int(start_key[SEGMENTS_KEY])
+    if not starts or any(s < 0 or s >= total for s in starts):
+        raise ValueError('malformed segment position')
+    return starts, total
+
+
+def segment_request(kwargs, segment, total, start, limit=None):
+    '''
+    Return the scan arguments `kwargs` for one page of segment
+    `segment` of `total`, resuming from `start` if it is not None
+
+    `limit`, if given, replaces the `Limit` of `kwargs`.  The scan
+    reports the read capacity it consumes.
+    '''
+    kwargs = dict(kwargs,
+                  Segment=segment,
+                  TotalSegments=total,
+                  ReturnConsumedCapacity='TOTAL')
+    if start is not None:
+        kwargs['ExclusiveStartKey'] = start
+    if limit is not None:
+        kwargs['Limit'] = limit
+    return kwargs
+
+
+def segment_limit(limit, segments):
+    '''
+    Return the `Limit` of each of `segments` segments read for one
+    page of at most about `limit` items, or None if `limit` is None
+    '''
+    if limit is None:
+        return None
+    return -(-limit // segments)
+
+
+def merge_segment_pages(pages, total):
+    '''
+    Return one page of a parallel scan of `total` segments
+
+    `pages` maps each segment read to its scan response.  The items
+    are those of the segments in segment order.  If any segment has
+    more, `LastEvaluatedKey` holds the count and the position of each
+    such segment, for scan_segments() to resume from.
+    '''
+    items = []
+    scanned = 0
+    remaining = {}
+    for segment in sorted(pages):
+        page = pages[segment]
+        items.extend(page['Items'])
+        scanned += page.get('ScannedCount', len(page['Items']))
+        if 'LastEvaluatedKey' in page:
+            remaining[str(segment)] = page['LastEvaluatedKey']
+    response = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+    if remaining:
+        response['LastEvaluatedKey'] = {SEGMENTS_KEY: total,
+                                        'Segments': remaining}
+    return response
+
+
+def consumed_units(response):
+    '''Return the read capacity units a DynamoDB call reports consuming'''
+    return response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+
+
+def export_args(args, segments):
+    '''
+    Return (starts, total, limit) for an `/export` of `segments` segments
+
+    `starts` and `total` are as for scan_segments().  The `cursor` of
+    a checkpoint line resumes an earlier export, with its segment
+    count, and `limit` caps the items of each page.  Raises
+    ValueError if either is malformed.
+    '''
+    limit = limit_arg(args)
+    if not args.get('cursor'):
+        return {s: None for s in range(segments)}, segments, limit
+    try:
+        starts, total = scan_segments(decode_token(args.get('cursor')), 1)
+    except Exception:
+        raise ValueError('malformed cursor')
+    return starts, total, limit
+
+
+def export_checkpoint(remaining, total, exported):
+    '''
+    Return the checkpoint line of an `/export` that has sent `exported`
+    items
+
+    `remaining` maps each unfinished segment of `total` to the
+    LastEvaluatedKey to resume it from, or None if it has not begun.
+    The `cursor` resumes the export after the items sent; it is None
+    once every segment is done.
+    '''
+    cursor = None
+    if remaining:
+        cursor = encode_token({SEGMENTS_KEY: total,
+                               'Segments': {str(s): k
+                                            for s, k in remaining.items()}})
+    return {CHECKPOINT_KEY: {'cursor': cursor, 'exported': exported}}
+
+
+def import_args(args):
+    '''
+    Return the `cursor` of an `/import` as an int, or 0 if it has none
+
+    The cursor is the number of items at the start of the stream to
+    pass over, as written by an earlier import.  Raises ValueError if
+    it is not a non-negative integer.
+    '''
+    if not args.get('cursor'):
+        return 0
+    skip = int(args.get('cursor'))
+    if skip < 0:
+        raise ValueError('cursor must not be negative')
+    return skip
+
+
+def import_item(line):
+    '''
+    Return the item on one line of an `/import` stream, or None for a
+    blank line or an `/export` checkpoint line
+
+    Numbers are decoded as Decimal, as boto3 requires.  Raises
+    ValueError if the line is not a JSON object.
+    '''
+    line = line.strip()
+    if not line:
+        return None
+    item = json.loads(line, use_decimal=True)
+    if not isinstance(item, dict):
+        raise ValueError('not a JSON object')
+    if CHECKPOINT_KEY in item:
+        return None
+    return item
+
+
+def import_progress(skip):
+    '''Return the progress of an `/import` that passes over `skip` items'''
+    return {'cursor': skip, 'imported': 0, 'unprocessed': 0}
+
+
+def import_settled(progress, start, end, unprocessed):
+    '''
+    Record in `progress` a settled batch of an `/import`: the items
+    after the first `start` of the stream, up to `end`, `unprocessed`
+    of which were not written
+
+    Batches settle in stream order.  The cursor moves past a batch
+    only if it and every batch before it were written in full, so a
+    retry from the cursor writes every item at least once.
+    '''
+    progress['imported'] += end - start - unprocessed
+    progress['unprocessed'] += unprocessed
+    if progress['cursor'] == start and not unprocessed:
+        progress['cursor'] = end
+
+
+def adjacent_request(owner, create_time, forward, indexes, limit=1,
+                     fields=None):
+    '''
+    Return (operation, kwargs) reading the `limit` items of the owner
+    created next after `create_time`, or last before it if `forward`
+    is False, with only the attributes in `fields` if given
+
+    With the (Owner, create_time) index among `indexes` this is a
+    query.  Otherwise it is a scan of all the owner's items on that
+    side, to be trimmed by nearest_item(); the scan always reads
+    `create_time`, which nearest_item() orders by.
+    '''
+    if OWNER_TIME_INDEX in indexes:
+        if forward:
+            after = Key('create_time').gt(create_time)
+        else:
+            after = Key('create_time').lt(create_time)
+        kwargs = {
+            'IndexName': OWNER_TIME_INDEX,
+            'KeyConditionExpression': Key('Owner').eq(owner) & after,
+            'ScanIndexForward': forward,
+            'Limit': limit}
+        kwargs.update(projection(fields))
+        return 'query', kwargs
+
+    if forward:
+        after = Attr('create_time').gt(create_time)
+    else:
+        after = Attr('create_time').lt(create_time)
+    kwargs = {'FilterExpression': Attr('Owner').eq(owner) & after}
+    if fields and 'create_time' not in fields:
+        fields = fields + ['create_time']
+    kwargs.update(projection(fields))
+    return 'scan', kwargs
+
+
+def nearest_item(response, forward, limit=1, fields=None):
+    '''
+    Trim a scan made by adjacent_request() to the `limit` items nearest
+    the starting time, so it has the shape of the query
+
+    `fields` are those given to adjacent_request(); a `create_time`
+    read only for ordering is dropped.
+    '''
+    items = sorted(response['Items'],
+                   key=lambda item: item['create_time'],
+                   reverse=not forward)[:limit]
+    if fields and 'create_time' not in fields:
+        for item in items:
+            del item['create_time']
+    response['Items'] = items
+    response['Count'] = len(items)
+    return response
+
+
+def cursor_args(args, owner):
+    '''
+    Return (forward, create_time, start_key) for a `/cursor` request
+    for `owner`'s tracks
+
+    `direction` is "next" (the default) or "prev".  The position is
+    given by either a `cursor` returned by an earlier call, decoded
+    into `start_key`, or a `create_time`; with neither, the call reads
+    the owner's first track (or last, going back).  Raises ValueError
+    if `owner` is empty or an argument is malformed.
+    '''
+    if not owner:
+        raise ValueError('owner is required')
+    direction = args.get('direction', 'next')
+    if direction not in ('next', 'prev'):
+        raise ValueError('direction must be next or prev')
+    create_time = None
+    start_key = None
+    if args.get('cursor'):
+        try:
+            start_key = decode_token(args.get('cursor'))
+        except Exception:
+            raise ValueError('malformed cursor')
+        if not isinstance(start_key, dict) or start_key.get('Owner') != owner:
+            raise ValueError('cursor is not one of this owner\'s tracks')
+    elif args.get('create_time') is not None:
+        create_time = int(args.get('create_time'))
+    return direction == 'next', create_time, start_key
+
+
+def cursor_request(owner, forward, indexes, create_time=None, start_key=None):
+    '''
+    Return (operation, kwargs) reading the owner's track adjacent to a
+    position, as parsed by cursor_args()
+
+    With the (Owner, create_time) index among `indexes` this is a
+    one-item query, resuming from `start_key` when there is one.
+    Otherwise it is a scan of all the owner's items, from which
+    cursor_pick() chooses the track.
+    '''
+    if OWNER_TIME_INDEX not in indexes:
+        return 'scan', {'FilterExpression': Attr('Owner').eq(owner)}
+
+    condition = Key('Owner').eq(owner)
+    kwargs = {'IndexName': OWNER_TIME_INDEX,
+              'ScanIndexForward': forward,
+              'Limit': 1}
+    if start_key is not None:
+        kwargs['ExclusiveStartKey'] = start_key
+    elif create_time is not None and forward:
+        condition = condition & Key('create_time').gt(create_time)
+    elif create_time is not None:
+        condition = condition & Key('create_time').lt(create_time)
+    kwargs['KeyConditionExpression'] = condition
+    return 'query', kwargs
+
+
+def cursor_pick(items, table_id, forward, create_time=None, start_key=None):
+    '''
+    Return the track adjacent to a position among all of an owner's
+    `items`, read by the scan of cursor_request(), or None
+    '''
+    def position(item):
+        return (item['create_time'], item[table_id])
+
+    def beyond(item):
+        if start_key is not None:
+            here, start = position(item), position(start_key)
+        elif create_time is not None:
+            here, start = item['create_time'], create_time
+        else:
+            return True
+        return here > start if forward else here < start
+
+    for item in sorted(items, key=position, reverse=not forward):
+        if beyond(item):
+            return item
+    return None
+
+
+def cursor_response(item, table_id, wrapped):
+    '''
+    Return the `/cursor` response for the track `item` (or None)
+
+    The response has the shape of a query with at most one item in
+    `Items`, plus the `cursor` from which to continue and whether
+    the call `wrapped` around the end of the playlist.
+    '''
+    if item is None:
+        return {"Items": [], "Count": 0, "wrapped": False}
+    cursor = encode_token({table_id: item[table_id],
+                           'Owner': item['Owner'],
+                           'create_time': item['create_time']})
+    return {"Items": [item], "Count": 1, "cursor": cursor,
+            "wrapped": wrapped}
+
+
+def update_args(args):
+    '''
+    Return (add, version, return_values) of an `/update` request
+
+    `add` names the attributes whose values in the body are added to
+    the stored ones rather than replacing them.  `version` is the
+    value of VERSION_ATTR the item must have for the update to apply
+    (0 for an item without one), or "*" for any; either way the update
+    increments it.  `return_values` is a DynamoDB ReturnValues.  Raises
+    ValueError if an argument is malformed.
+    '''
+    add = names_arg(args, 'add') or []
+    version = args.get('version')
+    if version is not None and version != '*':
+        version = int(version)
+        if version < 0:
+            raise ValueError('version must not be negative')
+    return_values = args.get('return_values', 'NONE')
+    if return_values not in RETURN_VALUES:
+        raise ValueError('unknown return_values ' + return_values)
+    return add, version, return_values
+
+
+@functools.lru_cache(maxsize=UPDATE_CACHE_SIZE)
+def update_expressions(set_names, add_names, check):
+    '''
+    Return (UpdateExpression, ConditionExpression,
+    ExpressionAttributeNames) for an update
+
+    Only the names, not the values, of the attributes set and added
+    go into the strings, so calls with the same attribute names share
+    them.  The values are bound by update_request() as `:s0`, `:s1`,
+    ... for `set_names` and `:a0`, ... for `add_names`, in order.
+    `check` is None for an unversioned update; otherwise the update
+    increments the version, and it applies to any item ("any"), an
+    item without a version ("absent") or one with version `:ve`
+    ("equal").  ConditionExpression is None for the first two.
+    '''
+    names = {}
+    sets = []
+    adds = []
+    for i, name in enumerate(set_names):
+        names['#s{}'.format(i)] = name
+        sets.append('#s{0} = :s{0}'.format(i))
+    for i, name in enumerate(add_names):
+        names['#a{}'.format(i)] = name
+        adds.append('#a{0} :a{0}'.format(i))
+    if check is not None:
+        names['#v'] = VERSION_ATTR
+        sets.append('#v = if_not_exists(#v, :v0) + :v1')
+    condition = {'absent': 'attribute_not_exists(#v)',
+                 'equal': '#v = :ve'}.get(check)
+    expression = []
+    if sets:
+        expression.append('SET ' + ', '.join(sets))
+    if adds:
+        expression.append('ADD ' + ', '.join(adds))
+    return ' '.join(expression), condition, names
+
+
+def update_request(table_id, objkey, content, add=(), version=None,
+                   return_values='NONE'):
+    '''
+    Return update_item() arguments setting the attributes in `content`
+
+    The attributes named in `add` are instead incremented by their
+    values in `content` (an atomic counter; a set value adds members).
+    `version` and `return_values` are as returned by update_args().
+    Raises ValueError if `add` names an attribute not in `content`,
+    `content` sets the version itself or there is nothing to update.
+    '''
+    if set(add) - set(content):
+        raise ValueError('add names an attribute without a value')
+    if VERSION_ATTR in content:
+        raise ValueError(VERSION_ATTR + ' is set by the version argument')
+    set_names = tuple(sorted(k for k in content if k not in add))
+    add_names = tuple(sorted(add))
+    if version is None:
+        check = None
+    elif version == '*':
+        check = 'any'
+    else:
+        check = 'equal' if version else 'absent'
+    if not (set_names or add_names or check):
+        raise ValueError('nothing to update')
+    expression, condition, names = update_expressions(
+        set_names, add_names, check)
+
+    values = {}
+    for i, name in enumerate(set_names):
+        values[':s{}'.format(i)] = content[name]
+    for i, name in enumerate(add_names):
+        values[':a{}'.format(i)] = content[name]
+    if check is not None:
+        values.update({':v0': 0, ':v1': 1})
+    if check == 'equal':
+        values[':ve'] = version
+    kwargs = {'Key': {table_id: objkey},
+              'UpdateExpression': expression,
+              # A copy, as boto3 may add to it
+              'ExpressionAttributeNames': dict(names),
+              'ExpressionAttributeValues': values,
+              'ReturnValues': return_values}
+    if condition is not None:
+        kwargs['ConditionExpression'] = condition
+    return kwargs
+
+
+def chunks(seq, size):
+    '''Yield successive slices of `seq` of at most `size` elements'''
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def backoff_sec(attempt):
+    '''Return the delay before retry number `attempt` (1, 2, ...) of a batch'''
+    return BATCH_BACKOFF_SEC * 2 ** (attempt - 1)
+
+
+def batch_read_results(objkeys, table_id, items, unprocessed):
+    '''Return the `/batch_read` status of each of `objkeys`'''
+    found = {item[table_id] for item in items}
+    pending = {key[table_id] for key in unprocessed}
+    results = []
+    for k in objkeys:
+        if k in found:
+            status = 'found'
+        elif k in pending:
+            status = 'unprocessed'
+        else:
+            status = 'not_found'
+        results.append({table_id: k, 'status': status})
+    return results
+
+
+def batch_write_requests(table_id, items, deletes):
+    '''
+    Return (writes, results) for a `/batch_write`
+
+    `writes` are the PutRequest/DeleteRequest dicts for BatchWriteItem
+    and `results` one entry per item and delete, in request order.
+    Items without a `uuid` are given a new one.  BatchWriteItem
+    rejects two requests for one key, so the last request for a key
+    wins.
+    '''
+    writes = {}
+    results = []
+    for item in items:
+        payload = dict(item)
+        payload[table_id] = payload.pop('uuid', None) or str(uuid.uuid4())
+        writes[payload[table_id]] = {'PutRequest': {'Item': payload}}
+        results.append({table_id: payload[table_id], 'op': 'put'})
+    for objkey in deletes:
+        writes[objkey] = {'DeleteRequest': {'Key': {table_id: objkey}}}
+        results.append({table_id: objkey, 'op': 'delete'})
+    return list(writes.values()), results
+
+
+def write_key(write, table_id):
+    '''Return the key value of a PutRequest or DeleteRequest'''
+    if 'PutRequest' in write:
+        return write['PutRequest']['Item'][table_id]
+    return write['DeleteRequest']['Key'][table_id]
+
+
+def batch_write_response(table_id, writes, results, unprocessed):
+    '''Return the `/batch_write` response, marking unprocessed writes'''
+    pending = {write_key(w, table_id) for w in unprocessed}
+    for r in results:
+        r['status'] = 'unprocessed' if r[table_id] in pending else 'ok'
+    return {"Count": len(writes) - len(pending), "results": results}
+
+
+def delete_music_response(table_id, items, unprocessed):
+    '''
+    Return the `/delete_music` response: the deleted `items`, their
+    count and the keys of those left, as `unprocessed` DeleteRequests
+    '''
+    pending = {write_key(w, table_id) for w in unprocessed}
+    deleted = [item for item in items if item[table_id] not in pending]
+    return {"Items": deleted,
+            "Count": len(deleted),
+            "unprocessed": sorted(pending)}
+
+
+def batch_update_requests(table_id, updates):
+    '''
+    Return the update_item() arguments of each of `updates`
+
+    Each update is `{"objkey": ..., "item": {...}, "add": [...]}`,
+    applied as an `/update` of `objkey` with `item` as the body and
+    `add` as that argument.  Raises ValueError if one is malformed.
+    '''
+    calls = []
+    for u in updates:
+        if 'objkey' not in u:
+            raise ValueError('update without objkey')
+        calls.append(update_request(
+            table_id, u['objkey'], u.get('item', {}), u.get('add', ())))
+    return calls
+
+
+def batch_update_response(table_id, calls, errors):
+    '''
+    Return the `/batch_update` response
+
+    `errors` holds the error message of each of `calls` (arguments
+    from batch_update_requests()) that failed, or None for those
+    applied.
+    '''
+    results = []
+    for r, error in zip(calls, errors):
+        result = {table_id: r['Key'][table_id],
+                  'status': 'ok' if error is None else 'error'}
+        if error is not None:
+            result['reason'] = error
+        results.append(result)
+    return {"Count": errors.count(None), "results": results}
+
+
+def decode_auth_token(token):
+    '''Given an auth token in Base64 encoding, return the original string'''
+    return base64.standard_b64decode(token).decode()
+
+
+def is_loader(headers, loader_token):
+    '''Return True if `headers` authorize the caller to do a `/load` '''
+    if 'Authorization' not in headers:
+        return False
+    # Auth string is 'Basic ' concatenated with base64 encoding of uname:passwd
+    auth_string = headers['Authorization'].split()[1]
+    name, pwd = decode_auth_token(auth_string).split(':')
+    if name != 'svc-loader' or pwd != loader_token:
+        return False
+    return True
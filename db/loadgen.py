@@ -0,0 +1,95 @@
+"""
+SFU CMPT 756
+Closed-loop load generation shared by the benchmarks: `bench.py` here,
+of the database service, and `bench/bench.py`, of the music services.
+
+Each simulated user is a thread that makes one request after another,
+waiting for each response, so the load follows the service's latency.
+"""
+
+# Standard library modules
+import concurrent.futures
+import threading
+import time
+
+
+def percentile(ordered, p):
+    """Return the `p`th percentile of a sorted list, by nearest rank."""
+    if len(ordered) == 0:
+        return None
+    rank = max(int(round(p / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def user(request, pause, measure_from, deadline):
+    """
+    Call `request` until `deadline`.
+
+    Returns (latencies in seconds of the calls started after
+    `measure_from`, number of those that failed).
+    """
+    latencies = []
+    errors = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        measured = time.monotonic() >= measure_from
+        ok = request()
+        if measured:
+            latencies.append(time.perf_counter() - start)
+            errors += 0 if ok else 1
+        if pause:
+            time.sleep(pause)
+    return latencies, errors
+
+
+def run(new_user, users, duration, warmup=0, pause=0,
+        percentiles=(50, 99)):
+    """
+    Run `users` concurrent users; return their statistics.
+
+    Parameters
+    ----------
+    new_user: function
+        Called once per user, returning the function that makes one of
+        its requests and returns True if it succeeded.
+    users: int
+        Number of concurrent users.
+    duration: float
+        Seconds to measure, after `warmup` seconds unmeasured.
+    warmup: float
+        Seconds to run before measuring.
+    pause: float
+        Seconds each user waits between requests.
+    percentiles: tuple of int
+        Latency percentiles to report, as `p<N>_ms`.
+
+    Returns
+    -------
+    dict
+        The users, measured requests, errors, throughput (requests per
+        second) and latency percentiles in ms (None if no request was
+        measured).
+    """
+    start = threading.Barrier(users + 1)
+    times = {}
+
+    def started_user():
+        request = new_user()
+        start.wait()
+        return user(request, pause, times['measure_from'], times['deadline'])
+
+    with concurrent.futures.ThreadPoolExecutor(users) as pool:
+        futures = [pool.submit(started_user) for _ in range(users)]
+        times['measure_from'] = time.monotonic() + warmup
+        times['deadline'] = times['measure_from'] + duration
+        start.wait()
+        results = [f.result() for f in futures]
+    latencies = sorted(lat for lats, _ in results for lat in lats)
+    stats = {'users': users,
+             'requests': len(latencies),
+             'errors': sum(errors for _, errors in results),
+             'throughput_rps': len(latencies) / duration}
+    for p in percentiles:
+        value = percentile(latencies, p)
+        stats['p{}_ms'.format(p)] = None if value is None else 1000 * value
+    return stats
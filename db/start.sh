@@ -0,0 +1,27 @@
+#!/bin/sh
+# Start the database service on port $1 with the server named by APP_SERVER:
+#   flask     Flask's threaded development server running app.py (the default)
+#   gunicorn  Gunicorn worker processes running app.py, configured by
+#             gunicorn.conf.py
+#   asgi      uvicorn running the asyncio build, app_async.py
+set -o nounset
+set -o errexit
+if [ $# -ne 1 ]; then
+  echo "Usage: $0 PORT"
+  exit 1
+fi
+case "${APP_SERVER:-flask}" in
+  flask)
+    exec python app.py $1
+    ;;
+  gunicorn)
+    exec gunicorn --config gunicorn.conf.py --bind 0.0.0.0:$1 app:app
+    ;;
+  asgi)
+    exec python app_async.py $1
+    ;;
+  *)
+    echo "Unknown APP_SERVER '${APP_SERVER}': must be flask, gunicorn or asgi"
+    exit 1
+    ;;
+esac
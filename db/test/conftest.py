@@ -0,0 +1,77 @@
+"""
+Configure for pytest.
+
+Runs the tests of the database service's modules, none of which need
+DynamoDB.  From the `db` directory:
+
+    python -m pytest test
+
+The backend tests run each case against every stand-in backend:
+`memory` and `sqlite`, the latter in a new file for every test.  The
+route tests call the Flask build, rendered from `app-tpl.py` as
+`make templates` would, on the memory backend.
+"""
+
+# Standard libraries
+import importlib.util
+import os
+import sys
+from unittest import mock
+
+# Installed packages
+import pytest
+
+# The modules under test are in the directory above, and those it
+# shares with other services in `shared/`, whose copies may be stale
+DB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DB_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(DB_DIR), 'shared'))
+
+# The table suffix of the rendered app.py
+TABLE_SUFFIX = 'test'
+
+# Local modules
+import common  # noqa: E402
+from backends import memory, sqlite  # noqa: E402
+
+
+def memory_resource():
+    return memory.Resource(common.TABLE_INDEXES, common.INDEX_KEYS,
+                           common.ATTRIBUTE_TYPES)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def resource(request, tmp_path):
+    """Return an empty resource of each stand-in backend."""
+    if request.param == 'memory':
+        return memory_resource()
+    return sqlite.Resource(str(tmp_path / 'datastore.sqlite3'),
+                           common.TABLE_INDEXES, common.INDEX_KEYS,
+                           common.ATTRIBUTE_TYPES)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """Return the Flask build's module, serving the memory backend."""
+    path = tmp_path_factory.mktemp('app') / 'app.py'
+    with open(os.path.join(DB_DIR, 'app-tpl.py')) as tpl:
+        path.write_text(tpl.read().replace('ZZ-REG-ID', TABLE_SUFFIX))
+    spec = importlib.util.spec_from_file_location('app', str(path))
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ, {'DB_BACKEND': 'memory'}):
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def app_tables(request, app_module):
+    """Give the Flask build empty tables; return their resource."""
+    app_module.dynamodb = memory_resource()
+    app_module.table_indexes.clear()
+    return app_module.dynamodb
+
+
+@pytest.fixture
+def client(request, app_module, app_tables):
+    """Return a test client of the Flask build, with empty tables."""
+    return app_module.app.test_client()
@@ -0,0 +1,268 @@
+"""
+Test the stand-in backends as the datastore routes call them.
+
+Every test runs against each backend of the `resource` fixture in
+`conftest.py`, so the SQLite backend is held to the same responses as
+the in-memory one: single-item calls with their conditions and
+ReturnValues, queries of both indexes in both directions, and the
+paging of queries, scans and parallel scan segments.
+"""
+
+# Standard libraries
+from decimal import Decimal
+
+# Installed packages
+from boto3.dynamodb.conditions import Attr, Key
+
+from botocore.exceptions import ClientError
+
+import pytest
+
+# Local modules
+import common
+
+
+@pytest.fixture
+def playlist(request, resource):
+    """A Playlist table of two owners' tracks, create_time 1 to 10."""
+    table = resource.Table('Playlist-test')
+    for t in range(1, 11):
+        table.put_item(Item={'playlist_id': 'p{:02}'.format(t),
+                             'Owner': 'Ann' if t % 2 else 'Bob',
+                             'SongTitle': 'Song {:02}'.format(t),
+                             'Artist': 'Artist {}'.format(t % 3),
+                             'create_time': t})
+    return table
+
+
+def error_code(info):
+    return info.value.response['Error']['Code']
+
+
+def ids(items):
+    return [i['playlist_id'] for i in items]
+
+
+def read_all(call, **kwargs):
+    """Return the items and page count of paging through `call`."""
+    items, pages = [], 0
+    while True:
+        response = call(**kwargs)
+        items += response['Items']
+        pages += 1
+        if 'LastEvaluatedKey' not in response:
+            return items, pages
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def test_put_get_delete(resource):
+    table = resource.Table('Music-test')
+    table.put_item(Item={'music_id': 'm1', 'Artist': 'A', 'n': 1,
+                         'tags': {'x'}, 'raw': b'\x00\xff'})
+    item = table.get_item(Key={'music_id': 'm1'})['Item']
+    assert item == {'music_id': 'm1', 'Artist': 'A', 'n': Decimal(1),
+                    'tags': {'x'}, 'raw': item['raw']}
+    assert item['raw'].value == b'\x00\xff'
+    assert table.get_item(
+        Key={'music_id': 'm1'}, ProjectionExpression='#a',
+        ExpressionAttributeNames={'#a': 'Artist'})['Item'] == {'Artist': 'A'}
+    table.delete_item(Key={'music_id': 'm1'})
+    assert 'Item' not in table.get_item(Key={'music_id': 'm1'})
+
+
+def test_bad_items_and_keys(resource):
+    table = resource.Table('Music-test')
+    with pytest.raises(ClientError) as info:
+        table.put_item(Item={'Artist': 'A'})
+    assert error_code(info) == 'ValidationException'
+    with pytest.raises(ClientError) as info:
+        table.put_item(Item={'music_id': 'm1', 'Owner': 5})
+    assert error_code(info) == 'ValidationException'
+    with pytest.raises(ClientError) as info:
+        table.get_item(Key={'uuid': 'm1'})
+    assert error_code(info) == 'ValidationException'
+
+
+def test_conditional_writes(resource):
+    table = resource.Table('Music-test')
+    absent = {'ConditionExpression': 'attribute_not_exists(music_id)'}
+    table.put_item(Item={'music_id': 'm1', 'n': 1}, **absent)
+    with pytest.raises(ClientError) as info:
+        table.put_item(Item={'music_id': 'm1', 'n': 2}, **absent)
+    assert error_code(info) == 'ConditionalCheckFailedException'
+    old = table.put_item(Item={'music_id': 'm1', 'n': 3},
+                         ReturnValues='ALL_OLD')['Attributes']
+    assert old['n'] == 1
+    with pytest.raises(ClientError) as info:
+        table.delete_item(Key={'music_id': 'm1'},
+                          ConditionExpression=Attr('n').eq(4))
+    assert error_code(info) == 'ConditionalCheckFailedException'
+    table.delete_item(Key={'music_id': 'm1'},
+                      ConditionExpression=Attr('n').eq(3))
+    assert 'Item' not in table.get_item(Key={'music_id': 'm1'})
+
+
+def test_update(resource):
+    table = resource.Table('Music-test')
+    request = common.update_request('music_id', 'm1', {'Artist': 'A',
+                                                       'plays': 2},
+                                    add=('plays',), version=0,
+                                    return_values='UPDATED_NEW')
+    response = table.update_item(**request)
+    # An item without a version is at version 0
+    assert response['Attributes'] == {'Artist': 'A', 'plays': 2,
+                                      'version': 1}
+    with pytest.raises(ClientError) as info:
+        table.update_item(**request)
+    assert error_code(info) == 'ConditionalCheckFailedException'
+    request = common.update_request('music_id', 'm1', {'plays': 3},
+                                    add=('plays',), version=1,
+                                    return_values='ALL_NEW')
+    assert table.update_item(**request)['Attributes'] == {
+        'music_id': 'm1', 'Artist': 'A', 'plays': 5, 'version': 2}
+    with pytest.raises(ClientError) as info:
+        table.update_item(Key={'music_id': 'm1'},
+                          UpdateExpression='SET music_id = :v',
+                          ExpressionAttributeValues={':v': 'm2'})
+    assert error_code(info) == 'ValidationException'
+
+
+def test_update_keeps_index_in_step(resource, playlist):
+    playlist.update_item(Key={'playlist_id': 'p01'},
+                         UpdateExpression='SET #o = :o',
+                         ExpressionAttributeNames={'#o': 'Owner'},
+                         ExpressionAttributeValues={':o': 'Bob'})
+    response = playlist.query(IndexName=common.OWNER_TIME_INDEX,
+                              KeyConditionExpression=Key('Owner').eq('Bob'))
+    assert ids(response['Items']) == ['p01', 'p02', 'p04', 'p06', 'p08',
+                                      'p10']
+
+
+def test_query_by_key(resource, playlist):
+    response = playlist.query(
+        KeyConditionExpression=Key('playlist_id').eq('p03'))
+    assert ids(response['Items']) == ['p03']
+    with pytest.raises(ClientError) as info:
+        playlist.query(KeyConditionExpression=Key('Owner').eq('Ann'))
+    assert error_code(info) == 'ValidationException'
+
+
+def test_query_order_and_key_conditions(resource, playlist):
+    def query(condition, forward=True, index=common.OWNER_TIME_INDEX,
+              **kwargs):
+        return ids(playlist.query(
+            IndexName=index, KeyConditionExpression=condition,
+            ScanIndexForward=forward, **kwargs)['Items'])
+    ann = Key('Owner').eq('Ann')
+    assert query(ann) == ['p01', 'p03', 'p05', 'p07', 'p09']
+    assert query(ann, False) == ['p09', 'p07', 'p05', 'p03', 'p01']
+    assert query(ann & Key('create_time').gt(5)) == ['p07', 'p09']
+    assert query(ann & Key('create_time').lte(5), False) == ['p05', 'p03',
+                                                             'p01']
+    between = ann & Key('create_time').between(3, 7)
+    assert query(between) == ['p03', 'p05', 'p07']
+    assert query('#o = :o AND create_time < :t', False,
+                 ExpressionAttributeNames={'#o': 'Owner'},
+                 ExpressionAttributeValues={':o': 'Ann', ':t': 4}) == [
+                     'p03', 'p01']
+    titles = playlist.query(
+        IndexName=common.OWNER_TITLE_INDEX,
+        KeyConditionExpression=Key('Owner').eq('Bob')
+        & Key('SongTitle').begins_with('Song 1'))['Items']
+    assert ids(titles) == ['p10']
+    assert query(Key('Owner').eq('Nobody')) == []
+    with pytest.raises(ClientError) as info:
+        query(ann, index='No-index')
+    assert error_code(info) == 'ValidationException'
+
+
+@pytest.mark.parametrize('forward', [True, False])
+def test_query_paging(resource, playlist, forward):
+    expected = ['p01', 'p03', 'p05', 'p07', 'p09']
+    if not forward:
+        expected.reverse()
+    items, pages = read_all(
+        playlist.query, IndexName=common.OWNER_TIME_INDEX,
+        KeyConditionExpression=Key('Owner').eq('Ann'),
+        ScanIndexForward=forward, Limit=2)
+    assert ids(items) == expected
+    assert pages == 3
+
+
+def test_query_limit_counts_before_filter(resource, playlist):
+    response = playlist.query(
+        IndexName=common.OWNER_TIME_INDEX,
+        KeyConditionExpression=Key('Owner').eq('Ann'),
+        FilterExpression=Attr('Artist').eq('Artist 0'), Limit=3)
+    assert ids(response['Items']) == ['p03']
+    assert (response['Count'], response['ScannedCount']) == (1, 3)
+    assert response['LastEvaluatedKey'] == {
+        'playlist_id': 'p05', 'Owner': 'Ann', 'create_time': 5}
+
+
+def test_query_projection_and_count(resource, playlist):
+    response = playlist.query(
+        IndexName=common.OWNER_TIME_INDEX,
+        KeyConditionExpression=Key('Owner').eq('Bob'),
+        ProjectionExpression='#t', ExpressionAttributeNames={
+            '#t': 'SongTitle'}, Limit=1)
+    assert response['Items'] == [{'SongTitle': 'Song 02'}]
+    response = playlist.query(
+        IndexName=common.OWNER_TIME_INDEX,
+        KeyConditionExpression=Key('Owner').eq('Bob'), Select='COUNT')
+    assert 'Items' not in response and response['Count'] == 5
+
+
+def test_scan(resource, playlist):
+    response = playlist.scan()
+    assert sorted(ids(response['Items'])) == ids(response['Items'])
+    assert response['Count'] == 10
+    response = playlist.scan(FilterExpression=Attr('Artist').eq('Artist 1')
+                             & Attr('create_time').gte(4))
+    assert ids(response['Items']) == ['p04', 'p07', 'p10']
+    response = playlist.scan(FilterExpression=Attr('SongTitle').begins_with(
+        'Song 0') & Attr('Owner').eq('Bob'))
+    assert ids(response['Items']) == ['p02', 'p04', 'p06', 'p08']
+
+
+def test_scan_paging(resource, playlist):
+    items, pages = read_all(playlist.scan, Limit=3)
+    assert ids(items) == ['p{:02}'.format(t) for t in range(1, 11)]
+    assert pages == 4
+    items, _ = read_all(playlist.scan, Limit=4,
+                        FilterExpression=Attr('Artist').eq('Artist 2'))
+    assert ids(items) == ['p02', 'p05', 'p08']
+
+
+@pytest.mark.parametrize('total', [1, 3, 4])
+def test_scan_segments(resource, playlist, total):
+    segments = [read_all(playlist.scan, Segment=s, TotalSegments=total,
+                         Limit=2)[0]
+                for s in range(total)]
+    found = [i for items in segments for i in ids(items)]
+    assert sorted(found) == ['p{:02}'.format(t) for t in range(1, 11)]
+    for items in segments:
+        assert ids(items) == sorted(ids(items))
+
+
+def test_batch_calls(resource):
+    response = resource.batch_write_item(RequestItems={
+        'Music-test': [{'PutRequest': {'Item': {'music_id': 'm1'}}},
+                       {'PutRequest': {'Item': {'music_id': 'm2'}}}],
+        'User-test': [{'PutRequest': {'Item': {'user_id': 'u1'}}}]})
+    assert response['UnprocessedItems'] == {}
+    resource.batch_write_item(RequestItems={
+        'Music-test': [{'DeleteRequest': {'Key': {'music_id': 'm2'}}}]})
+    response = resource.batch_get_item(RequestItems={
+        'Music-test': {'Keys': [{'music_id': 'm1'}, {'music_id': 'm2'}]},
+        'User-test': {'Keys': [{'user_id': 'u1'}]}})
+    assert response['Responses'] == {'Music-test': [{'music_id': 'm1'}],
+                                     'User-test': [{'user_id': 'u1'}]}
+    assert response['UnprocessedKeys'] == {}
+
+
+def test_table_description(resource):
+    table = resource.Table('Playlist-test')
+    assert {i['IndexName'] for i in table.global_secondary_indexes} == {
+        common.OWNER_TITLE_INDEX, common.OWNER_TIME_INDEX}
+    assert resource.Table('User-test').global_secondary_indexes is None
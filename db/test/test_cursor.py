@@ -0,0 +1,151 @@
+"""
+Test the playlist cursor: the request helpers of `common.py` and the
+`/cursor` route of the Flask build.
+
+The route is called on the Playlist table, which has the
+(Owner, create_time) index and is read by one-item queries, and on the
+Music table, which lacks it and is read by a scan.
+"""
+
+# Standard libraries
+from decimal import Decimal
+
+# Installed packages
+import pytest
+
+# Local modules
+import common
+from conftest import TABLE_SUFFIX
+
+URL = '/api/v1/datastore/cursor'
+
+
+@pytest.fixture
+def tracks(request):
+    """Ann's three tracks, the last two created at the same time."""
+    return [{'playlist_id': 'p1', 'Owner': 'Ann', 'create_time': Decimal(10)},
+            {'playlist_id': 'p2', 'Owner': 'Ann', 'create_time': Decimal(20)},
+            {'playlist_id': 'p3', 'Owner': 'Ann', 'create_time': Decimal(20)}]
+
+
+def test_cursor_args():
+    assert common.cursor_args({}, 'Ann') == (True, None, None)
+    assert common.cursor_args({'direction': 'prev', 'create_time': '5'},
+                              'Ann') == (False, 5, None)
+    token = common.encode_token({'playlist_id': 'p1', 'Owner': 'Ann',
+                                 'create_time': 10})
+    # A cursor takes precedence over a create_time
+    assert common.cursor_args({'cursor': token, 'create_time': '5'},
+                              'Ann') == (True, None, {
+                                  'playlist_id': 'p1', 'Owner': 'Ann',
+                                  'create_time': 10})
+
+
+@pytest.mark.parametrize('args, owner', [
+    ({}, ''),
+    ({}, None),
+    ({'direction': 'up'}, 'Ann'),
+    ({'create_time': 'now'}, 'Ann'),
+    ({'cursor': 'not a cursor'}, 'Ann'),
+    ({'cursor': common.encode_token({'Owner': 'Bob'})}, 'Ann'),
+    ({'cursor': common.encode_token(['Ann'])}, 'Ann'),
+])
+def test_cursor_args_rejected(args, owner):
+    with pytest.raises(ValueError):
+        common.cursor_args(args, owner)
+
+
+def test_cursor_pick(tracks):
+    def pick(forward, **kwargs):
+        item = common.cursor_pick(tracks, 'playlist_id', forward, **kwargs)
+        return None if item is None else item['playlist_id']
+    assert pick(True) == 'p1'
+    assert pick(False) == 'p3'
+    assert pick(True, create_time=10) == 'p2'
+    assert pick(False, create_time=20) == 'p1'
+    # Tracks created at the same time are ordered by key
+    assert pick(True, start_key=tracks[1]) == 'p3'
+    assert pick(False, start_key=tracks[2]) == 'p2'
+    # Past either end
+    assert pick(True, start_key=tracks[2]) is None
+    assert pick(False, create_time=10) is None
+
+
+def test_cursor_response(tracks):
+    assert common.cursor_response(None, 'playlist_id', False) == {
+        'Items': [], 'Count': 0, 'wrapped': False}
+    response = common.cursor_response(tracks[1], 'playlist_id', True)
+    assert response['Items'] == [tracks[1]]
+    assert (response['Count'], response['wrapped']) == (1, True)
+    assert common.decode_token(response['cursor']) == tracks[1]
+
+
+@pytest.fixture(params=['playlist', 'music'])
+def objtype(request, app_tables, tracks):
+    """The type of a table holding `tracks`, with and without the index."""
+    table = app_tables.Table(request.param.capitalize() + '-' + TABLE_SUFFIX)
+    for track in tracks:
+        item = dict(track)
+        item[request.param + '_id'] = item.pop('playlist_id')
+        table.put_item(Item=item)
+    table.put_item(Item={request.param + '_id': 'b1', 'Owner': 'Bob',
+                         'create_time': 15})
+    return request.param
+
+
+def walk(client, objtype, direction, steps, **args):
+    """Return (key, wrapped) of `steps` successive `/cursor` calls."""
+    seen = []
+    query = dict(objtype=objtype, owner='Ann', direction=direction, **args)
+    for _ in range(steps):
+        response = client.get(URL, query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        if body['Count'] == 0:
+            seen.append((None, body['wrapped']))
+            break
+        seen.append((body['Items'][0][objtype + '_id'], body['wrapped']))
+        query['cursor'] = body['cursor']
+    return seen
+
+
+def test_wrap_forward(client, objtype):
+    assert walk(client, objtype, 'next', 5) == [
+        ('p1', False), ('p2', False), ('p3', False), ('p1', True),
+        ('p2', False)]
+
+
+def test_wrap_backward(client, objtype):
+    assert walk(client, objtype, 'prev', 5) == [
+        ('p3', False), ('p2', False), ('p1', False), ('p3', True),
+        ('p2', False)]
+
+
+def test_wrap_from_create_time(client, objtype):
+    assert walk(client, objtype, 'next', 1, create_time=20) == [
+        ('p1', True)]
+    assert walk(client, objtype, 'prev', 1, create_time=10) == [
+        ('p3', True)]
+
+
+def test_no_wrap(client, objtype):
+    assert walk(client, objtype, 'next', 5, create_time=10,
+                wrap='false') == [('p2', False), ('p3', False),
+                                  (None, False)]
+
+
+def test_empty_playlist(client):
+    assert walk(client, 'playlist', 'next', 2) == [(None, False)]
+
+
+@pytest.mark.parametrize('query', [
+    {'objtype': 'playlist'},
+    {'objtype': 'playlist', 'owner': ''},
+    {'objtype': 'playlist', 'owner': 'Ann', 'direction': 'up'},
+    {'objtype': 'playlist', 'owner': 'Bob',
+     'cursor': common.encode_token({'Owner': 'Ann'})},
+])
+def test_bad_request(client, query):
+    response = client.get(URL, query_string=query)
+    assert response.status_code == 400
+    assert response.get_json()['http_status_code'] == 400
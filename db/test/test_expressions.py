@@ -0,0 +1,244 @@
+"""
+Test the expression parser and evaluator of the stand-in backends.
+
+Each form of condition, projection and update expression that
+`backends/expressions.py` accepts is evaluated against small items,
+both as an expression string and, for conditions, as the boto3
+condition object the routes build.
+"""
+
+# Standard libraries
+from decimal import Decimal
+
+# Installed packages
+from boto3.dynamodb.conditions import Attr, Key
+
+from botocore.exceptions import ClientError
+
+import pytest
+
+# Local modules
+from backends import expressions
+from backends.expressions import Env
+
+
+@pytest.fixture
+def item(request):
+    return {'music_id': 'm1',
+            'Artist': 'Big Mama Thornton',
+            'SongTitle': 'Hound Dog',
+            'plays': Decimal(7),
+            'tags': {'blues', 'rnb'},
+            'history': [Decimal(1), Decimal(2)]}
+
+
+def holds(expression, item, values=None, names=None):
+    tree = expressions.condition(expression)
+    return expressions.evaluate(tree, item, Env(names, values))
+
+
+def error_code(info):
+    return info.value.response['Error']['Code']
+
+
+@pytest.mark.parametrize('expression, value, expected', [
+    ('plays = :v', 7, True),
+    ('plays = :v', 8, False),
+    ('plays <> :v', 8, True),
+    ('plays < :v', 8, True),
+    ('plays <= :v', 7, True),
+    ('plays > :v', 7, False),
+    ('plays >= :v', 7, True),
+    (':v < plays', 6, True),
+    ('SongTitle < :v', 'I', True),
+    ('SongTitle = :v', 'Hound Dog', True),
+])
+def test_comparisons(item, expression, value, expected):
+    assert holds(expression, item, {':v': value}) is expected
+
+
+def test_comparison_of_other_types_never_matches(item):
+    assert not holds('plays = :v', item, {':v': '7'})
+    assert not holds('plays < :v', item, {':v': '8'})
+    assert holds('plays <> :v', item, {':v': '7'})
+    assert not holds('missing = :v', item, {':v': 7})
+    assert holds('missing <> :v', item, {':v': 7})
+
+
+def test_between_and_in(item):
+    assert holds('plays BETWEEN :lo AND :hi', item, {':lo': 1, ':hi': 7})
+    assert not holds('plays BETWEEN :lo AND :hi', item, {':lo': 8, ':hi': 9})
+    assert holds('Artist IN (:a, :b)', item,
+                 {':a': 'Elvis Presley', ':b': 'Big Mama Thornton'})
+    assert not holds('Artist IN (:a)', item, {':a': 'Elvis Presley'})
+
+
+def test_boolean_operators_and_precedence(item):
+    values = {':yes': 7, ':no': 8}
+    assert holds('plays = :yes AND NOT plays = :no', item, values)
+    assert not holds('plays = :no AND plays = :yes', item, values)
+    assert holds('plays = :no OR plays = :yes', item, values)
+    # AND binds tighter than OR
+    assert holds('plays = :yes OR plays = :no AND plays = :no', item,
+                 values)
+    assert not holds('(plays = :yes OR plays = :no) AND plays = :no', item,
+                     values)
+    assert holds('NOT (plays = :no)', item, values)
+
+
+def test_functions(item):
+    assert holds('attribute_exists(plays)', item)
+    assert not holds('attribute_exists(missing)', item)
+    assert holds('attribute_not_exists(missing)', item)
+    assert holds('attribute_type(plays, :t)', item, {':t': 'N'})
+    assert holds('attribute_type(tags, :t)', item, {':t': 'SS'})
+    assert not holds('attribute_type(plays, :t)', item, {':t': 'S'})
+    assert holds('begins_with(SongTitle, :p)', item, {':p': 'Hound'})
+    assert not holds('begins_with(SongTitle, :p)', item, {':p': 'Dog'})
+    assert holds('contains(SongTitle, :s)', item, {':s': 'nd D'})
+    assert holds('contains(tags, :s)', item, {':s': 'blues'})
+    assert holds('contains(history, :n)', item, {':n': 2})
+    assert not holds('contains(missing, :s)', item, {':s': 'x'})
+
+
+def test_size(item):
+    assert holds('size(SongTitle) = :n', item, {':n': 9})
+    assert holds('size(tags) > :n', item, {':n': 1})
+    assert not holds('size(missing) >= :n', item, {':n': 0})
+
+
+def test_names_and_case(item):
+    assert holds('#t = :v and attribute_EXISTS(#p)', item,
+                 {':v': 'Hound Dog'}, {'#t': 'SongTitle', '#p': 'plays'})
+
+
+def test_condition_objects(item):
+    assert holds(Key('SongTitle').eq('Hound Dog') & Key('plays').gt(6), item)
+    assert holds(Key('plays').between(7, 8), item)
+    assert holds(Key('SongTitle').begins_with('Hou'), item)
+    assert holds(Attr('Artist').is_in(['Big Mama Thornton']), item)
+    assert holds(Attr('missing').not_exists() | Attr('plays').lt(0), item)
+    assert holds(~Attr('plays').ne(7), item)
+    assert holds(Attr('tags').contains('rnb'), item)
+    assert holds(Attr('SongTitle').size().eq(9), item)
+    assert holds(Attr('plays').attribute_type('N'), item)
+    assert not holds(Attr('plays').exists() & Attr('plays').lte(6), item)
+
+
+def test_undefined_placeholders(item):
+    with pytest.raises(ClientError) as info:
+        holds('plays = :v', item)
+    assert error_code(info) == 'ValidationException'
+    with pytest.raises(ClientError) as info:
+        holds('#p = :v', item, {':v': 7})
+    assert error_code(info) == 'ValidationException'
+
+
+@pytest.mark.parametrize('expression', [
+    'plays =', 'plays = :v AND', '(plays = :v', 'plays ! :v',
+    'plays BETWEEN :v', 'attribute_exists(:v)', 'plays = :v :v'])
+def test_syntax_errors(expression):
+    with pytest.raises(ClientError) as info:
+        expressions.condition(expression)
+    assert error_code(info) == 'ValidationException'
+
+
+def test_key_value():
+    env = Env({'#o': 'Owner'}, {':o': 'Ann', ':t': 5})
+    tree = expressions.condition('#o = :o AND create_time > :t')
+    assert expressions.key_value(tree, 'Owner', env) == 'Ann'
+    tree = expressions.condition(Key('Owner').eq('Ann')
+                                 & Key('SongTitle').begins_with('H'))
+    assert expressions.key_value(tree, 'Owner', env) == 'Ann'
+    with pytest.raises(ClientError):
+        expressions.key_value(tree, 'music_id', env)
+
+
+def test_projection(item):
+    env = Env({'#t': 'SongTitle'})
+    assert expressions.project(item, '#t, plays, missing', env) == {
+        'SongTitle': 'Hound Dog', 'plays': 7}
+    assert expressions.project(item, None, env) is item
+
+
+def update(expression, item, values=None, names=None):
+    actions = expressions.parse_update(expression)
+    return expressions.apply_update(actions, item, Env(names, values))
+
+
+def test_set(item):
+    new = update('SET Artist = :a, #n = :n', item,
+                 {':a': 'Elvis Presley', ':n': 1}, {'#n': 'new'})
+    assert new['Artist'] == 'Elvis Presley'
+    assert new['new'] == 1 and isinstance(new['new'], Decimal)
+    assert item['Artist'] == 'Big Mama Thornton'
+
+
+def test_set_arithmetic_and_functions(item):
+    new = update('SET plays = plays + :one, left = :ten - plays', item,
+                 {':one': 1, ':ten': 10})
+    assert new['plays'] == 8
+    # Every value is computed from the item before the update
+    assert new['left'] == 3
+    new = update('SET plays = if_not_exists(plays, :z), '
+                 'first = if_not_exists(first, :z)', item, {':z': 0})
+    assert new['plays'] == 7 and new['first'] == 0
+    new = update('SET history = list_append(history, :more)', item,
+                 {':more': [3]})
+    assert new['history'] == [1, 2, 3]
+    with pytest.raises(ClientError):
+        update('SET plays = SongTitle + :one', item, {':one': 1})
+    with pytest.raises(ClientError):
+        update('SET plays = missing', item)
+
+
+def test_remove(item):
+    new = update('REMOVE tags, missing', item)
+    assert 'tags' not in new and 'tags' in item
+
+
+def test_add(item):
+    new = update('ADD plays :one, count :one, tags :more', item,
+                 {':one': 1, ':more': {'jazz'}})
+    assert new['plays'] == 8
+    assert new['count'] == 1
+    assert new['tags'] == {'blues', 'rnb', 'jazz'}
+    with pytest.raises(ClientError):
+        update('ADD SongTitle :s', item, {':s': 'x'})
+    with pytest.raises(ClientError):
+        update('ADD plays :s', item, {':s': {'x'}})
+
+
+def test_delete(item):
+    new = update('DELETE tags :gone', item, {':gone': {'rnb'}})
+    assert new['tags'] == {'blues'}
+    new = update('DELETE tags :gone', item, {':gone': {'rnb', 'blues'}})
+    assert 'tags' not in new
+    with pytest.raises(ClientError):
+        update('DELETE plays :gone', item, {':gone': {'x'}})
+
+
+def test_several_clauses(item):
+    new = update('SET Artist = :a REMOVE history ADD plays :one', item,
+                 {':a': 'Elvis Presley', ':one': 1})
+    assert (new['Artist'], new['plays']) == ('Elvis Presley', 8)
+    assert 'history' not in new
+    assert expressions.update_paths(
+        expressions.parse_update('SET #a = :a ADD plays :one'),
+        Env({'#a': 'Artist'})) == ['Artist', 'plays']
+
+
+@pytest.mark.parametrize('expression', [
+    '', 'SET', 'SET plays', 'SET plays = ', 'ADD plays', 'INSERT plays :v',
+    'SET :v = plays'])
+def test_update_syntax_errors(expression):
+    with pytest.raises(ClientError) as info:
+        expressions.parse_update(expression)
+    assert error_code(info) == 'ValidationException'
+
+
+def test_normalize():
+    assert expressions.normalize({'n': 1, 'l': [2, {'s': {3}}]}) == {
+        'n': Decimal(1), 'l': [Decimal(2), {'s': {Decimal(3)}}]}
+    with pytest.raises(TypeError):
+        expressions.normalize(1.5)
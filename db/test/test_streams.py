@@ -0,0 +1,95 @@
+"""
+Test the streamed parallel scans of the Flask build: `/read_music` of a
+whole table and `/export`.
+
+A stream's segment scans run on threads of its own, which wait while
+its client is slow to read, so they must neither take `scan_pool` from
+the one-page scans nor outlive a client that goes away.
+"""
+
+# Standard libraries
+import concurrent.futures
+import contextlib
+import threading
+import time
+
+# Installed packages
+import pytest
+
+# Local modules
+import common
+from conftest import TABLE_SUFFIX
+
+# Far more one-item pages than a stream holds waiting
+ITEMS = 4 * common.SCAN_QUEUE_PAGES * 4
+
+
+@pytest.fixture
+def music(request, app_tables):
+    """A Music table of ITEMS items."""
+    table = app_tables.Table('Music-' + TABLE_SUFFIX)
+    for i in range(ITEMS):
+        table.put_item(Item={'music_id': 'm{:03}'.format(i), 'Artist': 'A'})
+    return table
+
+
+def stream_threads():
+    return [t for t in threading.enumerate()
+            if t.name.startswith('stream-scan')]
+
+
+def wait_for_no_stream_threads():
+    deadline = time.monotonic() + 5
+    while stream_threads() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return stream_threads()
+
+
+def starts():
+    return {s: None for s in range(common.SCAN_SEGMENTS)}
+
+
+def test_stream_reads_every_item(app_module, music):
+    with contextlib.closing(app_module.segment_pages(
+            music, {'Limit': 1}, starts(), common.SCAN_SEGMENTS)) as pages:
+        items = [i['music_id'] for _, page in pages for i in page['Items']]
+    assert sorted(items) == ['m{:03}'.format(i) for i in range(ITEMS)]
+    assert wait_for_no_stream_threads() == []
+
+
+def test_slow_streams_leave_scan_pool_free(app_module, music):
+    # Enough stalled streams to hold every scan_pool thread, were
+    # their scans on it
+    count = -(-common.SCAN_CONCURRENCY // common.SCAN_SEGMENTS)
+    streams = [app_module.segment_pages(music, {'Limit': 1}, starts(),
+                                        common.SCAN_SEGMENTS)
+               for _ in range(count)]
+    caller = concurrent.futures.ThreadPoolExecutor(1)
+    try:
+        for stream in streams:
+            next(stream)
+        page = caller.submit(
+            app_module.parallel_scan, music, {'Limit': 4}, starts(),
+            common.SCAN_SEGMENTS).result(timeout=5)
+        assert page['Count'] == 4
+    finally:
+        for stream in streams:
+            stream.close()
+        caller.shutdown(wait=False)
+    assert wait_for_no_stream_threads() == []
+
+
+@pytest.mark.parametrize('url', [
+    '/api/v1/datastore/read_music?objtype=music&limit=1&format=ndjson',
+    '/api/v1/datastore/export?objtype=music&limit=1',
+])
+def test_client_going_away_stops_the_scans(client, music, url):
+    response = client.get(url, buffered=False)
+    try:
+        assert response.status_code == 200
+        assert next(iter(response.response))
+        assert stream_threads()
+    finally:
+        # What the server does when the client closes the connection
+        response.close()
+    assert wait_for_no_stream_threads() == []
@@ -0,0 +1,32 @@
+#!/usr/bin/env bash
+# Run one of the simulations of gatling/simulations/proj756/WriteTables.scala,
+# passing the workload settings of this shell (MODEL, USERS, RATE, PHASES, ...)
+# into the container.  For example,
+#   MODEL=open RATE=20 PHASES=ramp,spike ./gatling-workload.sh WriteMusicSim
+if [[ $# -ne 1 ]]
+then
+  echo "Usage: ${0} SIM_NAME"
+  echo " Simulations: WriteUserSim WriteMusicSim WritePlaylistSim"
+  echo "              MixedUserSim MixedMusicSim MixedPlaylistSim MixedAllSim"
+  exit 1
+fi
+docker container run --detach --rm \
+  -v ${PWD}/gatling/results:/opt/gatling/results \
+  -v ${PWD}/gatling:/opt/gatling/user-files \
+  -v ${PWD}/gatling/target:/opt/gatling/target \
+  -e CLUSTER_IP=`tools/getip.sh kubectl istio-system svc/istio-ingressgateway` \
+  -e MODEL=${MODEL:-closed} \
+  -e PHASES=${PHASES:-ramp} \
+  -e USERS=${USERS:-10} \
+  -e RATE=${RATE:-10} \
+  -e RAMP_SEC=${RAMP_SEC:-60} \
+  -e HOLD_SEC=${HOLD_SEC:-60} \
+  -e SPIKE_FACTOR=${SPIKE_FACTOR:-5} \
+  -e SPIKE_SEC=${SPIKE_SEC:-30} \
+  -e SOAK_SEC=${SOAK_SEC:-1800} \
+  -e READ_PCT=${READ_PCT:-50} \
+  -e PAUSE_MS=${PAUSE_MS:-0} \
+  -e SIM_NAME=${1} \
+  --label gatling \
+  ghcr.io/scp-2021-jan-cmpt-756/gatling:3.4.2 \
+  -s proj756.${1}
@@ -0,0 +1,204 @@
+package proj756
+
+import scala.concurrent.duration._
+
+import io.gatling.core.Predef._
+import io.gatling.core.controller.inject.closed.ClosedInjectionStep
+import io.gatling.core.controller.inject.open.OpenInjectionStep
+import io.gatling.core.structure.{ChainBuilder, PopulationBuilder, ScenarioBuilder}
+import io.gatling.http.Predef._
+
+/*
+  Write-heavy and mixed read/write workloads for the user, music and
+  playlist services.
+
+  Unlike the looping users of ReadTables.scala, each user here makes one
+  request (or one create/delete pair) and leaves, so the same scenarios
+  run under either injection model, chosen by MODEL:
+
+    closed  USERS users are in the system at once; one starts as
+            another leaves (the default)
+    open    RATE users arrive per second, however many are still
+            waiting for a response
+
+  PHASES, a comma-separated list run in order, shapes the load:
+
+    ramp   grow from 1 to USERS (or RATE) over RAMP_SEC s, then hold
+           for HOLD_SEC s
+    spike  hold for HOLD_SEC s, multiply the load by SPIKE_FACTOR for
+           SPIKE_SEC s, then hold for HOLD_SEC s again
+    soak   hold for SOAK_SEC s
+
+  READ_PCT is the percentage of reads in the Mixed simulations and
+  PAUSE_MS the think time after each request, in ms.  For example,
+
+    MODEL=open RATE=50 PHASES=ramp,spike READ_PCT=80 ./gatling-workload.sh MixedMusicSim
+*/
+object Workload {
+  val model = Utility.envVar("MODEL", "closed")
+  val phases = Utility.envVar("PHASES", "ramp").split(",").map(_.trim).toSeq
+  val users = Utility.envVarToInt("USERS", 10)
+  val rate = Utility.envVarToInt("RATE", 10)
+  val rampSec = Utility.envVarToInt("RAMP_SEC", 60)
+  val holdSec = Utility.envVarToInt("HOLD_SEC", 60)
+  val spikeFactor = Utility.envVarToInt("SPIKE_FACTOR", 5)
+  val spikeSec = Utility.envVarToInt("SPIKE_SEC", 30)
+  val soakSec = Utility.envVarToInt("SOAK_SEC", 1800)
+  val readPct = Utility.envVarToInt("READ_PCT", 50).max(0).min(100)
+  val pauseMs = Utility.envVarToInt("PAUSE_MS", 0)
+
+  def closedSteps: Seq[ClosedInjectionStep] = phases.flatMap {
+    case "ramp" => Seq(
+      rampConcurrentUsers(1).to(users).during(rampSec.seconds),
+      constantConcurrentUsers(users).during(holdSec.seconds))
+    case "spike" => Seq(
+      constantConcurrentUsers(users).during(holdSec.seconds),
+      constantConcurrentUsers(users * spikeFactor).during(spikeSec.seconds),
+      constantConcurrentUsers(users).during(holdSec.seconds))
+    case "soak" => Seq(
+      constantConcurrentUsers(users).during(soakSec.seconds))
+    case other => throw new IllegalArgumentException("Unknown phase: " + other)
+  }
+
+  def openSteps: Seq[OpenInjectionStep] = phases.flatMap {
+    case "ramp" => Seq(
+      rampUsersPerSec(1).to(rate).during(rampSec.seconds),
+      constantUsersPerSec(rate).during(holdSec.seconds))
+    case "spike" => Seq(
+      constantUsersPerSec(rate).during(holdSec.seconds),
+      constantUsersPerSec(rate * spikeFactor).during(spikeSec.seconds),
+      constantUsersPerSec(rate).during(holdSec.seconds))
+    case "soak" => Seq(
+      constantUsersPerSec(rate).during(soakSec.seconds))
+    case other => throw new IllegalArgumentException("Unknown phase: " + other)
+  }
+
+  // One user's visit: the chain, then the think time
+  def scenarioOf(name: String, chain: ChainBuilder): ScenarioBuilder =
+    scenario(name).exec(chain).pause(pauseMs.milliseconds)
+
+  def inject(scn: ScenarioBuilder): PopulationBuilder = model match {
+    case "closed" => scn.inject(closedSteps)
+    case "open" => scn.inject(openSteps)
+    case other => throw new IllegalArgumentException("Unknown MODEL: " + other)
+  }
+
+  // READ_PCT percent of visits read, the rest write
+  def mix(read: ChainBuilder, write: ChainBuilder): ChainBuilder =
+    randomSwitch(
+      Seq(readPct.toDouble -> read, (100 - readPct).toDouble -> write)
+        .filter(_._1 > 0): _*)
+}
+
+/*
+  s1: a read of a user, or an update of one (PUT -> db /update)
+*/
+object UserOps {
+  val feeder = csv("users.csv").eager.circular
+
+  val read = feed(feeder)
+    .exec(http("RUser")
+      .get("/api/v1/user/${UUID}"))
+
+  val write = feed(feeder)
+    .exec(http("WUser update")
+      .put("/api/v1/user/${UUID}")
+      .body(StringBody("""{"fname": "${fname}", "lname": "${lname}", "email": "${email}"}""")).asJson)
+}
+
+/*
+  s2: a read of a song, or a new copy of it created and deleted again
+  (create_song -> db /write, then -> db /delete), so the table does not
+  grow over a long run
+*/
+object MusicOps {
+  val feeder = csv("music.csv").eager.random
+
+  val read = feed(feeder)
+    .exec(http("RMusic")
+      .get("/api/v1/music/${Owner}/${SongTitle}"))
+
+  val write = feed(feeder)
+    .exec(session => session.set("copy", java.util.UUID.randomUUID.toString))
+    .exec(http("WMusic create")
+      .post("/api/v1/music/")
+      .body(StringBody("""{"Artist": "${Artist}", "SongTitle": "${SongTitle} ${copy}", "Owner": "${Owner}"}""")).asJson
+      .check(jsonPath("$.music_id").saveAs("music_id")))
+    .exitHereIfFailed
+    .exec(http("WMusic delete")
+      .delete("/api/v1/music/${music_id}"))
+}
+
+/*
+  s3: a listing of the playlists, or a song added to its owner's
+  playlist (add_music_to_playlist -> db /read_music and /write) and
+  removed again (-> db /delete)
+*/
+object PlaylistOps {
+  val feeder = csv("music.csv").eager.random
+
+  val read = exec(http("RPlaylist")
+    .get("/api/v1/playlist/show_playlist"))
+
+  val write = feed(feeder)
+    .exec(http("WPlaylist add")
+      .post("/api/v1/playlist/add_music_to_playlist")
+      .body(StringBody("""{"Artist": "${Artist}", "SongTitle": "${SongTitle}", "Owner": "${Owner}"}""")).asJson
+      .check(jsonPath("$.playlist_id").saveAs("playlist_id")))
+    .exitHereIfFailed
+    .exec(http("WPlaylist delete")
+      .delete("/api/v1/playlist/${playlist_id}"))
+}
+
+class WriteUserSim extends ReadTablesSim {
+  setUp(
+    Workload.inject(Workload.scenarioOf("WriteUser", UserOps.write))
+  ).protocols(httpProtocol)
+}
+
+class WriteMusicSim extends ReadTablesSim {
+  setUp(
+    Workload.inject(Workload.scenarioOf("WriteMusic", MusicOps.write))
+  ).protocols(httpProtocol)
+}
+
+class WritePlaylistSim extends ReadTablesSim {
+  setUp(
+    Workload.inject(Workload.scenarioOf("WritePlaylist", PlaylistOps.write))
+  ).protocols(httpProtocol)
+}
+
+class MixedUserSim extends ReadTablesSim {
+  setUp(
+    Workload.inject(Workload.scenarioOf("MixedUser",
+      Workload.mix(UserOps.read, UserOps.write)))
+  ).protocols(httpProtocol)
+}
+
+class MixedMusicSim extends ReadTablesSim {
+  setUp(
+    Workload.inject(Workload.scenarioOf("MixedMusic",
+      Workload.mix(MusicOps.read, MusicOps.write)))
+  ).protocols(httpProtocol)
+}
+
+class MixedPlaylistSim extends ReadTablesSim {
+  setUp(
+    Workload.inject(Workload.scenarioOf("MixedPlaylist",
+      Workload.mix(PlaylistOps.read, PlaylistOps.write)))
+  ).protocols(httpProtocol)
+}
+
+/*
+  All three services at once, each with its own USERS or RATE
+*/
+class MixedAllSim extends ReadTablesSim {
+  setUp(
+    Workload.inject(Workload.scenarioOf("MixedUser",
+      Workload.mix(UserOps.read, UserOps.write))),
+    Workload.inject(Workload.scenarioOf("MixedMusic",
+      Workload.mix(MusicOps.read, MusicOps.write))),
+    Workload.inject(Workload.scenarioOf("MixedPlaylist",
+      Workload.mix(PlaylistOps.read, PlaylistOps.write)))
+  ).protocols(httpProtocol)
+}
@@ -198,6 +198,8 @@ dynamodb-init: $(LOG_DIR)/dynamodb-init.log
 # Start DynamoDB at the default read and write rates
 $(LOG_DIR)/dynamodb-init.log: cluster/cloudformationdynamodb.json
 	@# "|| true" suffix because command fails when stack already exists
+	@# An existing stack is left as is; see db/README.md, "Indexes", to add
+	@# the global secondary indexes to one
 	@# (even with --on-failure DO_NOTHING, a nonzero error code is returned)
 	$(AWS) cloudformation create-stack --stack-name db-ZZ-REG-ID --template-body file://$< || true | tee $(LOG_DIR)/dynamodb-init.log
 	# Must give DynamoDB time to create the tables before running the loader
@@ -317,8 +319,16 @@ db: $(LOG_DIR)/db.repo.log cluster/awscred.yaml cluster/dynamodb-service-entry.y
 # Build & push the images up to the CR
 cri: $(LOG_DIR)/s1.repo.log $(LOG_DIR)/s2-$(S2_VER).repo.log $(LOG_DIR)/s3.repo.log $(LOG_DIR)/db.repo.log
 
+# Copy the modules in shared/ into the services' directories (see
+# tools/copy-shared.sh)
+s1/datastore.py s2/v1/datastore.py s3/datastore.py: shared/datastore.py
+	cp $< $@
+
+db/serialize.py s1/serialize.py s2/v1/serialize.py s3/serialize.py: shared/serialize.py
+	cp $< $@
+
 # Build the s1 service
-$(LOG_DIR)/s1.repo.log: s1/Dockerfile s1/app.py s1/requirements.txt
+$(LOG_DIR)/s1.repo.log: s1/Dockerfile s1/app.py s1/cache.py s1/datastore.py s1/gunicorn.conf.py s1/monitoring.py s1/serialize.py s1/start.sh s1/requirements.txt
 	make -f k8s.mak --no-print-directory registry-login
 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756s1:$(APP_VER_TAG) s1 | tee $(LOG_DIR)/s1.img.log
 	$(DK) push $(CREG)/$(REGID)/cmpt756s1:$(APP_VER_TAG) | tee $(LOG_DIR)/s1.repo.log
@@ -330,13 +340,13 @@ $(LOG_DIR)/s2-$(S2_VER).repo.log: s2/$(S2_VER)/Dockerfile s2/$(S2_VER)/app.py s2
 	$(DK) push $(CREG)/$(REGID)/cmpt756s2:$(S2_VER) | tee $(LOG_DIR)/s2-$(S2_VER).repo.log
 
 # Build the s3 service
-$(LOG_DIR)/s3.repo.log: s3/Dockerfile s3/app.py s3/requirements.txt
+$(LOG_DIR)/s3.repo.log: s3/Dockerfile s3/app.py s3/datastore.py s3/history.py s3/gunicorn.conf.py s3/monitoring.py s3/serialize.py s3/start.sh s3/requirements.txt
 	make -f k8s.mak --no-print-directory registry-login
 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756s3:$(APP_VER_TAG) s3 | tee $(LOG_DIR)/s3.img.log
 	$(DK) push $(CREG)/$(REGID)/cmpt756s3:$(APP_VER_TAG) | tee $(LOG_DIR)/s3.repo.log
 
 # Build the db service
-$(LOG_DIR)/db.repo.log: db/Dockerfile db/app.py db/requirements.txt
+$(LOG_DIR)/db.repo.log: db/Dockerfile db/app.py db/app_async.py db/common.py db/backends/__init__.py db/backends/expressions.py db/backends/memory.py db/backends/sqlite.py db/backends/tables.py db/gunicorn.conf.py db/monitoring.py db/serialize.py db/start.sh db/requirements.txt
 	make -f k8s.mak --no-print-directory registry-login
 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756db:$(APP_VER_TAG) db | tee $(LOG_DIR)/db.img.log
 	$(DK) push $(CREG)/$(REGID)/cmpt756db:$(APP_VER_TAG) | tee $(LOG_DIR)/db.repo.log
@@ -1,15 +1,30 @@
 """
 SFU CMPT 756
 Loader for sample database
+
+The CSV files are streamed in batches of rows.  Each batch is one
+`/batch_write` call to the db service, and up to `--concurrency`
+batches are in flight at once, each worker thread holding its own
+keep-alive session.  With `--checkpoint`, the number of rows loaded
+from each file is recorded as the load proceeds, and a rerun with the
+same file resumes after them.  The loader exits with status 1 if any
+row was not written; the checkpoint then stops before its batch.
 """
 
 # Standard library modules
+import argparse
+import concurrent.futures
 import csv
+import itertools
+import json
 import os
+import sys
+import threading
 import time
 
 # Installed packages
 import requests
+from requests.adapters import HTTPAdapter
 
 # The application
 
@@ -21,10 +36,52 @@ loader_token = os.getenv('SVC_LOADER_TOKEN')
 # sets that value.
 INITIAL_WAIT_SEC = 1
 
+# Rows per `/batch_write` request.  The db service splits a batch
+# into DynamoDB BatchWriteItem calls of 25 items.
+DEFAULT_BATCH_SIZE = 100
+
+# Batches in flight at once
+DEFAULT_CONCURRENCY = int(os.getenv('LOADER_CONCURRENCY', '8'))
+
+# Seconds between throughput reports
+REPORT_INTERVAL_SEC = 5
+
 db = {
     "name": "http://cmpt756db:30002/api/v1/datastore",
 }
 
+# Per-thread HTTP session
+local = threading.local()
+
+
+def parse_args():
+    argp = argparse.ArgumentParser(
+        'loader',
+        description='Load the users and music tables from CSV files'
+        )
+    argp.add_argument(
+        '--resource-dir',
+        default='/data',
+        help="Directory holding users/users.csv and music/music.csv"
+        )
+    argp.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Number of batches in flight at once"
+        )
+    argp.add_argument(
+        '--batch-size',
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of rows per request to the db service"
+        )
+    argp.add_argument(
+        '--checkpoint',
+        help="File recording progress; rerunning with it resumes the load"
+        )
+    return argp.parse_args()
+
 
 def build_auth():
     """Return a loader Authorization header in Basic format"""
@@ -32,81 +89,167 @@ def build_auth():
     return requests.auth.HTTPBasicAuth('svc-loader', loader_token)
 
 
-def create_user(lname, fname, email, uuid):
+def session():
+    """Return this thread's keep-alive session to the db service"""
+    if not hasattr(local, 'session'):
+        s = requests.Session()
+        s.auth = build_auth()
+        s.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        local.session = s
+    return local.session
+
+
+def user_item(row):
+    """Return the `/batch_write` item for a users.csv row"""
+    fn, ln, email, uuid = row
+    return {"fname": fn.strip(),
+            "lname": ln.strip(),
+            "email": email.strip(),
+            "uuid": uuid.strip()}
+
+
+def song_item(row):
+    """Return the `/batch_write` item for a music.csv row"""
+    artist, title, uuid, owner = row
+    return {"Artist": artist.strip(),
+            "SongTitle": title.strip(),
+            "uuid": uuid.strip(),
+            "Owner": owner.strip()}
+
+
+def load_batch(objtype, items):
     """
-    Create a user.
-    If a record already exists with the same fname, lname, and email,
-    the old UUID is replaced with this one.
+    Write a batch of items with their own UUIDs.
+
+    Returns the UUIDs that the db service did not write: all of them if
+    the request failed.
     """
-    url = db['name'] + '/load'
-    response = requests.post(
-        url,
-        auth=build_auth(),
-        json={"objtype": "user",
-              "lname": lname,
-              "email": email,
-              "fname": fname,
-              "uuid": uuid})
-    return (response.json())
-
-
-def create_song(artist, title, uuid, owner):
+    try:
+        response = session().post(
+            db['name'] + '/batch_write',
+            json={"objtype": objtype, "items": items})
+    except requests.exceptions.RequestException as e:
+        print('Error writing {} batch: {}'.format(objtype, e))
+        return [item['uuid'] for item in items]
+    if response.status_code != 200:
+        return [item['uuid'] for item in items]
+    return [r[objtype + '_id'] for r in response.json()['results']
+            if r['status'] != 'ok']
+
+
+class Checkpoint():
     """
-    Create a song.
-    If a record already exists with the same artist and title,
-    the old UUID is replaced with this one.
+    Number of leading rows of each CSV file already loaded.
+
+    Saved as JSON after every update if a path is given.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._done = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as inp:
+                self._done = json.load(inp)
+
+    def rows_done(self, name):
+        return self._done.get(name, 0)
+
+    def update(self, name, rows):
+        self._done[name] = rows
+        if self._path is None:
+            return
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as out:
+            json.dump(self._done, out)
+        os.replace(tmp, self._path)
+
+
+class Progress():
+    """Row count and throughput of the load of one file"""
+    def __init__(self, name):
+        self._name = name
+        self._rows = 0
+        self._start = time.monotonic()
+        self._last = self._start
+
+    def add(self, rows):
+        self._rows += rows
+        now = time.monotonic()
+        if now - self._last >= REPORT_INTERVAL_SEC:
+            self._last = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self._start, 1e-6)
+        print('{}: {} rows in {:.1f} s, {:.1f} rows/s'.format(
+            self._name, self._rows, elapsed, self._rows / elapsed),
+            flush=True)
+
+
+def load_file(path, objtype, to_item, args, checkpoint):
     """
-    url = db['name'] + '/load'
-    response = requests.post(
-        url,
-        auth=build_auth(),
-        json={"objtype": "music",
-              "Artist": artist,
-              "SongTitle": title,
-              "uuid": uuid,
-              "Owner": owner})
-    return (response.json())
+    Load every row of the CSV file `path` after those already checkpointed.
 
+    Reading the file stops while 2 * `args.concurrency` batches are
+    in flight.  Batches can finish out of order, so the checkpoint only
+    advances past a row once every row before it has been loaded.  A
+    batch with any row not written holds the checkpoint before it for
+    good, so that a rerun retries it; the rest of the file is still
+    loaded.
 
-def check_resp(resp, key):
-    if 'http_status_code' in resp:
-        return None
-    else:
-        return resp[key]
+    Returns True if every row was written.
+    """
+    name = os.path.basename(path)
+    first = checkpoint.rows_done(name)
+    loaded = first
+    progress = Progress(name)
+    in_flight = {}  # future -> (index of first row, row count)
+    finished = {}   # index of first row -> row count, finished early
+    complete = True
+    with open(path, 'r') as inp, \
+            concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        rdr = csv.reader(inp)
+        next(rdr)  # Skip header
+        rows = itertools.islice(rdr, first, None)
+        while True:
+            batch = [to_item(row)
+                     for row in itertools.islice(rows, args.batch_size)]
+            if len(batch) > 0:
+                future = pool.submit(load_batch, objtype, batch)
+                in_flight[future] = (first, len(batch))
+                first += len(batch)
+                if len(in_flight) < 2 * args.concurrency:
+                    continue
+            if len(in_flight) == 0:
+                break
+            done, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                start, count = in_flight.pop(future)
+                failed = future.result()
+                for uuid in failed:
+                    print('Error creating {} {}'.format(objtype, uuid))
+                progress.add(count - len(failed))
+                if len(failed) == 0:
+                    finished[start] = count
+                else:
+                    complete = False
+            while loaded in finished:
+                loaded += finished.pop(loaded)
+            checkpoint.update(name, loaded)
+    progress.report()
+    return complete
 
 
 if __name__ == '__main__':
+    args = parse_args()
+
     # Give Istio proxy time to initialize
     time.sleep(INITIAL_WAIT_SEC)
 
-    resource_dir = '/data'
-
-    with open('{}/users/users.csv'.format(resource_dir), 'r') as inp:
-        rdr = csv.reader(inp)
-        next(rdr)  # Skip header
-        for fn, ln, email, uuid in rdr:
-            resp = create_user(fn.strip(),
-                               ln.strip(),
-                               email.strip(),
-                               uuid.strip())
-            resp = check_resp(resp, 'user_id')
-            if resp is None or resp != uuid:
-                print('Error creating user {} {} ({}), {}'.format(fn,
-                                                                  ln,
-                                                                  email,
-                                                                  uuid))
-
-    with open('{}/music/music.csv'.format(resource_dir), 'r') as inp:
-        rdr = csv.reader(inp)
-        next(rdr)  # Skip header
-        for artist, title, uuid in rdr:
-            resp = create_song(artist.strip(),
-                               title.strip(),
-                               uuid.strip()),
-                               owner.strip()
-            resp = check_resp(resp, 'music_id')
-            if resp is None or resp != uuid:
-                print('Error creating song {} {}, {}'.format(artist,
-                                                             title,
-                                                             uuid,
-                                                             owner))
+    checkpoint = Checkpoint(args.checkpoint)
+    users_ok = load_file('{}/users/users.csv'.format(args.resource_dir),
+                         'user', user_item, args, checkpoint)
+    music_ok = load_file('{}/music/music.csv'.format(args.resource_dir),
+                         'music', song_item, args, checkpoint)
+    if not (users_ok and music_ok):
+        sys.exit(1)
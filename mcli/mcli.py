@@ -333,7 +333,8 @@ Enter 'help' for command list.
         # print(url)
         r = requests.get(
             url+'show_playlist',
-            headers={'Authorization': self.USER_ID}
+            headers={'Authorization': self.USER_ID},
+            params={'fields': 'Artist,SongTitle,playlist_id'}
             )
         if r.status_code != 200:
             print("Non-successful status code:", r.status_code)
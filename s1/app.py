@@ -5,6 +5,7 @@ Sample application---user service.
 
 # Standard library modules
 import logging
+import os
 import sys
 import time
 
@@ -16,31 +17,63 @@ from flask import Response
 
 import jwt
 
-from prometheus_flask_exporter import PrometheusMetrics
-
-import requests
-
 import simplejson as json
 
+# Local modules
+import cache
+import datastore
+import monitoring
+import serialize
+
 # The application
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
-metrics.info('app_info', 'User process')
+metrics = monitoring.create_metrics(app, 'User process')
+
+# Calls to the database service, over pooled keep-alive connections
+db_client = datastore.DatastoreClient(metrics)
+
+# User records by user_id, for GET /<user_id> and /login.  An entry is
+# dropped, in every worker of this pod, when that user is updated or
+# deleted through any of them; changes made through other replicas
+# show up once the entry expires.
+user_cache = cache.TTLCache(
+    'user',
+    metrics,
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('USER_CACHE_TTL_SEC', '30')))
 
 bp = Blueprint('app', __name__)
 
-db = {
-    "name": "http://cmpt756db:30002/api/v1/datastore",
-    "endpoint": [
-        "read",
-        "write",
-        "delete",
-        "update",
-        "read_music",
-    ]
-}
+# Paging, projection and order parameters that listings forward to
+# the datastore
+PAGING_PARAMS = ('limit', 'next_token', 'format', 'fields', 'sort')
+
+
+def paging_args():
+    """Return the paging parameters given in the current request"""
+    return {k: request.args[k] for k in PAGING_PARAMS if k in request.args}
+
+
+def listing_response(objtype, auth, **params):
+    """
+    Forward a listing request to the datastore.
+
+    The listing, JSON or NDJSON (`format=ndjson`), is streamed through
+    to the client as it arrives rather than decoded here.
+    """
+    params.update(paging_args())
+    return datastore.relay(
+        db_client.passthrough.read_music(objtype, auth, **params))
+
+
+def read_user(user_id):
+    """Return the datastore read of a user, through the user cache"""
+    return user_cache.get_or_load(
+        user_id,
+        lambda: db_client.read("user", user_id),
+        lambda data: data.get('Count', 0) > 0)
 
 
 @bp.route('/', methods=['GET'])
@@ -72,13 +105,28 @@ def list_user():
                         status=401,
                         mimetype='application/json')
     # list all songs here
-    payload = {"objtype": "user"}
-    url = db['name'] + '/' + db['endpoint'][4]
-    response = requests.get(
-        url,
-        payload,
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    return listing_response("user", headers['Authorization'])
+
+
+def expected_version():
+    """
+    Return the user version named by the request's If-Match, or "*"
+
+    A user's record carries a `version` that every update increments,
+    and that each update returns as its ETag.  An update with
+    `If-Match: "<version>"` applies only if the record is still at
+    that version (412 Precondition Failed otherwise); one without
+    If-Match applies whatever the version.  A record never updated
+    has no version and matches "0".  Raises ValueError if
+    If-Match does not name one version.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return '*'
+    tags = request.if_match.as_set()
+    if len(tags) != 1:
+        raise ValueError('If-Match must name one version')
+    return int(tags.pop())
+
 
 @bp.route('/<user_id>', methods=['PUT'])
 def update_user(user_id):
@@ -94,12 +142,29 @@ def update_user(user_id):
         lname = content['lname']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.put(
-        url,
-        params={"objtype": "user", "objkey": user_id},
-        json={"email": email, "fname": fname, "lname": lname})
-    return (response.json())
+    try:
+        version = expected_version()
+    except ValueError:
+        return Response(json.dumps({"error": "invalid If-Match"}),
+                        status=400,
+                        mimetype='application/json')
+    # One conditional write; no read of the current record is needed
+    response = db_client.update(
+        "user", user_id, {"email": email, "fname": fname, "lname": lname},
+        version=version, return_values='UPDATED_NEW')
+    user_cache.invalidate(user_id)
+    status = response.get('http_status_code')
+    if status == 409:
+        # A version conflict fails the If-Match precondition
+        status = response['http_status_code'] = 412
+    if status is not None:
+        return Response(serialize.dumps(response),
+                        status=status,
+                        mimetype='application/json')
+    result = Response(serialize.dumps(response), mimetype='application/json')
+    result.set_etag(str(response['Attributes']['version']))
+    return result
+
 
 
 @bp.route('/', methods=['POST'])
@@ -116,14 +181,8 @@ def create_user():
         fname = content['fname']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][1]
-    response = requests.post(
-        url,
-        json={"objtype": "user",
-              "lname": lname,
-              "email": email,
-              "fname": fname})
-    return (response.json())
+    return datastore.relay(db_client.passthrough.write(
+        "user", {"lname": lname, "email": email, "fname": fname}))
 
 
 @bp.route('/<user_id>', methods=['DELETE'])
@@ -134,11 +193,9 @@ def delete_user(user_id):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    url = db['name'] + '/' + db['endpoint'][2]
-
-    response = requests.delete(url,
-                               params={"objtype": "user", "objkey": user_id})
-    return (response.json())
+    response = db_client.passthrough.delete("user", user_id)
+    user_cache.invalidate(user_id)
+    return datastore.relay(response)
 
 
 @bp.route('/<user_id>', methods=['GET'])
@@ -150,10 +207,8 @@ def get_user(user_id):
             json.dumps({"error": "missing auth"}),
             status=401,
             mimetype='application/json')
-    payload = {"objtype": "user", "objkey": user_id}
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(url, params=payload)
-    return (response.json())
+    return Response(serialize.dumps(read_user(user_id)),
+                    mimetype='application/json')
 
 
 @bp.route('/login', methods=['PUT'])
@@ -163,9 +218,7 @@ def login():
         uid = content['uid']
     except Exception:
         return json.dumps({"message": "error reading parameters"})
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(url, params={"objtype": "user", "objkey": uid})
-    data = response.json()
+    data = read_user(uid)
     if len(data['Items']) > 0:
         encoded = jwt.encode({'user_id': uid, 'time': time.time()},
                              'secret',
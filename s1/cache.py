@@ -0,0 +1,219 @@
+"""
+SFU CMPT 756
+In-process read-through cache for datastore results.
+
+Entries expire `ttl` seconds after they are stored and the least
+recently used entry is evicted once the cache holds `maxsize` entries.
+Each cache exports `<name>_cache_hits`, `<name>_cache_misses` and
+`<name>_cache_evictions` counters to the service's Prometheus registry.
+
+Every Gunicorn worker has its own entries.  So that a write through one
+worker is seen by the others at once, the keys are divided into groups
+(a user, an owner's catalog), each with a version counter.  An
+invalidation increments its group's counter, and an entry loaded at an
+earlier count is no longer served.  Under Gunicorn the counters are
+shared by the workers, in a memory-mapped file in CACHE_VERSIONS_DIR,
+which `gunicorn.conf.py` sets, so no worker serves the entry.  Other
+pods' caches still see a write only when their entries expire.
+
+The same module is copied into the s1 and s2/v1 directories because
+each container image is built from its own directory.
+"""
+
+# Standard library modules
+import collections
+import contextlib
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Installed packages
+from prometheus_client import Counter
+
+# Version counters per file; groups whose hashes collide only
+# invalidate each other's entries
+VERSION_SLOTS = 4096
+
+# One counter: a signed 64-bit integer
+VERSION = struct.Struct('q')
+
+
+class Versions():
+    """
+    Version counters of groups of cache keys.
+
+    Parameters
+    ----------
+    path: string
+        File holding the counters, created if missing.  Every process
+        that opens the same file shares them.  If None, the counters
+        are this process's own.
+    """
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        size = VERSION_SLOTS * VERSION.size
+        self._file = None
+        if path is None:
+            self._map = mmap.mmap(-1, size)
+            return
+        self._file = open(path, 'a+b')
+        with self._locked():
+            if os.fstat(self._file.fileno()).st_size < size:
+                os.ftruncate(self._file.fileno(), size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the counters' lock, against this and other processes."""
+        with self._lock:
+            if self._file is None:
+                yield
+                return
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _offset(group):
+        # crc32, unlike hash(), is the same in every process
+        return VERSION.size * (zlib.crc32(repr(group).encode())
+                               % VERSION_SLOTS)
+
+    def get(self, group):
+        """Return the version of `group`."""
+        return VERSION.unpack_from(self._map, self._offset(group))[0]
+
+    def increment(self, group):
+        """Increment the version of `group`."""
+        offset = self._offset(group)
+        with self._locked():
+            value = VERSION.unpack_from(self._map, offset)[0]
+            VERSION.pack_into(self._map, offset, value + 1)
+
+
+def versions(name):
+    """
+    Return the Versions of cache `name`.
+
+    They are shared through a file in CACHE_VERSIONS_DIR if it is set,
+    as under Gunicorn, and held in this process otherwise.
+    """
+    directory = os.getenv('CACHE_VERSIONS_DIR')
+    if not directory:
+        return Versions()
+    return Versions(os.path.join(directory, name + '.versions'))
+
+
+class TTLCache():
+    """
+    Bounded LRU cache whose entries expire after a fixed time.
+
+    Safe for use by the threads of a threaded Flask server, and kept
+    consistent between Gunicorn workers by their shared versions().
+
+    Parameters
+    ----------
+    name: string
+        Prefix of the cache's metric names.
+    metrics: PrometheusMetrics
+        The service's metrics; the counters are added to its registry.
+    maxsize: int
+        Maximum number of entries.
+    ttl: float
+        Seconds an entry stays valid.
+    group: function
+        Returns the group of a key; invalidate_group() drops the
+        entries of a group together.  By default each key is its own
+        group.
+    """
+    def __init__(self, name, metrics, maxsize, ttl, group=lambda key: key):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._group = group
+        self._versions = versions(name)
+        # key -> (expiry, group version, value)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = Counter(
+            name + '_cache_hits',
+            'Lookups answered by the {} cache'.format(name),
+            registry=metrics.registry)
+        self._misses = Counter(
+            name + '_cache_misses',
+            'Lookups not answered by the {} cache'.format(name),
+            registry=metrics.registry)
+        self._evictions = Counter(
+            name + '_cache_evictions',
+            'Entries evicted from the {} cache to make room'.format(name),
+            registry=metrics.registry)
+
+    def version(self, key):
+        """Return the current version of the group of `key`."""
+        return self._versions.get(self._group(key))
+
+    def get(self, key):
+        """Return the value cached for `key`, or None."""
+        version = self.version(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is not None and entry[0] > time.monotonic()
+                    and entry[1] == version):
+                self._entries.move_to_end(key)
+                self._hits.inc()
+                return entry[2]
+            if entry is not None:
+                del self._entries[key]
+        self._misses.inc()
+        return None
+
+    def put(self, key, value, version=None):
+        """
+        Cache `value` for `key`.
+
+        `version` is the version of the key's group read before
+        `value` was; by default, the current one.
+        """
+        if version is None:
+            version = self.version(key)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, version,
+                                  value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+                self._evictions.inc()
+
+    def invalidate(self, key):
+        """Drop any value cached for `key`'s group, in every worker."""
+        self.invalidate_group(self._group(key))
+
+    def invalidate_group(self, group):
+        """
+        Drop every entry of `group`, in every worker.
+
+        The entries stay until a lookup finds them stale or they are
+        evicted.
+        """
+        self._versions.increment(group)
+
+    def get_or_load(self, key, load, cacheable=lambda value: True):
+        """
+        Return the value cached for `key`, calling `load()` on a miss.
+
+        The loaded value is cached only if `cacheable(value)` is true.
+        An invalidation made while `load()` runs leaves the value
+        stale, so the version is read before calling it.
+        """
+        value = self.get(key)
+        if value is None:
+            version = self.version(key)
+            value = load()
+            if cacheable(value):
+                self.put(key, value, version)
+        return value
@@ -0,0 +1,80 @@
+"""
+SFU CMPT 756
+Gunicorn settings for the production serving mode of a service.
+
+`start.sh` serves `app:app` with Gunicorn, using these settings, when
+APP_SERVER=gunicorn.  Gunicorn pre-forks WEB_WORKERS processes, each
+serving WEB_THREADS requests at once, so a service uses more than one
+core.  Every setting can be overridden through the environment of the
+service's container.
+
+Send SIGHUP to the master (`kill -HUP 1` in the container) for a
+graceful reload: new workers start and the old ones finish their
+requests in flight, for up to `graceful_timeout` seconds, before
+exiting.
+
+The same module is copied into each service directory (s1, s2/v1,
+s3, db) because each container image is built from its own directory.
+"""
+
+# Standard library modules
+import os
+
+# A fixed default rather than the core count: in a pod, the count is
+# that of the node, not the pod's CPU limit, and each worker holds its
+# own boto3 client, connection pool and cache entries.  The deployments in
+# cluster/ set WEB_WORKERS.
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_WORKERS', '2'))
+threads = int(os.getenv('WEB_THREADS', '4'))
+
+# Seconds an idle connection is held open for its next request.
+# Callers (the Istio sidecar, DatastoreClient) reuse connections.
+keepalive = int(os.getenv('WEB_KEEPALIVE_SEC', '75'))
+
+# Seconds a worker may be silent before it is restarted, and that
+# workers are given to finish their requests on reload or shutdown
+timeout = int(os.getenv('WEB_TIMEOUT_SEC', '30'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT_SEC', '30'))
+
+# Like Flask's server, log each request to stderr
+accesslog = '-'
+errorlog = '-'
+
+# Each worker records its metrics in files in this directory and
+# `/metrics` sums them over the workers (see monitoring.py).  It is set
+# here, in the master, before prometheus_client is imported, so that
+# every worker inherits it.
+os.environ.setdefault('prometheus_multiproc_dir',
+                      os.getenv('PROMETHEUS_MULTIPROC_DIR',
+                                '/tmp/prometheus-multiproc'))
+multiproc_dir = os.environ['prometheus_multiproc_dir']
+os.makedirs(multiproc_dir, exist_ok=True)
+
+# The read caches of s1 and s2 share their version counters, by which
+# a write through one worker invalidates the entries of all of them,
+# through files in this directory (see cache.py)
+os.environ.setdefault('CACHE_VERSIONS_DIR', '/tmp/cache-versions')
+cache_versions_dir = os.environ['CACHE_VERSIONS_DIR']
+os.makedirs(cache_versions_dir, exist_ok=True)
+
+
+def on_starting(server):
+    """Delete the metrics and cache files left by an earlier run."""
+    for name in os.listdir(multiproc_dir):
+        if name.endswith('.db'):
+            os.remove(os.path.join(multiproc_dir, name))
+    for name in os.listdir(cache_versions_dir):
+        if name.endswith('.versions'):
+            os.remove(os.path.join(cache_versions_dir, name))
+
+
+def child_exit(server, worker):
+    """
+    Drop the gauges of a worker that has exited.
+
+    Its counters and histograms stay in the sums, so totals do not
+    fall when a worker is replaced.
+    """
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,22 @@
+#!/bin/sh
+# Start the service on port $1 with the server named by APP_SERVER:
+#   flask     Flask's threaded development server (the default)
+#   gunicorn  Gunicorn worker processes, configured by gunicorn.conf.py
+set -o nounset
+set -o errexit
+if [ $# -ne 1 ]; then
+  echo "Usage: $0 PORT"
+  exit 1
+fi
+case "${APP_SERVER:-flask}" in
+  flask)
+    exec python app.py $1
+    ;;
+  gunicorn)
+    exec gunicorn --config gunicorn.conf.py --bind 0.0.0.0:$1 app:app
+    ;;
+  *)
+    echo "Unknown APP_SERVER '${APP_SERVER}': must be flask or gunicorn"
+    exit 1
+    ;;
+esac
@@ -0,0 +1,78 @@
+"""
+Configure for pytest.
+
+Runs the tests of the user service's own modules, with a stand-in for
+the database service.  From the `s1` directory:
+
+    python -m pytest test
+"""
+
+# Standard libraries
+import os
+import sys
+import types
+
+# Installed packages
+from prometheus_client import CollectorRegistry
+
+import pytest
+
+# The modules under test are in the directory above, and those it
+# shares with other services in `shared/`, whose copies may be stale
+S1_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, S1_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(S1_DIR), 'shared'))
+
+
+class Datastore():
+    """
+    The user table, behind the calls app.py makes of a DatastoreClient.
+
+    `reads` counts the reads, which the cache should spare.
+    """
+    def __init__(self):
+        self.users = {}
+        self.reads = 0
+
+    def read(self, objtype, objkey, auth=None, **params):
+        self.reads += 1
+        items = [dict(self.users[objkey])] if objkey in self.users else []
+        return {"Items": items, "Count": len(items)}
+
+    def update(self, objtype, objkey, changes, auth=None, version=None,
+               return_values='NONE'):
+        user = self.users.setdefault(objkey, {"user_id": objkey})
+        current = user.get('version', 0)
+        if version != '*' and version != current:
+            return {"http_status_code": 409,
+                    "reason": "Version conflict"}
+        user.update(changes)
+        user['version'] = current + 1
+        return {"Attributes": {"version": user['version']}}
+
+
+def new_metrics():
+    """Return a stand-in for PrometheusMetrics, with its own registry."""
+    return types.SimpleNamespace(registry=CollectorRegistry())
+
+
+@pytest.fixture(scope='session')
+def app_module(request):
+    import app
+    return app
+
+
+@pytest.fixture
+def db(request, app_module, monkeypatch):
+    """Give the service an empty user table and cache; return the table."""
+    import cache
+    db = Datastore()
+    monkeypatch.setattr(app_module, 'db_client', db)
+    monkeypatch.setattr(app_module, 'user_cache', cache.TTLCache(
+        'user', new_metrics(), maxsize=100, ttl=30))
+    return db
+
+
+@pytest.fixture
+def client(request, app_module, db):
+    return app_module.app.test_client()
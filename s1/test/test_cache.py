@@ -0,0 +1,127 @@
+"""
+Test the read-through cache, in one process and shared by workers.
+
+Two caches opened with the same CACHE_VERSIONS_DIR stand for two
+Gunicorn workers of one pod.
+"""
+
+# Standard libraries
+import multiprocessing
+from unittest import mock
+
+# Installed packages
+import pytest
+
+# Local modules
+import cache
+from conftest import new_metrics
+
+
+@pytest.fixture
+def versions_dir(request, tmp_path, monkeypatch):
+    monkeypatch.setenv('CACHE_VERSIONS_DIR', str(tmp_path))
+    return tmp_path
+
+
+def new_cache(**kwargs):
+    kwargs.setdefault('maxsize', 10)
+    kwargs.setdefault('ttl', 30)
+    return cache.TTLCache('test', new_metrics(), **kwargs)
+
+
+def test_read_through():
+    c = new_cache()
+    load = mock.Mock(return_value='v')
+    assert c.get_or_load('k', load) == 'v'
+    assert c.get_or_load('k', load) == 'v'
+    assert load.call_count == 1
+    assert c.get_or_load('other', lambda: None, lambda v: v is not None) \
+        is None
+    assert c.get('other') is None
+
+
+def test_expiry():
+    c = new_cache(ttl=10)
+    with mock.patch('time.monotonic', return_value=100):
+        c.put('k', 'v')
+    with mock.patch('time.monotonic', return_value=109):
+        assert c.get('k') == 'v'
+    with mock.patch('time.monotonic', return_value=111):
+        assert c.get('k') is None
+
+
+def test_lru_eviction():
+    c = new_cache(maxsize=2)
+    c.put('a', 1)
+    c.put('b', 2)
+    c.get('a')
+    c.put('c', 3)
+    assert (c.get('a'), c.get('b'), c.get('c')) == (1, None, 3)
+
+
+def test_invalidate():
+    c = new_cache()
+    c.put('a', 1)
+    c.put('b', 2)
+    c.invalidate('a')
+    assert (c.get('a'), c.get('b')) == (None, 2)
+
+
+def test_invalidate_group():
+    c = new_cache(group=lambda key: key[0])
+    c.put(('ann', 'list'), 1)
+    c.put(('ann', 'title'), 2)
+    c.put(('bob', 'list'), 3)
+    c.invalidate_group('ann')
+    assert c.get(('ann', 'list')) is None
+    assert c.get(('ann', 'title')) is None
+    assert c.get(('bob', 'list')) == 3
+
+
+def test_invalidation_during_load():
+    c = new_cache()
+
+    def load():
+        # A write, and its invalidation, while the old value is read
+        c.invalidate('k')
+        return 'old'
+    assert c.get_or_load('k', load) == 'old'
+    assert c.get('k') is None
+
+
+def test_invalidation_reaches_other_workers(versions_dir):
+    first = new_cache()
+    second = new_cache()
+    first.put('k', 'old')
+    second.put('k', 'old')
+    second.invalidate('k')
+    assert first.get('k') is None
+    assert second.get('k') is None
+    first.put('k', 'new')
+    assert first.get('k') == 'new'
+    assert list(versions_dir.iterdir()) == [versions_dir / 'test.versions']
+
+
+def test_workers_share_only_their_pod_versions(versions_dir, monkeypatch):
+    first = new_cache()
+    first.put('k', 'v')
+    # A worker of another pod
+    monkeypatch.setenv('CACHE_VERSIONS_DIR', str(versions_dir / 'other'))
+    (versions_dir / 'other').mkdir()
+    new_cache().invalidate('k')
+    assert first.get('k') == 'v'
+
+
+def invalidate(key):
+    new_cache().invalidate(key)
+
+
+def test_invalidation_from_another_process(versions_dir):
+    first = new_cache()
+    first.put('k', 'v')
+    worker = multiprocessing.get_context('fork').Process(
+        target=invalidate, args=('k',))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+    assert first.get('k') is None
@@ -0,0 +1,70 @@
+"""
+Test the user routes that read through the user cache, and the
+ETag and If-Match handling of updates.
+"""
+
+# Installed packages
+import pytest
+
+URL = '/api/v1/user/'
+AUTH = {'Authorization': 'Bearer A'}
+USER = {'fname': 'Sam', 'lname': 'Cooke', 'email': 'sam@example.com'}
+
+
+@pytest.fixture
+def user_id(request, db):
+    db.users['u1'] = dict(USER, user_id='u1')
+    return 'u1'
+
+
+def test_get_is_cached(client, db, user_id):
+    for _ in range(3):
+        response = client.get(URL + user_id, headers=AUTH)
+        assert response.get_json()['Items'][0]['fname'] == 'Sam'
+    assert db.reads == 1
+
+
+def test_missing_user_not_cached(client, db):
+    for _ in range(2):
+        assert client.get(URL + 'nobody', headers=AUTH).get_json()[
+            'Count'] == 0
+    assert db.reads == 2
+
+
+def test_update_sets_etag(client, user_id):
+    response = client.put(URL + user_id, headers=AUTH,
+                          json=dict(USER, fname='Samuel'))
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"1"'
+    response = client.put(URL + user_id, headers=dict(AUTH, **{
+        'If-Match': '"1"'}), json=USER)
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"2"'
+
+
+def test_update_of_stale_version(client, db, user_id):
+    client.put(URL + user_id, headers=AUTH, json=USER)
+    response = client.put(URL + user_id, headers=dict(AUTH, **{
+        'If-Match': '"0"'}), json=dict(USER, fname='Samuel'))
+    assert response.status_code == 412
+    assert db.users[user_id]['fname'] == 'Sam'
+
+
+def test_if_match_any(client, user_id):
+    response = client.put(URL + user_id, headers=dict(AUTH, **{
+        'If-Match': '*'}), json=USER)
+    assert response.status_code == 200
+
+
+def test_if_match_of_several_versions(client, user_id):
+    response = client.put(URL + user_id, headers=dict(AUTH, **{
+        'If-Match': '"1", "2"'}), json=USER)
+    assert response.status_code == 400
+
+
+def test_update_invalidates(client, db, user_id):
+    client.get(URL + user_id, headers=AUTH)
+    client.put(URL + user_id, headers=AUTH, json=dict(USER, fname='Samuel'))
+    response = client.get(URL + user_id, headers=AUTH)
+    assert response.get_json()['Items'][0]['fname'] == 'Samuel'
+    assert db.reads == 2
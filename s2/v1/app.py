@@ -4,6 +4,7 @@ Sample application---music service.
 """
 
 # Standard library modules
+import hashlib
 import logging
 import os
 import sys
@@ -15,13 +16,13 @@ from flask import Flask
 from flask import request
 from flask import Response
 
-from prometheus_flask_exporter import PrometheusMetrics
-
-import requests
-
 import simplejson as json
 
 # Local modules
+import cache
+import datastore
+import monitoring
+import serialize
 import unique_code
 
 # The unique exercise code
@@ -32,21 +33,81 @@ ucode = unique_code.exercise_hash(os.getenv('EXER'))
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
-metrics.info('app_info', 'Music process')
-
-db = {
-    "name": "http://cmpt756db:30002/api/v1/datastore",
-    "endpoint": [
-        "read",
-        "write",
-        "delete",
-        "read_music",
-        "delete_music",
-    ]
-}
+metrics = monitoring.create_metrics(app, 'Music process')
+
+# Calls to the database service, over pooled keep-alive connections
+db_client = datastore.DatastoreClient(metrics)
+
+# Catalog reads (listings and title lookups) as (ETag, JSON body)
+# pairs, keyed by (owner, query) and grouped by owner.  The owner is
+# None for a listing of the whole table.  Writes through any worker of
+# this pod drop the entries of the owner they touch in every worker;
+# writes through other replicas show up once the entries expire.
+catalog_cache = cache.TTLCache(
+    'catalog',
+    metrics,
+    maxsize=int(os.getenv('CATALOG_CACHE_SIZE', '1000')),
+    ttl=float(os.getenv('CATALOG_CACHE_TTL_SEC', '30')),
+    group=lambda key: key[0])
+
 bp = Blueprint('app', __name__)
 
+# Paging, projection and order parameters that listings forward to
+# the datastore
+PAGING_PARAMS = ('limit', 'next_token', 'format', 'fields', 'sort')
+
+
+def paging_args():
+    """Return the paging parameters given in the current request"""
+    return {k: request.args[k] for k in PAGING_PARAMS if k in request.args}
+
+
+def listing_response(objtype, auth, **params):
+    """
+    Forward a listing request to the datastore.
+
+    An NDJSON (`format=ndjson`) listing is streamed through to the
+    client as it arrives rather than decoded here.
+    """
+    params.update(paging_args())
+    if params.get('format') == 'ndjson':
+        return datastore.relay(
+            db_client.passthrough.read_music(objtype, auth, **params))
+    return db_client.read_music(objtype, auth, **params)
+
+
+def catalog_response(owner, query, load):
+    """
+    Return a catalog read, through the catalog cache, with its ETag.
+
+    `load()` reads the datastore on a miss.  Answers 304 Not Modified
+    if the request's If-None-Match names the current ETag.  The ETag is
+    computed over the items only, so it is unchanged by a reload of
+    the same items.
+    """
+    def load_entry():
+        result = load()
+        if 'Items' not in result:
+            return (None, serialize.dumps(result))
+        items = serialize.dumps(result['Items'], sort_keys=True)
+        return (hashlib.sha1(items).hexdigest(), serialize.dumps(result))
+
+    etag, body = catalog_cache.get_or_load(
+        (owner, query), load_entry, lambda entry: entry[0] is not None)
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def invalidate_owner(owner):
+    """Drop the cached catalog reads of `owner` and of the whole table"""
+    catalog_cache.invalidate_group(owner)
+    catalog_cache.invalidate_group(None)
+
 
 @bp.route('/health')
 @metrics.do_not_track()
@@ -72,16 +133,19 @@ def list_table():
     # list all songs here
     if headers['Authorization'] != 'Bearer A':
         #pass in owner id, list all music under that owner
-        payload = {"objtype": "music", "owner": headers['Authorization']}
+        owner = headers['Authorization']
+        payload = {"owner": owner}
     else:
         #for testing, list the whole table
-        payload = {"objtype": "music"}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.get(
-        url,
-        payload,
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+        owner = None
+        payload = {}
+    if request.args.get('format') == 'ndjson':
+        return listing_response("music", headers['Authorization'], **payload)
+    query = ('list',) + tuple(sorted(paging_args().items()))
+    return catalog_response(
+        owner,
+        query,
+        lambda: listing_response("music", headers['Authorization'], **payload))
 
 
 # @bp.route('/', methods=['GET'])
@@ -110,13 +174,7 @@ def get_song(music_id):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    payload = {"objtype": "music", "objkey": music_id}
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    return db_client.read("music", music_id, headers['Authorization'])
 
 @bp.route('/<owner>/<music_name>', methods=['GET'])
 def get_song_new(owner, music_name):
@@ -126,13 +184,13 @@ def get_song_new(owner, music_name):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    payload = {"objtype": "music", "objkey": music_name, "owner": owner}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    return catalog_response(
+        owner,
+        ('title', music_name),
+        lambda: db_client.read_music("music",
+                                     headers['Authorization'],
+                                     objkey=music_name,
+                                     owner=owner))
 
 
 @bp.route('/', methods=['POST'])
@@ -150,12 +208,12 @@ def create_song():
         Owner = content['Owner']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][1]
-    response = requests.post(
-        url,
-        json={"objtype": "music", "Artist": Artist, "SongTitle": SongTitle, "Owner": Owner},
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    response = db_client.passthrough.write(
+        "music",
+        {"Artist": Artist, "SongTitle": SongTitle, "Owner": Owner},
+        headers['Authorization'])
+    invalidate_owner(Owner)
+    return datastore.relay(response)
 
 # @bp.route('/test_new_db_create', methods=['POST'])
 # def create_song_new_db():
@@ -191,13 +249,9 @@ def delete_song(music_id):
                         mimetype='application/json')
     detail = get_song(music_id)
     
-    url = db['name'] + '/' + db['endpoint'][2]
-    response = requests.delete(
-        url,
-        params={"objtype": "music", "objkey": music_id},
-        headers={'Authorization': headers['Authorization']})
-
-    ret = response.json()
+    ret = db_client.delete("music", music_id, headers['Authorization'])
+    for item in detail.get('Items', []):
+        invalidate_owner(item.get('Owner'))
     ret["deleted_song_detail"] = detail
     return (ret)
 
@@ -219,12 +273,13 @@ def delete_song_new(owner):
         # Owner = content['Owner']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][4]
-    response = requests.delete(
-        url,
-        params={"objtype": "music", "objkey": SongTitle, "owner": owner, "artist": Artist},
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    response = db_client.passthrough.delete_music("music",
+                                                  headers['Authorization'],
+                                                  objkey=SongTitle,
+                                                  owner=owner,
+                                                  artist=Artist)
+    invalidate_owner(owner)
+    return datastore.relay(response)
 
 
 @bp.route('/test', methods=['GET'])
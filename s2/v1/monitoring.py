@@ -0,0 +1,136 @@
+"""
+SFU CMPT 756
+Prometheus metrics of a service, served by one process or many.
+
+Under Flask's server the service is one process and its metrics are
+prometheus_flask_exporter's defaults.  Under Gunicorn
+(`gunicorn.conf.py`), every worker process writes its metrics to
+memory-mapped files in `prometheus_multiproc_dir`, and `/metrics`, on
+whichever worker serves it, reports them summed over the workers,
+together with the resources used by all the service's processes.
+
+The same module is copied into each service directory (s1, s2/v1,
+s3, db) because each container image is built from its own directory.
+"""
+
+# Standard library modules
+import os
+
+# Installed packages
+from flask import Response
+
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry
+from prometheus_client import Gauge
+from prometheus_client import ProcessCollector
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import Metric
+
+from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import GunicornPrometheusMetrics
+
+# Set by gunicorn.conf.py before the workers start
+MULTIPROCESS = 'prometheus_multiproc_dir' in os.environ
+
+
+def service_pids():
+    """
+    Return the process IDs of the Gunicorn master and all its workers.
+
+    Called in a worker, whose parent is the master.
+    """
+    master = os.getppid()
+    pids = [master]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry), 'rb') as stat:
+                # The fields after the parenthesized command name are
+                # state, then parent PID
+                ppid = int(stat.read().rsplit(b')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master:
+            pids.append(int(entry))
+    return pids
+
+
+class ServiceProcessCollector():
+    """
+    The `process_*` metrics of the whole service.
+
+    prometheus_client's ProcessCollector reports one process.  This
+    sums its figures over the Gunicorn master and workers, so that
+    the CPU, memory and file descriptor panels of the Grafana
+    dashboards count every process of the pod.
+    """
+    # Figures of the whole service that are not sums
+    EARLIEST = 'process_start_time_seconds'
+    LARGEST = 'process_max_fds'
+
+    def collect(self):
+        totals = {}  # sample name -> value
+        families = {}  # family name -> Metric, without samples
+        for pid in service_pids():
+            collector = ProcessCollector(pid=lambda pid=pid: pid,
+                                         registry=None)
+            for family in collector.collect():
+                families.setdefault(family.name, family)
+                for sample in family.samples:
+                    if sample.name not in totals:
+                        totals[sample.name] = sample.value
+                    elif sample.name == self.EARLIEST:
+                        totals[sample.name] = min(totals[sample.name],
+                                                  sample.value)
+                    elif sample.name == self.LARGEST:
+                        totals[sample.name] = max(totals[sample.name],
+                                                  sample.value)
+                    else:
+                        totals[sample.name] += sample.value
+        for family in families.values():
+            metric = Metric(family.name, family.documentation, family.type)
+            for sample in family.samples:
+                metric.add_sample(sample.name, {}, totals[sample.name])
+            yield metric
+
+
+def create_metrics(app, description):
+    """
+    Return the PrometheusMetrics of a service's Flask `app`.
+
+    Parameters
+    ----------
+    app: Flask
+        The service.
+    description: string
+        Description of the service's `app_info` metric.
+
+    Returns
+    -------
+    PrometheusMetrics
+        Routes are tracked as by PrometheusMetrics(app), and `/metrics`
+        reports every worker's requests under Gunicorn.
+    """
+    if not MULTIPROCESS:
+        metrics = PrometheusMetrics(app)
+    else:
+        # This class serves no `/metrics`; the route below does
+        metrics = GunicornPrometheusMetrics(app)
+
+        @app.route('/metrics')
+        @metrics.do_not_track()
+        def prometheus_metrics():
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            registry.register(ServiceProcessCollector())
+            return Response(generate_latest(registry),
+                            mimetype=CONTENT_TYPE_LATEST)
+
+    # One series whatever the number of workers.  Gauges otherwise
+    # report a series per worker process.
+    info = Gauge('app_info', description,
+                 multiprocess_mode='max', registry=metrics.registry)
+    info.set(1)
+    return metrics
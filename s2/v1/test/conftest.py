@@ -0,0 +1,122 @@
+"""
+Configure for pytest.
+
+Runs the tests of the music service's own modules, with a stand-in for
+the database service.  From the `s2/v1` directory:
+
+    python -m pytest test
+
+`unique_code.py` is rendered from its template if `make templates` has
+not been run.
+"""
+
+# Standard libraries
+import importlib.util
+import os
+import sys
+import types
+
+# Installed packages
+from prometheus_client import CollectorRegistry
+
+import pytest
+
+import requests
+
+import simplejson as json
+
+# The modules under test are in the directory above, and those it
+# shares with other services in `shared/`, whose copies may be stale
+V1_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, V1_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(V1_DIR)),
+                                'shared'))
+
+
+def new_metrics():
+    """Return a stand-in for PrometheusMetrics, with its own registry."""
+    return types.SimpleNamespace(registry=CollectorRegistry())
+
+
+def raw_response(body):
+    """Return a requests.Response of `body`, as passthrough calls do."""
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(body).encode()
+    response._content_consumed = True
+    return response
+
+
+class Datastore():
+    """
+    The music table, behind the calls app.py makes of a DatastoreClient.
+
+    `reads` counts the reads, which the cache should spare.
+    """
+    def __init__(self):
+        self.songs = []
+        self.reads = 0
+
+    @property
+    def passthrough(self):
+        return types.SimpleNamespace(
+            write=lambda *args: raw_response(self.write(*args)),
+            read_music=lambda *args, **kwargs: raw_response(
+                self.read_music(*args, **kwargs)),
+            delete_music=lambda *args, **kwargs: raw_response(
+                self.delete_music(*args, **kwargs)))
+
+    def _matching(self, objkey=None, owner=None, artist=None):
+        return [s for s in self.songs
+                if objkey in (None, s['SongTitle'])
+                and owner in (None, s['Owner'])
+                and artist in (None, s['Artist'])]
+
+    def read_music(self, objtype, auth=None, objkey=None, owner=None,
+                   **params):
+        self.reads += 1
+        items = [dict(s) for s in self._matching(objkey, owner)]
+        return {"Items": items, "Count": len(items)}
+
+    def write(self, objtype, item, auth=None):
+        song = dict(item, music_id='m{}'.format(len(self.songs) + 1))
+        self.songs.append(song)
+        return {"music_id": song['music_id']}
+
+    def delete_music(self, objtype, auth=None, objkey=None, owner=None,
+                     artist=None):
+        gone = self._matching(objkey, owner, artist)
+        self.songs = [s for s in self.songs if s not in gone]
+        return {"Items": gone, "Count": len(gone), "unprocessed": []}
+
+
+@pytest.fixture(scope='session')
+def app_module(request):
+    try:
+        import unique_code  # noqa: F401
+    except ImportError:
+        spec = importlib.util.spec_from_file_location(
+            'unique_code', os.path.join(V1_DIR, 'unique_code-tpl.py'))
+        sys.modules['unique_code'] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(sys.modules['unique_code'])
+    os.environ.setdefault('EXER', 'test')
+    import app
+    return app
+
+
+@pytest.fixture
+def db(request, app_module, monkeypatch):
+    """Give the service an empty music table and cache; return the table."""
+    import cache
+    db = Datastore()
+    monkeypatch.setattr(app_module, 'db_client', db)
+    monkeypatch.setattr(app_module, 'catalog_cache', cache.TTLCache(
+        'catalog', new_metrics(), maxsize=100, ttl=30,
+        group=lambda key: key[0]))
+    return db
+
+
+@pytest.fixture
+def client(request, app_module, db):
+    return app_module.app.test_client()
@@ -0,0 +1,91 @@
+"""
+Test the catalog reads of the music service: their caching, their
+ETags and If-None-Match, and their invalidation by writes.
+"""
+
+# Installed packages
+import pytest
+
+URL = '/api/v1/music/'
+ALL = {'Authorization': 'Bearer A'}
+
+
+def auth(owner):
+    return {'Authorization': owner}
+
+
+@pytest.fixture
+def songs(request, client):
+    for owner, artist, title in (('ann', 'Big Mama Thornton', 'Hound Dog'),
+                                 ('ann', 'Aretha Franklin', 'Respect'),
+                                 ('bob', 'Elvis Presley', 'Hound Dog')):
+        response = client.post(URL, headers=ALL, json={
+            'Artist': artist, 'SongTitle': title, 'Owner': owner})
+        assert response.status_code == 200
+
+
+def test_listing_is_cached(client, db, songs):
+    first = client.get(URL + 'list_table', headers=auth('ann'))
+    assert first.status_code == 200
+    assert first.get_json()['Count'] == 2
+    second = client.get(URL + 'list_table', headers=auth('ann'))
+    assert second.get_data() == first.get_data()
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert db.reads == 1
+
+
+def test_if_none_match(client, db, songs):
+    etag = client.get(URL + 'list_table', headers=ALL).headers['ETag']
+    response = client.get(URL + 'list_table',
+                          headers=dict(ALL, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.headers['ETag'] == etag
+    response = client.get(URL + 'list_table',
+                          headers=dict(ALL, **{'If-None-Match': '"stale"'}))
+    assert response.status_code == 200
+    assert response.get_json()['Count'] == 3
+
+
+def test_etag_depends_only_on_items(client, db, songs, app_module):
+    etag = client.get(URL + 'list_table', headers=ALL).headers['ETag']
+    app_module.catalog_cache.invalidate_group(None)
+    response = client.get(URL + 'list_table',
+                          headers=dict(ALL, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert db.reads == 2
+
+
+def test_write_invalidates_owner_and_whole_table(client, db, songs):
+    etags = {}
+    for owner in ('ann', 'bob', 'Bearer A'):
+        etags[owner] = client.get(URL + 'list_table',
+                                  headers=auth(owner)).headers['ETag']
+    client.post(URL, headers=ALL, json={
+        'Artist': 'Otis Redding', 'SongTitle': 'Respect', 'Owner': 'ann'})
+    for owner, status in (('ann', 200), ('bob', 304), ('Bearer A', 200)):
+        response = client.get(URL + 'list_table', headers=dict(
+            auth(owner), **{'If-None-Match': etags[owner]}))
+        assert response.status_code == status
+    assert db.reads == 5
+
+
+def test_title_lookup(client, db, songs):
+    response = client.get(URL + 'ann/Hound Dog', headers=ALL)
+    assert response.get_json()['Items'][0]['Artist'] == 'Big Mama Thornton'
+    etag = response.headers['ETag']
+    response = client.get(URL + 'ann/Hound Dog',
+                          headers=dict(ALL, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert db.reads == 1
+
+
+def test_delete_by_name_invalidates(client, db, songs):
+    etag = client.get(URL + 'ann/Hound Dog', headers=ALL).headers['ETag']
+    response = client.delete(URL + 'delete_by_name/ann', headers=ALL, json={
+        'Artist': 'Big Mama Thornton', 'SongTitle': 'Hound Dog'})
+    assert response.get_json()['Count'] == 1
+    response = client.get(URL + 'ann/Hound Dog',
+                          headers=dict(ALL, **{'If-None-Match': etag}))
+    assert response.status_code == 200
+    assert response.get_json()['Count'] == 0
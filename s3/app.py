@@ -14,14 +14,14 @@ from flask import Flask
 from flask import request
 from flask import Response
 
-from prometheus_flask_exporter import PrometheusMetrics
-
-import requests
-
 import simplejson as json
 import time
 
 # Local modules
+import datastore
+import history
+import monitoring
+import serialize
 import unique_code
 
 # The unique exercise code
@@ -32,21 +32,42 @@ import unique_code
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
-metrics.info('app_info', 'Playlist process')
-
-db = {
-    "name": "http://cmpt756db:30002/api/v1/datastore",
-    "endpoint": [
-        "read",
-        "write",
-        "delete",
-        "read_music",
-        "delete_music",
-    ]
-}
+metrics = monitoring.create_metrics(app, 'Playlist process')
+
+# Calls to the database service, over pooled keep-alive connections
+db_client = datastore.DatastoreClient(metrics)
+
+# Plays of each owner's songs, written to the History table in batches
+play_history = history.PlayHistory(
+    db_client,
+    metrics,
+    flush_size=int(os.getenv('HISTORY_FLUSH_SIZE', '100')),
+    flush_sec=float(os.getenv('HISTORY_FLUSH_SEC', '5')))
+
 bp = Blueprint('app', __name__)
 
+# Paging, projection and order parameters that listings forward to
+# the datastore
+PAGING_PARAMS = ('limit', 'next_token', 'format', 'fields', 'sort')
+
+
+def paging_args():
+    """Return the paging parameters given in the current request"""
+    return {k: request.args[k] for k in PAGING_PARAMS if k in request.args}
+
+
+def listing_response(objtype, auth, **params):
+    """
+    Forward a listing request to the datastore.
+
+    The listing, JSON or NDJSON (`format=ndjson`), is streamed through
+    to the client as it arrives rather than decoded here.
+    """
+    params.update(paging_args())
+    return datastore.relay(
+        db_client.passthrough.read_music(objtype, auth, **params))
+
+
 @bp.route('/show_playlist', methods=['GET'])
 def show_playlist():
     headers = request.headers
@@ -58,16 +79,11 @@ def show_playlist():
     # list all songs here
     if headers['Authorization'] != 'Bearer A':
         #pass in owner id, list all music under that owner
-        payload = {"objtype": "PlayList"}
+        payload = {}
     else:
         #for testing, list the whole table
-        payload = {"objtype": "PlayList"}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.get(
-        url,
-        payload,
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+        payload = {}
+    return listing_response("PlayList", headers['Authorization'], **payload)
 
 @bp.route('/read', methods=['GET'])
 def get_song():
@@ -86,13 +102,12 @@ def get_song():
         return json.dumps({"message": "error reading arguments"})
 
 
-    payload = {"objtype": "playlist", "objkey": SongTitle, "artist": Artist, "owner": Owner}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    return datastore.relay(
+        db_client.passthrough.read_music("playlist",
+                                         headers['Authorization'],
+                                         objkey=SongTitle,
+                                         artist=Artist,
+                                         owner=Owner))
 
 @bp.route('/play/<owner>/<music_name>', methods=['GET'])
 def play_music(owner, music_name):
@@ -103,40 +118,41 @@ def play_music(owner, music_name):
                         status=401,
                         mimetype='application/json')
 
-    #check if music in play list:    
-    payload = {"objtype": "Playlist", "owner": headers['Authorization']}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.get(
-        url,
-        payload,
-        headers={'Authorization': headers['Authorization']})
-
-    items = response.json()
-    if 'Count' not in items or items['Count'] == 0:
-        return (response.json())
-    else:
-        if music_name != "NONE":
-            #same as read
-            # payload = {"objtype": "Playlist", "objkey": music_name, "owner": headers['Authorization'], "create_time": 0}
-            payload = {"objtype": "Playlist", "objkey": music_name, "owner": owner}
-            url = db['name'] + '/' + db['endpoint'][3]
-            response = requests.get(
-                url,
-                params=payload,
-                headers={'Authorization': headers['Authorization']})
-            return (response.json())
-
-        else:
-            payload = {"objtype": "Playlist", "owner": headers['Authorization'], "create_time": 0}
-            # play from begining
-            url = db['name'] + "/next"
-            response = requests.get(
-                url,
-                payload,
-                headers={'Authorization': headers['Authorization']})
-            items = response.json()
-    
-    return (response.json())
+    auth = headers['Authorization']
+    if music_name != "NONE":
+        #same as read
+        return played(db_client.read_music("Playlist",
+                                           auth,
+                                           objkey=music_name,
+                                           owner=owner))
+    # play from begining
+    return played(db_client.cursor("playlist", auth, "next", auth))
+
+
+def played(response):
+    """Record a play of the track in a datastore response; send it on"""
+    if response.get('Items'):
+        play_history.record(response['Items'][0])
+    return Response(serialize.dumps(response), mimetype='application/json')
+
+
+def navigate(direction, create_time):
+    """
+    Return the track after (or before) the current one, wrapping around.
+
+    The current track is given by the `cursor` query parameter that
+    the previous call returned or, failing that, by its
+    `create_time`.  One indexed datastore call; an empty playlist
+    gives an empty `Items`.
+    """
+    auth = request.headers['Authorization']
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        return played(db_client.cursor("playlist", auth, direction, auth,
+                                       cursor=cursor))
+    return played(db_client.cursor("playlist", auth, direction, auth,
+                                   create_time=create_time))
+
 
 @bp.route('/next/<owner>/<create_time>', methods=['GET'])
 def next_music(owner, create_time):
@@ -147,44 +163,8 @@ def next_music(owner, create_time):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
+    return navigate("next", create_time)
 
-    #check if music in play list:
-    payload = {"objtype": "Playlist", "owner": headers['Authorization'], "create_time": create_time}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.get(
-        url,
-        payload,
-        headers={'Authorization': headers['Authorization']})
-
-    items = response.json()
-    if 'Count' not in items or items['Count'] == 0:
-        return (response.json())
-    else:
-        # print("count: " + str(items['Count']))
-        # try play newer one
-        url = db['name'] + "/next"
-        response_ = requests.get(
-            url,
-            payload,
-            headers={'Authorization': headers['Authorization']})
-        items_ = response_.json()
-        
-        if 'Count' not in items_  or items_['Count'] == 0:        
-            # otherwise play from begining
-            url = db['name'] + "/next"
-            payload = {"objtype": "Playlist", "owner": headers['Authorization'], "create_time": 0}
-            response__ = requests.get(
-                url,
-                payload,
-                headers={'Authorization': headers['Authorization']})
-            ret = response__.json()
-            ret["test_the_last_query"] = str(items_)
-            return (ret)
-        else:
-            # print("count: " + str(items_['Count']))
-            return (response_.json())
-    
-    return (response.json())
 
 @bp.route('/prev/<owner>/<create_time>', methods=['GET'])
 def prev_music(owner, create_time):
@@ -195,44 +175,7 @@ def prev_music(owner, create_time):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-
-    #check if music in play list:
-    payload = {"objtype": "Playlist", "owner": headers['Authorization'], "create_time": create_time}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.get(
-        url,
-        payload,
-        headers={'Authorization': headers['Authorization']})
-
-    items = response.json()
-    if 'Count' not in items or items['Count'] == 0:
-        return (response.json())
-    else:
-        # print("count: " + str(items['Count']))
-        # try play newer one
-        url = db['name'] + "/prev"
-        response_ = requests.get(
-            url,
-            payload,
-            headers={'Authorization': headers['Authorization']})
-        items_ = response_.json()
-        
-        if 'Count' not in items_  or items_['Count'] == 0:        
-            # otherwise play from begining
-            url = db['name'] + "/next"
-            payload = {"objtype": "Playlist", "owner": headers['Authorization'], "create_time": 0}
-            response__ = requests.get(
-                url,
-                payload,
-                headers={'Authorization': headers['Authorization']})
-            ret = response__.json()
-            ret["test_the_last_query"] = str(items_)
-            return (ret)
-        else:
-            # print("count: " + str(items_['Count']))
-            return (response_.json())
-    
-    return (response.json())
+    return navigate("prev", create_time)
 
 @bp.route('/add_music_to_playlist', methods=['POST'])
 def add_music_to_playlist():
@@ -251,26 +194,20 @@ def add_music_to_playlist():
         return json.dumps({"message": "error reading arguments"})
 
     #read from music_list first
-    payload = {"objtype": "music", "objkey": SongTitle, "Artist": Artist, "owner": Owner}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
-    
-    items = response.json()        
+    items = db_client.read_music("music",
+                                 headers['Authorization'],
+                                 objkey=SongTitle,
+                                 Artist=Artist,
+                                 owner=Owner,
+                                 fields="music_id")
     if 'Count' not in items  or items['Count'] == 0:  
-        ret = response.json()
-        ret['Error Message'] = "Can only add music existed in music list to play list!"
-        return (ret)
+        items['Error Message'] = "Can only add music existed in music list to play list!"
+        return (items)
     else:
-        url = db['name'] + '/' + db['endpoint'][1]
-        response = requests.post(
-            url,
-            json={"objtype": "playlist", "Artist": Artist, "SongTitle": SongTitle, "Owner": Owner, "create_time": int(time.time())},
-            headers={'Authorization': headers['Authorization']})
-        return (response.json())
-    return (response.json())
+        return datastore.relay(db_client.passthrough.write(
+            "playlist",
+            {"Artist": Artist, "SongTitle": SongTitle, "Owner": Owner, "create_time": int(time.time())},
+            headers['Authorization']))
 
 
 @bp.route('/<music_id>', methods=['DELETE'])
@@ -283,15 +220,11 @@ def delete_song(music_id):
                         mimetype='application/json')
     # detail = get_song(music_id)
     
-    url = db['name'] + '/' + db['endpoint'][2]
-    response = requests.delete(
-        url,
-        params={"objtype": "playlist", "objkey": music_id},
-        headers={'Authorization': headers['Authorization']})
+    ret = db_client.passthrough.delete("playlist", music_id,
+                                       headers['Authorization'])
 
-    # ret = response.json()
     # ret["deleted_song_detail"] = detail
-    return ( response.json())
+    return datastore.relay(ret)
 
     
 @bp.route('/delete_by_name/<owner>', methods=['DELETE'])
@@ -311,12 +244,32 @@ def delete_song_by_name(owner):
         # Owner = content['Owner']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][4]
-    response = requests.delete(
-        url,
-        params={"objtype": "playlist", "objkey": SongTitle, "owner": owner, "artist": Artist},
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    return datastore.relay(
+        db_client.passthrough.delete_music("playlist",
+                                           headers['Authorization'],
+                                           objkey=SongTitle,
+                                           owner=owner,
+                                           artist=Artist))
+
+
+@bp.route('/history/<owner>', methods=['GET'])
+def play_counts(owner):
+    """
+    List `owner`'s songs with their play counts.
+
+    Each item has the SongTitle, Artist, `play_count` and
+    `last_played` time of a song.  Plays reach the History table in
+    batches, up to HISTORY_FLUSH_SEC seconds after they are made.
+    Takes the listing parameters (`limit`, `next_token`, ...).
+    """
+    headers = request.headers
+    # check header here
+    if 'Authorization' not in headers:
+        return Response(json.dumps({"error": "missing auth"}),
+                        status=401,
+                        mimetype='application/json')
+    return listing_response("history", headers['Authorization'],
+                            owner=owner)
 
 
 @bp.route('/health')
@@ -0,0 +1,160 @@
+"""
+SFU CMPT 756
+Play counts and listening history of the playlist service.
+
+Each track served by `/play`, `/next` or `/prev` is a play.  Plays are
+counted in memory, one entry per (owner, song), and written to the
+History table together, with one `/batch_update` that adds each
+entry's count to the stored `play_count` atomically.  A batch is
+written every `flush_sec` seconds, or sooner once `flush_size`
+(owner, song) entries are waiting, so a play costs no datastore call
+of its own and repeated plays of a song cost one update.
+"""
+
+# Standard library modules
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+# Installed packages
+from prometheus_client import Counter
+
+import requests
+
+# Namespace of the keys of History items, which are derived from the
+# owner and song so that every process updates the same item
+HISTORY_NAMESPACE = uuid.UUID('9f0c4b1e-6d3a-4e8b-a1f7-3c2d5e6b7a80')
+
+
+def history_id(owner, song_title):
+    """Return the key of the History item of `owner`'s plays of a song."""
+    return str(uuid.uuid5(HISTORY_NAMESPACE, owner + '\0' + song_title))
+
+
+class PlayHistory():
+    """
+    Buffer of plays, flushed to the History table in batches.
+
+    Safe for use by the threads of a threaded Flask server.  Each
+    process (each Gunicorn worker) has its own buffer and flushing
+    thread, started on its first play.  Plays still buffered when the
+    process exits are flushed then; those of a batch that fails are
+    returned to the buffer for the next one.
+
+    Parameters
+    ----------
+    db_client: DatastoreClient
+        Client of the database service.
+    metrics: PrometheusMetrics
+        The service's metrics; the counters are added to its registry.
+    flush_size: int
+        Number of buffered (owner, song) entries that starts a flush.
+    flush_sec: float
+        Longest time between flushes.
+    """
+    def __init__(self, db_client, metrics, flush_size, flush_sec):
+        self._db_client = db_client
+        self._flush_size = flush_size
+        self._flush_sec = flush_sec
+        self._pending = {}  # history_id -> item, counting plays since flush
+        self._lock = threading.Lock()
+        self._full = threading.Event()
+        self._pid = None  # Process whose flushing thread is running
+        self._plays = Counter(
+            'play_history_plays',
+            'Plays recorded in the play history buffer',
+            registry=metrics.registry)
+        self._flushes = Counter(
+            'play_history_flushes',
+            'Batches of plays written to the History table',
+            registry=metrics.registry)
+        self._updates = Counter(
+            'play_history_updates',
+            'History items updated by play history flushes',
+            ['status'],
+            registry=metrics.registry)
+
+    def record(self, item):
+        """Count a play of the playlist `item` (a track)."""
+        key = history_id(item['Owner'], item['SongTitle'])
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = {'Owner': item['Owner'],
+                         'SongTitle': item['SongTitle'],
+                         'Artist': item.get('Artist', ''),
+                         'play_count': 0}
+                self._pending[key] = entry
+            entry['play_count'] += 1
+            entry['last_played'] = int(time.time())
+            full = len(self._pending) >= self._flush_size
+        self._plays.inc()
+        self._start()
+        if full:
+            self._full.set()
+
+    def flush(self):
+        """Write the buffered plays to the History table."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        updates = [{"objkey": key, "item": entry, "add": ["play_count"]}
+                   for key, entry in pending.items()]
+        try:
+            results = self._db_client.batch_update(
+                "history", updates)['results']
+            failed = {r['history_id'] for r in results
+                      if r['status'] != 'ok'}
+        except (requests.RequestException, KeyError, ValueError):
+            failed = set(pending)
+        except Exception:
+            logging.exception('Play history flush failed')
+            failed = set(pending)
+        self._flushes.inc()
+        self._updates.labels('ok').inc(len(pending) - len(failed))
+        self._updates.labels('failed').inc(len(failed))
+        if failed:
+            self._requeue({key: pending[key] for key in failed})
+
+    def _requeue(self, entries):
+        """
+        Return unwritten `entries` to the buffer.
+
+        An entry merges with any plays of its song buffered since the
+        flush: the counts add up, and the later `last_played` is kept.
+        """
+        with self._lock:
+            for key, entry in entries.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = entry
+                else:
+                    current['play_count'] += entry['play_count']
+                    current['last_played'] = max(current['last_played'],
+                                                 entry['last_played'])
+
+    def _start(self):
+        """Start this process's flushing thread if it is not running."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._full.wait(self._flush_sec)
+            self._full.clear()
+            # The thread must outlive any failure, or plays would be
+            # buffered for good; flush() keeps the plays it could not write
+            try:
+                self.flush()
+            except Exception:
+                logging.exception('Play history flush failed')
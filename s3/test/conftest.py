@@ -0,0 +1,76 @@
+"""
+Configure for pytest.
+
+Runs the tests of the playlist service's own modules, with a stand-in
+for the database service.  From the `s3` directory:
+
+    python -m pytest test
+"""
+
+# Standard libraries
+import os
+import sys
+import threading
+import types
+
+# Installed packages
+from prometheus_client import CollectorRegistry
+
+import pytest
+
+# The modules under test are in the directory above, and those it
+# shares with other services in `shared/`, whose copies may be stale
+S3_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, S3_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(S3_DIR), 'shared'))
+
+
+class Datastore():
+    """
+    The History table, behind the batch_update() of a DatastoreClient.
+
+    `items` holds each history item, its `play_count` added to and its
+    other attributes set by every update, as the database service does.
+    A key in `failing` is answered with a failed status, and every call
+    raises `error` if it is set.  `before` is called at the start of
+    each call, as if a play arrived while the batch was written.
+    """
+    def __init__(self):
+        self.items = {}
+        self.calls = []
+        self.failing = set()
+        self.error = None
+        self.before = None
+        self.called = threading.Event()
+
+    def batch_update(self, objtype, updates, auth=None):
+        self.calls.append((objtype, updates))
+        self.called.set()
+        if self.before is not None:
+            self.before()
+        if self.error is not None:
+            raise self.error
+        results = []
+        for update in updates:
+            key = update['objkey']
+            if key in self.failing:
+                results.append({'history_id': key, 'status': 'failed'})
+                continue
+            item = self.items.setdefault(key, {'play_count': 0})
+            for name, value in update['item'].items():
+                if name in update.get('add', []):
+                    item[name] += value
+                else:
+                    item[name] = value
+            results.append({'history_id': key, 'status': 'ok'})
+        return {'results': results}
+
+
+def new_metrics():
+    """Return a stand-in for PrometheusMetrics, with its own registry."""
+    return types.SimpleNamespace(registry=CollectorRegistry())
+
+
+@pytest.fixture
+def db(request):
+    return Datastore()
@@ -0,0 +1,148 @@
+"""
+Test the play history buffer: its flushes, the plays it keeps when a
+flush fails, and the flush when the process exits.
+"""
+
+# Standard libraries
+import subprocess
+import sys
+from unittest import mock
+
+# Installed packages
+import pytest
+
+import requests
+
+# Local modules
+import history
+from conftest import S3_DIR, new_metrics
+
+
+def track(owner, title):
+    return {'playlist_id': 'p-' + title, 'Owner': owner, 'SongTitle': title,
+            'Artist': 'A'}
+
+
+@pytest.fixture
+def plays(request, db, monkeypatch):
+    """Return a PlayHistory writing to `db`, flushed only when called."""
+    # Neither the flushing thread nor the exit flush of these buffers
+    # is wanted while testing
+    monkeypatch.setattr(history.PlayHistory, '_start', lambda self: None)
+    return history.PlayHistory(db, new_metrics(), flush_size=100,
+                               flush_sec=3600)
+
+
+def record_at(plays, when, item):
+    with mock.patch('time.time', return_value=when):
+        plays.record(item)
+
+
+def test_flush(plays, db):
+    for title in ['a', 'b', 'a']:
+        record_at(plays, 100, track('Ann', title))
+    record_at(plays, 150, track('Ann', 'a'))
+    plays.flush()
+    assert len(db.calls) == 1
+    objtype, updates = db.calls[0]
+    assert objtype == 'history'
+    assert {u['objkey'] for u in updates} == {
+        history.history_id('Ann', 'a'), history.history_id('Ann', 'b')}
+    assert all(u['add'] == ['play_count'] for u in updates)
+    assert db.items[history.history_id('Ann', 'a')] == {
+        'Owner': 'Ann', 'SongTitle': 'a', 'Artist': 'A', 'play_count': 3,
+        'last_played': 150}
+    # Only plays since the last flush are written, and nothing when
+    # there are none
+    plays.flush()
+    assert len(db.calls) == 1
+    record_at(plays, 200, track('Ann', 'a'))
+    plays.flush()
+    assert db.items[history.history_id('Ann', 'a')]['play_count'] == 4
+
+
+def test_history_id():
+    assert history.history_id('Ann', 'a') == history.history_id('Ann', 'a')
+    assert history.history_id('Ann', 'a') != history.history_id('Ann', 'b')
+    assert history.history_id('Ann', 'a') != history.history_id('Bob', 'a')
+
+
+@pytest.mark.parametrize('error', [
+    requests.ConnectionError('down'),
+    RuntimeError('unexpected'),
+])
+def test_failed_flush_keeps_plays(plays, db, error):
+    record_at(plays, 100, track('Ann', 'a'))
+    db.error = error
+    plays.flush()
+    assert db.items == {}
+    db.error = None
+    plays.flush()
+    assert db.items[history.history_id('Ann', 'a')]['play_count'] == 1
+
+
+def test_failed_items_are_requeued(plays, db):
+    record_at(plays, 100, track('Ann', 'a'))
+    record_at(plays, 100, track('Ann', 'b'))
+    db.failing = {history.history_id('Ann', 'b')}
+    plays.flush()
+    db.failing = set()
+    plays.flush()
+    _, updates = db.calls[1]
+    assert [u['objkey'] for u in updates] == [history.history_id('Ann', 'b')]
+    assert db.items[history.history_id('Ann', 'a')]['play_count'] == 1
+    assert db.items[history.history_id('Ann', 'b')]['play_count'] == 1
+
+
+@pytest.mark.parametrize('failed_at, played_at', [(100, 200), (200, 100)])
+def test_requeue_merges_with_later_plays(plays, db, failed_at, played_at):
+    record_at(plays, failed_at, track('Ann', 'a'))
+    record_at(plays, failed_at, track('Ann', 'a'))
+    # A play of the same song arrives while the batch is written, which
+    # then fails
+    db.before = lambda: record_at(plays, played_at, track('Ann', 'a'))
+    db.error = requests.ConnectionError('down')
+    plays.flush()
+    db.before = db.error = None
+    plays.flush()
+    assert db.items[history.history_id('Ann', 'a')]['play_count'] == 3
+    assert db.items[history.history_id('Ann', 'a')]['last_played'] == 200
+
+
+def test_full_buffer_starts_a_flush(db, monkeypatch):
+    monkeypatch.setattr('atexit.register', lambda f: None)
+    plays = history.PlayHistory(db, new_metrics(), flush_size=2,
+                                flush_sec=3600)
+    plays.record(track('Ann', 'a'))
+    plays.record(track('Ann', 'a'))
+    assert not db.called.is_set()
+    plays.record(track('Ann', 'b'))
+    assert db.called.wait(5)
+
+
+# Records plays in a process that then exits before any flush is due;
+# its stand-in datastore prints what reaches it
+EXITING_PROCESS = '''
+import sys
+sys.path[:0] = [{test!r}, {s3!r}]
+import conftest
+import history
+
+class Datastore(conftest.Datastore):
+    def batch_update(self, objtype, updates, auth=None):
+        print(sorted(u['item']['play_count'] for u in updates))
+        return super().batch_update(objtype, updates, auth)
+
+plays = history.PlayHistory(Datastore(), conftest.new_metrics(),
+                            flush_size=100, flush_sec=3600)
+for title in ['a', 'b', 'b']:
+    plays.record({{'Owner': 'Ann', 'SongTitle': title}})
+'''
+
+
+def test_plays_are_flushed_at_exit():
+    script = EXITING_PROCESS.format(test=S3_DIR + '/test', s3=S3_DIR)
+    result = subprocess.run([sys.executable, '-c', script],
+                            capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == '[1, 2]\n'
@@ -0,0 +1,430 @@
+"""
+SFU CMPT 756
+Client for the database service.
+
+Each service keeps one DatastoreClient for all of its calls to the
+database service.  Its session pools kept-alive connections, so
+successive calls reuse a connection instead of opening (and, under
+Istio, handshaking) a new one per call.
+
+A handler that returns the database service's answer unchanged can
+call through `client.passthrough` instead and return relay() of the
+result: the body is then streamed to the client as it arrives, with
+the upstream status and content type, rather than decoded here and
+encoded again by Flask.
+
+Each container image is built from its own directory, so
+`tools/copy-shared.sh` copies this module into those of s1, s2/v1 and
+s3; edit it here.
+"""
+
+# Standard library modules
+import concurrent.futures
+import copy
+import os
+import threading
+import time
+
+# Installed packages
+import flask
+
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.core import GaugeMetricFamily
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from urllib3.util.retry import Retry
+
+# Local modules
+import serialize
+
+DB_URL = os.getenv('DB_URL', 'http://cmpt756db:30002/api/v1/datastore')
+
+# Defaults for every service, each overridable through the environment
+# of the service's container
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '20'))
+TIMEOUT_SEC = float(os.getenv('DB_TIMEOUT_SEC', '5'))
+RETRIES = int(os.getenv('DB_RETRIES', '2'))
+
+# Only these methods are retried.  urllib3's default list also has
+# PUT, but an `/update` may increment counters (`add`) or check a
+# `version`, so repeating one that reached the database would count
+# twice or fail its own condition.  POSTs (`/write`) are never repeated.
+RETRY_METHODS = frozenset({'GET', 'HEAD', 'DELETE', 'OPTIONS'})
+RETRY_BACKOFF_SEC = 0.1
+RETRY_STATUS = (502, 503, 504)
+
+# Threads running the calls started by DatastoreClient.submit()
+ASYNC_WORKERS = int(os.getenv('DB_ASYNC_WORKERS', '8'))
+
+# Set when the service runs under Gunicorn (see monitoring.py)
+MULTIPROCESS = 'prometheus_multiproc_dir' in os.environ
+
+
+class PooledSession(requests.Session):
+    """A session that applies a default timeout to every request."""
+    def __init__(self, timeout):
+        super().__init__()
+        self._timeout = timeout
+        # PoolMetrics to update after each request, if any
+        self.pool_metrics = None
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        try:
+            return super().request(method, url, **kwargs)
+        finally:
+            if self.pool_metrics is not None:
+                self.pool_metrics.publish()
+
+
+def pool_stats(adapter, pool_size):
+    """
+    Yield (host, in use, opened, requests) for each pool of `adapter`.
+
+    `in use` is the number of connections checked out of the pool,
+    `opened` the number of connections opened and `requests` the
+    number of requests sent.
+    """
+    pools = adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None or pool.pool is None:
+            continue
+        # The pool queue starts full of placeholders; every
+        # connection taken out of it is in use.
+        yield ('{}:{}'.format(pool.host, pool.port),
+               pool_size - pool.pool.qsize(),
+               pool.num_connections,
+               pool.num_requests)
+
+
+class PoolCollector():
+    """
+    Prometheus collector for the connection pools of a session.
+
+    Reports, per database host, the connections checked out of the
+    pool, the connections opened and the requests sent.
+    """
+    def __init__(self, adapter, pool_size):
+        self._adapter = adapter
+        self._pool_size = pool_size
+
+    def collect(self):
+        in_use = GaugeMetricFamily(
+            'datastore_pool_connections_in_use',
+            'Connections to the database service in use',
+            labels=['host'])
+        opened = CounterMetricFamily(
+            'datastore_pool_connections_opened',
+            'Connections opened to the database service',
+            labels=['host'])
+        sent = CounterMetricFamily(
+            'datastore_pool_requests',
+            'Requests sent over pooled connections',
+            labels=['host'])
+        for host, n_in_use, n_opened, n_sent in pool_stats(
+                self._adapter, self._pool_size):
+            in_use.add_metric([host], n_in_use)
+            opened.add_metric([host], n_opened)
+            sent.add_metric([host], n_sent)
+        return [in_use, opened, sent]
+
+
+class PoolMetrics():
+    """
+    The metrics of PoolCollector, for a service with several workers.
+
+    A collector only reports the process serving `/metrics`, so each
+    worker instead writes its pool's figures to the shared metrics
+    files after every request, where they are summed over the workers.
+    """
+    def __init__(self, adapter, pool_size, registry):
+        self._adapter = adapter
+        self._pool_size = pool_size
+        self._lock = threading.Lock()
+        self._counted = {}  # host -> (opened, sent) already counted
+        self._in_use = Gauge(
+            'datastore_pool_connections_in_use',
+            'Connections to the database service in use',
+            ['host'],
+            multiprocess_mode='livesum',
+            registry=registry)
+        self._opened = Counter(
+            'datastore_pool_connections_opened',
+            'Connections opened to the database service',
+            ['host'],
+            registry=registry)
+        self._sent = Counter(
+            'datastore_pool_requests',
+            'Requests sent over pooled connections',
+            ['host'],
+            registry=registry)
+
+    def publish(self):
+        """Record the current figures of the pools."""
+        with self._lock:
+            for host, n_in_use, n_opened, n_sent in pool_stats(
+                    self._adapter, self._pool_size):
+                opened, sent = self._counted.get(host, (0, 0))
+                self._in_use.labels(host).set(n_in_use)
+                self._opened.labels(host).inc(n_opened - opened)
+                self._sent.labels(host).inc(n_sent - sent)
+                self._counted[host] = (n_opened, n_sent)
+
+
+def create_session(metrics,
+                   pool_size=POOL_SIZE,
+                   timeout=TIMEOUT_SEC,
+                   retries=RETRIES):
+    """
+    Return a pooled keep-alive session for calls to the database service.
+
+    Parameters
+    ----------
+    metrics: PrometheusMetrics
+        The service's metrics; the pool metrics are added to its registry.
+    pool_size: int
+        Maximum number of connections kept open to each host.  This
+        should be at least the number of threads serving requests.
+    timeout: float
+        Seconds to wait for a connection or a response.
+    retries: int
+        Retries of a RETRY_METHODS request after a connection error or
+        a 502/503/504 response.
+
+    Returns
+    -------
+    PooledSession
+    """
+    session = PooledSession(timeout)
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=retries,
+                          backoff_factor=RETRY_BACKOFF_SEC,
+                          status_forcelist=RETRY_STATUS,
+                          allowed_methods=RETRY_METHODS,
+                          raise_on_status=False))
+    session.mount('http://', adapter)
+    if MULTIPROCESS:
+        session.pool_metrics = PoolMetrics(adapter, pool_size,
+                                           metrics.registry)
+    else:
+        metrics.registry.register(PoolCollector(adapter, pool_size))
+    return session
+
+
+def relay(response):
+    """
+    Return a Flask response passing on a passthrough call's response.
+
+    The body is sent on in the chunks it arrives in, undecoded, with
+    the upstream status and content type.  The connection goes back to
+    the pool when the server closes the response, even one whose body
+    is never sent (a HEAD request, or a client gone before the first
+    chunk).
+    """
+    relayed = flask.Response(
+        response.iter_content(chunk_size=None),
+        status=response.status_code,
+        content_type=response.headers.get('Content-Type'))
+    relayed.call_on_close(response.close)
+    # A compressed body arrives decompressed, so its length is unknown
+    if ('Content-Length' in response.headers
+            and 'Content-Encoding' not in response.headers):
+        relayed.headers['Content-Length'] = response.headers['Content-Length']
+    return relayed
+
+
+class DatastoreClient():
+    """
+    Python API for the database service.
+
+    Each method makes one call to the service and returns the decoded
+    JSON body.  The latency of every call is recorded in the histogram
+    `datastore_call_seconds`, labelled by method name.
+
+    The methods of `client.passthrough` make the same calls but return
+    the requests.Response, its body not yet read, for relay().  They
+    share the client's session, metrics and threads.  Their latency is
+    the time to the response's headers.
+
+    Parameters
+    ----------
+    metrics: PrometheusMetrics
+        The service's metrics; the client's metrics are added to its
+        registry.
+    url: string
+        The URL prefix of the database service's routes.
+    session: requests.Session or None
+        The session to call through.  By default, a new one from
+        create_session().
+    """
+    def __init__(self, metrics, url=DB_URL, session=None):
+        self.url = url
+        if session is None:
+            session = create_session(metrics)
+        self._session = session
+        self._latency = Histogram(
+            'datastore_call_seconds',
+            'Latency of calls to the database service',
+            ['call'],
+            registry=metrics.registry)
+        self._executor = concurrent.futures.ThreadPoolExecutor(ASYNC_WORKERS)
+        self._raw = False
+
+    @property
+    def passthrough(self):
+        """This client, its methods returning undecoded responses."""
+        client = copy.copy(self)
+        client._raw = True
+        return client
+
+    def _call(self, call, method, endpoint, auth=None, **kwargs):
+        """Make one call and return the (undecoded) requests.Response."""
+        if self._raw:
+            kwargs['stream'] = True
+        if auth is not None:
+            kwargs['headers'] = {'Authorization': auth}
+        start = time.perf_counter()
+        try:
+            return self._session.request(
+                method, self.url + '/' + endpoint, **kwargs)
+        finally:
+            self._latency.labels(call).observe(time.perf_counter() - start)
+
+    def _result(self, response):
+        """Return the decoded body of `response`, unless in passthrough."""
+        return response if self._raw else serialize.loads(response.content)
+
+    def read(self, objtype, objkey, auth=None, **params):
+        """
+        Return the item of `objtype` with key `objkey`.
+
+        `params` may name the attributes to return, as `fields`.
+        """
+        params.update(objtype=objtype, objkey=objkey)
+        return self._result(self._call(
+            'read', 'GET', 'read', auth, params=params))
+
+    def read_music(self, objtype, auth=None, **params):
+        """
+        Return the items of `objtype` matching `params`.
+
+        `params` are the query parameters of `/read_music`:
+        objkey (a song title), owner, artist, limit, next_token,
+        fields (attribute names to return) and sort (asc or desc).
+        """
+        params['objtype'] = objtype
+        return self._result(self._call(
+            'read_music', 'GET', 'read_music', auth, params=params))
+
+    def write(self, objtype, item, auth=None):
+        """Create an item of `objtype`; return its new key."""
+        body = dict(item)
+        body['objtype'] = objtype
+        return self._result(self._call(
+            'write', 'POST', 'write', auth, json=body))
+
+    def update(self, objtype, objkey, changes, auth=None, **params):
+        """
+        Set the attributes in `changes` on an item.
+
+        `params` are the other query parameters of `/update`: add
+        (attributes to increment by their values in `changes`),
+        version (the version the item must be at, or "*") and
+        return_values.
+        """
+        params.update(objtype=objtype, objkey=objkey)
+        return self._result(self._call(
+            'update', 'PUT', 'update', auth,
+            params=params, json=changes))
+
+    def delete(self, objtype, objkey, auth=None):
+        """Delete an item."""
+        return self._result(self._call(
+            'delete', 'DELETE', 'delete', auth,
+            params={"objtype": objtype, "objkey": objkey}))
+
+    def delete_music(self, objtype, auth=None, **params):
+        """Delete the items of `objtype` matching `params`."""
+        params['objtype'] = objtype
+        return self._result(self._call(
+            'delete_music', 'DELETE', 'delete_music', auth,
+            params=params))
+
+    def next(self, objtype, owner, create_time, auth=None, **params):
+        """
+        Return the owner's item created next after `create_time`.
+
+        `params` may ask for more items, as `limit`, and name the
+        attributes to return, as `fields`.
+        """
+        params.update(objtype=objtype, owner=owner, create_time=create_time)
+        return self._result(self._call(
+            'next', 'GET', 'next', auth, params=params))
+
+    def prev(self, objtype, owner, create_time, auth=None, **params):
+        """
+        Return the owner's item created last before `create_time`.
+
+        `params` are as for next().
+        """
+        params.update(objtype=objtype, owner=owner, create_time=create_time)
+        return self._result(self._call(
+            'prev', 'GET', 'prev', auth, params=params))
+
+    def cursor(self, objtype, owner, direction, auth=None, **position):
+        """
+        Return the owner's track next to a position, wrapping around.
+
+        `direction` is "next" or "prev" and `position` either a
+        `cursor` from an earlier call or a `create_time`; with neither,
+        the first (or last) track.  The result carries the `cursor` of
+        the track returned.
+        """
+        position.update({"objtype": objtype,
+                         "owner": owner,
+                         "direction": direction})
+        return self._result(self._call(
+            'cursor', 'GET', 'cursor', auth, params=position))
+
+    def batch_read(self, objtype, objkeys, auth=None):
+        """Return the items of `objtype` with the keys in `objkeys`."""
+        return self._result(self._call(
+            'batch_read', 'POST', 'batch_read', auth,
+            json={"objtype": objtype, "objkeys": list(objkeys)}))
+
+    def batch_write(self, objtype, items=(), deletes=(), auth=None):
+        """Create the `items` and delete the keys in `deletes`."""
+        return self._result(self._call(
+            'batch_write', 'POST', 'batch_write', auth,
+            json={"objtype": objtype,
+                  "items": list(items),
+                  "deletes": list(deletes)}))
+
+    def batch_update(self, objtype, updates, auth=None):
+        """
+        Apply the `updates` to items of `objtype`.
+
+        Each update is `{"objkey": ..., "item": {...}, "add": [...]}`,
+        as the arguments of one update().
+        """
+        return self._result(self._call(
+            'batch_update', 'POST', 'batch_update', auth,
+            json={"objtype": objtype, "updates": list(updates)}))
+
+    def submit(self, call, *args, **kwargs):
+        """
+        Start `call` (a method of this client) in the background.
+
+        Returns a concurrent.futures.Future for its result, so that
+        independent calls can overlap, for example
+        `client.submit(client.read, 'music', music_id)`.
+        """
+        return self._executor.submit(call, *args, **kwargs)
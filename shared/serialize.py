@@ -0,0 +1,114 @@
+"""
+SFU CMPT 756
+JSON encoding of datastore items and responses.
+
+boto3 returns DynamoDB numbers as Decimal, sets as Python sets and
+binary values as Binary (or bytes).  dumps() encodes these with
+orjson, which writes the other JSON types in C, as
+
+* a Decimal: the JSON number, an int if integral, else the float
+  that prints as that number;
+* a set: an array, in no particular order;
+* bytes or a Binary: its base64 string, as in DynamoDB's own JSON.
+
+A DynamoDB number holds up to 38 digits.  A document with a number
+that neither an int in orjson's range (see INT64_MIN) nor a float
+holds exactly is encoded with simplejson instead, digit for digit, and
+so more slowly.
+
+`compact=True` drops the `ResponseMetadata` of a boto3 response (the
+request ID, HTTP headers and retry count of the DynamoDB call), which
+is of no use past the database service.
+
+Each container image is built from its own directory, so
+`tools/copy-shared.sh` copies this module into those of db, s1, s2/v1
+and s3; edit it here.
+"""
+
+# Standard library modules
+import base64
+import decimal
+
+# Installed packages
+import orjson
+
+import simplejson
+
+# Keys of a boto3 response that describe the DynamoDB call rather
+# than its result
+METADATA_KEYS = ('ResponseMetadata',)
+
+# Range of the ints orjson writes: from the least signed 64-bit int
+# to the greatest unsigned one
+INT64_MIN = -2 ** 63
+UINT64_MAX = 2 ** 64 - 1
+
+
+def _default(obj):
+    """Return an orjson-serializable stand-in for `obj`."""
+    if isinstance(obj, decimal.Decimal):
+        numerator, denominator = obj.as_integer_ratio()
+        if denominator == 1:
+            if INT64_MIN <= numerator <= UINT64_MAX:
+                return numerator
+        else:
+            value = float(obj)
+            if decimal.Decimal(repr(value)) == obj:
+                return value
+        raise TypeError('Number not exact as a 64-bit int or a float')
+    return _plain(obj)
+
+
+def _plain(obj):
+    """Return the array of a set or the base64 string of binary data."""
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)) or hasattr(
+            obj, '__bytes__'):
+        return base64.b64encode(bytes(obj)).decode()
+    raise TypeError(
+        'Type is not JSON serializable: {}'.format(type(obj).__name__))
+
+
+def dumps(obj, compact=False, sort_keys=False):
+    """
+    Return the JSON encoding of `obj`, as UTF-8 bytes.
+
+    Parameters
+    ----------
+    obj: object
+        A datastore item or response, or other JSON-like value.
+    compact: bool
+        Drop the top-level METADATA_KEYS of a response.
+    sort_keys: bool
+        Write the keys of each object in sorted order.
+
+    Returns
+    -------
+    bytes
+    """
+    if compact and isinstance(obj, dict) and any(
+            k in obj for k in METADATA_KEYS):
+        obj = {k: v for k, v in obj.items() if k not in METADATA_KEYS}
+    try:
+        return orjson.dumps(
+            obj,
+            default=_default,
+            option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    except orjson.JSONEncodeError:
+        # A number out of orjson's range, or a type neither handles
+        return simplejson.dumps(
+            obj,
+            default=_plain,
+            encoding=None,
+            separators=(',', ':'),
+            sort_keys=sort_keys).encode()
+
+
+def loads(data):
+    """
+    Return the value encoded in the JSON `data` (bytes or str).
+
+    Numbers are decoded as ints and floats.
+    """
+    return orjson.loads(data)
@@ -0,0 +1,16 @@
+"""
+Configure for pytest.
+
+Runs the tests of the modules shared by the services.  From the
+`shared` directory:
+
+    python -m pytest test
+"""
+
+# Standard libraries
+import os
+import sys
+
+# The modules under test are in the directory above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
@@ -0,0 +1,56 @@
+"""
+Test the JSON encoding of datastore items and responses.
+"""
+
+# Standard libraries
+from decimal import Decimal
+
+# Installed packages
+from boto3.dynamodb.types import Binary
+
+import pytest
+
+# Local modules
+import serialize
+
+
+def test_boto3_types():
+    item = {'music_id': 'm1', 'create_time': Decimal('1612345678'),
+            'rating': Decimal('4.5'), 'tags': {'x'}, 'raw': Binary(b'\x00'),
+            'data': b'\xff', 'none': None, 'ok': True}
+    assert serialize.loads(serialize.dumps(item)) == {
+        'music_id': 'm1', 'create_time': 1612345678, 'rating': 4.5,
+        'tags': ['x'], 'raw': 'AA==', 'data': '/w==', 'none': None,
+        'ok': True}
+
+
+@pytest.mark.parametrize('number', [
+    serialize.INT64_MIN, -1, 0, 2 ** 63 - 1, 2 ** 63, serialize.UINT64_MAX])
+def test_ints_in_orjsons_range(number):
+    assert serialize.UINT64_MAX == 2 ** 64 - 1
+    assert serialize.dumps({'n': Decimal(number)}) == (
+        '{{"n":{}}}'.format(number).encode())
+
+
+@pytest.mark.parametrize('number', [
+    Decimal(serialize.INT64_MIN - 1),
+    Decimal(serialize.UINT64_MAX + 1),
+    Decimal('1' * 38),
+    Decimal('0.1000000000000000000000000001'),
+])
+def test_numbers_beyond_orjson_keep_every_digit(number):
+    assert serialize.dumps({'n': number, 's': 'x'}) == (
+        '{{"n":{},"s":"x"}}'.format(number).encode())
+
+
+def test_compact_and_sorted():
+    response = {'Items': [], 'Count': 0,
+                'ResponseMetadata': {'RequestId': 'r1'}}
+    assert serialize.loads(serialize.dumps(response)) == response
+    assert serialize.dumps(response, compact=True, sort_keys=True) == (
+        b'{"Count":0,"Items":[]}')
+
+
+def test_unknown_type():
+    with pytest.raises(TypeError):
+        serialize.dumps({'when': object()})
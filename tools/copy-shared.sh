@@ -0,0 +1,27 @@
+#!/usr/bin/env bash
+#
+# Copy the modules in `shared/` into the directories of the services
+# that use them
+#
+# Each container image is built from its own directory, so a module
+# used by several services must be in each of their directories.  The
+# copies are ignored by git; edit the module in `shared/` and run this
+# (`make -f k8s-tpl.mak templates` does) to update them.
+#
+# Run from the top-level directory.
+#
+set -o nounset
+set -o errexit
+#
+# copy MODULE DIR...: Copy `shared/MODULE` into each DIR
+#
+function copy () {
+  module=${1}
+  shift
+  for dir in "$@"
+  do
+    cp shared/${module} ${dir}/${module}
+  done
+}
+copy datastore.py s1 s2/v1 s3
+copy serialize.py db s1 s2/v1 s3
@@ -10,6 +10,10 @@ then
   echo "   ReadUserSim"
   echo "   ReadMusicSim"
   echo "   ReadBothVaryingSim"
+  echo "   WriteUserSim, WriteMusicSim, WritePlaylistSim"
+  echo "   MixedUserSim, MixedMusicSim, MixedPlaylistSim, MixedAllSim"
+  echo " The Write and Mixed simulations also read MODEL, PHASES, RATE and"
+  echo " more from the environment; see WriteTables.scala."
   exit 1
 fi
 
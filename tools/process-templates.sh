@@ -45,6 +45,10 @@ fi
 #
 find . -name '*-tpl.*' -exec ./tools/call-sed.sh '{}'  ${vals} \;
 #
-# Step 3: Cleanup
+# Step 4: Copy the modules in `shared/` into the service directories
+#
+./tools/copy-shared.sh
+#
+# Step 5: Cleanup
 #
 /bin/rm -f ./cluster/tpl-nocomments.txt